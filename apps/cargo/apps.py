@@ -4,4 +4,6 @@ from django.apps import AppConfig
 class CargoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.cargo'
-
+    
+    def ready(self):
+        from apps.cargo import signals
@@ -0,0 +1,48 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from apps.cargo.manifest import import_manifest, MANIFEST_CHUNK_SIZE, MANIFEST_FORMATS
+from apps.users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Register the cargo listed in an origin manifest (CSV or JSON lines)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path to the manifest file')
+        parser.add_argument('--format', choices=MANIFEST_FORMATS, help='Manifest format (default: from file extension)')
+        parser.add_argument('--warehouse', type=int, help='Warehouse ID for lines without one')
+        parser.add_argument('--user', help='Username recorded as the creator of the cargo')
+        parser.add_argument('--chunk-size', type=int, default=MANIFEST_CHUNK_SIZE)
+        parser.add_argument('--report', help='Write the import report to this JSON file')
+    
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']} not found")
+        
+        try:
+            with open(path, encoding='utf-8-sig', newline='') as manifest:
+                report = import_manifest(
+                    manifest,
+                    file_format=file_format,
+                    warehouse_id=options['warehouse'],
+                    user=user,
+                    chunk_size=options['chunk_size']
+                )
+        except OSError as e:
+            raise CommandError(str(e))
+        
+        if options['report']:
+            with open(options['report'], 'w') as output:
+                json.dump(report, output, indent=2)
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ {report['created']} of {report['total_lines']} line(s) registered"
+        ))
+        self.stdout.write(f"  Invalid: {report['invalid_count']}")
@@ -0,0 +1,230 @@
+"""
+Cargo manifest import
+Origin agents' manifests (CSV or JSON lines) are read lazily and imported
+`chunk_size` lines at a time: customers and warehouses are resolved with
+one lookup each per chunk, missing CBM is computed from the dimensions in
+one vectorized pass, and the Cargo rows (with their first timeline entry)
+and CargoHistory rows are written with one bulk insert each, so memory
+stays flat however long the file is.
+"""
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from django.db import transaction as db_transaction
+from django.utils import timezone
+from apps.cargo.models import Cargo, CargoHistory, generate_tracking_number
+from apps.cargo.tracking import invalidate_tracking
+from apps.core.utils import iter_lines, unique_numbers
+from apps.customers.models import Customer
+from apps.warehouses.models import Warehouse
+
+try:
+    import numpy as np
+except ImportError:  # Optional: CBM is computed row by row in plain Python
+    np = None
+
+
+MANIFEST_CHUNK_SIZE = 1000
+MANIFEST_FORMATS = ('csv', 'jsonl')
+# Invalid lines listed in the report; the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+MANIFEST_REMARKS = 'Cargo registered from manifest'
+CENT = Decimal('0.01')
+MAX_AMOUNT = Decimal('100000000')  # DecimalField(max_digits=10, decimal_places=2)
+REQUIRED_FIELDS = ('cargo_name', 'origin_location', 'destination_location')
+DIMENSIONS = ('length', 'width', 'height')
+
+
+def _decimal(value, required=False):
+    """Parse a money/measure field, returns (Decimal or None, valid)"""
+    if value is None or str(value).strip() == '':
+        return None, not required
+    try:
+        value = Decimal(str(value).strip()).quantize(CENT)
+    except (InvalidOperation, ValueError):
+        return None, False
+    return value, Decimal(0) <= value < MAX_AMOUNT
+
+
+def _parse_line(row, default_warehouse_id):
+    """Validate a manifest row, returns (parsed dict, error)"""
+    if row is None:
+        return None, 'invalid_line'
+    
+    fields = {field: str(row.get(field) or '').strip() for field in REQUIRED_FIELDS}
+    missing = [field for field, value in fields.items() if not value]
+    if missing:
+        return None, f"missing_{missing[0]}"
+    
+    for field in ('cargo_weight', 'cargo_value', 'cbm') + DIMENSIONS:
+        fields[field], valid = _decimal(row.get(field), required=field in ('cargo_weight', 'cargo_value'))
+        if not valid:
+            return None, f"invalid_{field}"
+    if fields['cargo_weight'] <= 0:
+        return None, 'invalid_cargo_weight'
+    if not fields['cbm'] and not all(fields[dimension] for dimension in DIMENSIONS):
+        return None, 'missing_cbm_or_dimensions'
+    
+    try:
+        fields['customer_id'] = int(row['customer_id']) if row.get('customer_id') else None
+        fields['warehouse_id'] = int(row['warehouse_id']) if row.get('warehouse_id') else default_warehouse_id
+    except (TypeError, ValueError):
+        return None, 'invalid_customer_or_warehouse'
+    fields['customer_phone'] = str(row.get('customer_phone') or '').strip()
+    if not fields['customer_id'] and not fields['customer_phone']:
+        return None, 'missing_customer'
+    if not fields['warehouse_id']:
+        return None, 'missing_warehouse'
+    
+    for field in ('description', 'container_id', 'origin_tracking_number'):
+        fields[field] = str(row.get(field) or '').strip() or None
+    return fields, None
+
+
+def compute_cbm(lengths, widths, heights):
+    """CBM from dimensions, length x width x height / 1000 as in Cargo.save(), rounded to cents"""
+    if np is None:
+        return [
+            Decimal(str(round(float(length) * float(width) * float(height) / 1000, 2)))
+            for length, width, height in zip(lengths, widths, heights)
+        ]
+    
+    volumes = np.round(
+        np.asarray(lengths, dtype=np.float64) * np.asarray(widths, dtype=np.float64)
+        * np.asarray(heights, dtype=np.float64) / 1000, 2
+    )
+    return [Decimal(str(volume)) for volume in volumes.tolist()]
+
+
+def import_manifest(lines, file_format='csv', warehouse_id=None, user=None, chunk_size=MANIFEST_CHUNK_SIZE):
+    """
+    Register the cargo listed in a manifest, one database transaction per
+    chunk. Each line needs cargo_name, origin/destination_location,
+    cargo_weight, cargo_value, customer_id or customer_phone, and cbm or
+    length/width/height; warehouse_id defaults to `warehouse_id`.
+    
+    Returns a report dict with counts plus the invalid lines (at most
+    MAX_REPORTED_ERRORS are listed; created cargo is only counted).
+    """
+    report = {
+        'total_lines': 0,
+        'created': 0,
+        'invalid_count': 0,
+        'invalid': [],
+    }
+    
+    manifest = iter_lines(lines, file_format)
+    while True:
+        chunk = list(islice(manifest, chunk_size))
+        if not chunk:
+            break
+        report['total_lines'] += len(chunk)
+        _import_chunk(chunk, warehouse_id, user, report)
+    
+    return report
+
+
+def _report_invalid(report, line_number, reason):
+    report['invalid_count'] += 1
+    if len(report['invalid']) < MAX_REPORTED_ERRORS:
+        report['invalid'].append({'line': line_number, 'reason': reason})
+
+
+def _import_chunk(chunk, default_warehouse_id, user, report):
+    parsed = []
+    for line_number, row in chunk:
+        line, error = _parse_line(row, default_warehouse_id)
+        if error:
+            _report_invalid(report, line_number, error)
+        else:
+            parsed.append((line_number, line))
+    if not parsed:
+        return
+    
+    customers = set(
+        Customer.objects.filter(
+            customer_id__in={line['customer_id'] for _, line in parsed if line['customer_id']}
+        ).values_list('customer_id', flat=True)
+    )
+    # Phone number -> customer_id, None when several customers share the number
+    phones = {}
+    for customer_id, phone_number in Customer.objects.filter(
+        phone_number__in={line['customer_phone'] for _, line in parsed if not line['customer_id']}
+    ).values_list('customer_id', 'phone_number'):
+        phones[phone_number] = None if phone_number in phones else customer_id
+    warehouses = set(
+        Warehouse.objects.filter(
+            warehouse_id__in={line['warehouse_id'] for _, line in parsed}
+        ).values_list('warehouse_id', flat=True)
+    )
+    
+    valid = []
+    for line_number, line in parsed:
+        error = None
+        if line['customer_id'] is not None:
+            if line['customer_id'] not in customers:
+                error = 'unknown_customer'
+        elif line['customer_phone'] not in phones:
+            error = 'unknown_customer'
+        elif phones[line['customer_phone']] is None:
+            error = 'ambiguous_customer_phone'
+        else:
+            line['customer_id'] = phones[line['customer_phone']]
+        if not error and line['warehouse_id'] not in warehouses:
+            error = 'unknown_warehouse'
+        
+        if error:
+            _report_invalid(report, line_number, error)
+        else:
+            valid.append(line)
+    if not valid:
+        return
+    
+    missing_cbm = [line for line in valid if not line['cbm']]
+    if missing_cbm:
+        volumes = compute_cbm(*([line[dimension] for line in missing_cbm] for dimension in DIMENSIONS))
+        for line, cbm in zip(missing_cbm, volumes):
+            line['cbm'] = cbm
+    
+    registered = {
+        'status': 'pending',
+        'timestamp': timezone.now().isoformat(),
+        'remarks': MANIFEST_REMARKS
+    }
+    with db_transaction.atomic():
+        tracking_numbers = unique_numbers(len(valid), generate_tracking_number, Cargo.objects, 'tracking_number')
+        cargo = Cargo.objects.bulk_create([
+            Cargo(
+                customer_id=line['customer_id'],
+                warehouse_id=line['warehouse_id'],
+                tracking_number=tracking_number,
+                cargo_name=line['cargo_name'],
+                description=line['description'],
+                origin_location=line['origin_location'],
+                destination_location=line['destination_location'],
+                cargo_weight=line['cargo_weight'],
+                cargo_value=line['cargo_value'],
+                container_id=line['container_id'],
+                origin_tracking_number=line['origin_tracking_number'],
+                cbm=line['cbm'],
+                length=line['length'],
+                width=line['width'],
+                height=line['height'],
+                status='pending',
+                timeline=[registered],
+                created_by=user
+            )
+            for line, tracking_number in zip(valid, tracking_numbers)
+        ])
+        CargoHistory.objects.bulk_create([
+            CargoHistory(
+                cargo=item,
+                previous_status=None,
+                new_status='pending',
+                updated_by=user,
+                remarks=MANIFEST_REMARKS
+            )
+            for item in cargo
+        ])
+        invalidate_tracking(tracking_numbers)
+    
+    report['created'] += len(cargo)
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargo', '0002_initial'),
+        ('customers', '0001_initial'),
+        ('warehouses', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cargo',
+            index=models.Index(fields=['-created_at'], name='cargo_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cargo',
+            index=models.Index(fields=['status', '-created_at'], name='cargo_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cargo',
+            index=models.Index(fields=['warehouse', '-created_at'], name='cargo_warehouse_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cargo',
+            index=models.Index(fields=['customer', '-created_at'], name='cargo_customer_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cargohistory',
+            index=models.Index(fields=['cargo', 'updated_at'], name='cargo_history_cargo_upd_idx'),
+        ),
+    ]
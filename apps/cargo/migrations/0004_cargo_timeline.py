@@ -0,0 +1,44 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:46
+
+from django.db import migrations, models
+
+
+def backfill_timelines(apps, schema_editor):
+    """Build every cargo's timeline from its CargoHistory, oldest first"""
+    Cargo = apps.get_model('cargo', 'Cargo')
+    CargoHistory = apps.get_model('cargo', 'CargoHistory')
+    history = CargoHistory.objects.order_by('cargo_id', 'updated_at', 'history_id').values_list(
+        'cargo_id', 'new_status', 'updated_at', 'remarks'
+    )
+    
+    changed = []
+    current = None
+    for cargo_id, new_status, updated_at, remarks in history.iterator(chunk_size=2000):
+        if current is None or current.cargo_id != cargo_id:
+            if len(changed) >= 1000:
+                Cargo.objects.bulk_update(changed, ['timeline'])
+                changed = []
+            current = Cargo(cargo_id=cargo_id, timeline=[])
+            changed.append(current)
+        current.timeline.append({
+            'status': new_status,
+            'timestamp': updated_at.isoformat(),
+            'remarks': remarks
+        })
+    Cargo.objects.bulk_update(changed, ['timeline'])
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('cargo', '0003_list_view_indexes'),
+    ]
+    
+    operations = [
+        migrations.AddField(
+            model_name='cargo',
+            name='timeline',
+            field=models.JSONField(blank=True, default=list, help_text='CargoHistory as (status, timestamp, remarks) entries, oldest first'),
+        ),
+        migrations.RunPython(backfill_timelines, migrations.RunPython.noop),
+    ]
@@ -32,13 +32,28 @@ class Cargo(TimestampedModel):
         ('delivered', 'Delivered'),
     ], default='pending')
     created_by = models.ForeignKey('users.User', on_delete=models.SET_NULL, null=True, related_name='created_cargo')
+    timeline = models.JSONField(default=list, blank=True, help_text="CargoHistory as (status, timestamp, remarks) entries, oldest first")
+    
+    # Status changes allowed from each status: pending -> in_transit -> arrived -> delivered
+    STATUS_TRANSITIONS = {
+        'pending': ('in_transit',),
+        'in_transit': ('arrived',),
+        'arrived': ('delivered',),
+        'delivered': (),
+    }
     
     class Meta:
         db_table = 'cargo'
         verbose_name = 'Cargo'
         verbose_name_plural = 'Cargo'
         ordering = ['-created_at']
-        
+        indexes = [
+            models.Index(fields=['-created_at'], name='cargo_created_idx'),
+            models.Index(fields=['status', '-created_at'], name='cargo_status_created_idx'),
+            models.Index(fields=['warehouse', '-created_at'], name='cargo_warehouse_created_idx'),
+            models.Index(fields=['customer', '-created_at'], name='cargo_customer_created_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.tracking_number} - {self.cargo_name}"
     
@@ -63,7 +78,18 @@ class CargoHistory(TimestampedModel):
         verbose_name = 'Cargo History'
         verbose_name_plural = 'Cargo History'
         ordering = ['-updated_at']
-        
+        indexes = [
+            models.Index(fields=['cargo', 'updated_at'], name='cargo_history_cargo_upd_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.cargo.tracking_number} - {self.previous_status} -> {self.new_status}"
+    
+    def timeline_entry(self):
+        """Entry for Cargo.timeline"""
+        return {
+            'status': self.new_status,
+            'timestamp': self.updated_at.isoformat(),
+            'remarks': self.remarks
+        }
 
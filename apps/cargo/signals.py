@@ -0,0 +1,16 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from apps.cargo.models import Cargo, CargoHistory
+from apps.cargo.tracking import invalidate_cargo_tracking, invalidate_tracking
+
+
+@receiver([post_save, post_delete], sender=Cargo)
+def cargo_changed(sender, instance, **kwargs):
+    """A new cargo replaces a cached 'not found', a saved one its old document"""
+    invalidate_tracking([instance.tracking_number])
+
+
+@receiver(post_save, sender=CargoHistory)
+def cargo_history_created(sender, instance, created, **kwargs):
+    if created:
+        invalidate_cargo_tracking([instance.cargo_id])
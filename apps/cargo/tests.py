@@ -0,0 +1,385 @@
+"""
+Cargo tests
+"""
+import json
+from decimal import Decimal
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from apps.cargo.manifest import MANIFEST_REMARKS, import_manifest
+from apps.cargo.models import Cargo, CargoHistory
+from apps.cargo.utils import bulk_update_status, transition_status
+from apps.core.testing import QueryCountMixin, QueryPlanMixin, create_cargo, create_customer, create_user
+from apps.invoices.models import Invoice
+from apps.warehouses.models import Warehouse
+
+
+class CargoListIndexTests(QueryPlanMixin, TestCase):
+    """Every filter of the cargo list, and the cargo history, is served from an index"""
+    
+    def setUp(self):
+        self.customer = create_customer()
+        self.cargo = create_cargo(self.customer)
+        CargoHistory.objects.create(cargo=self.cargo, new_status='pending')
+        self.client = APIClient()
+        self.client.force_authenticate(create_user(self.customer.organization))
+    
+    def test_cargo_list(self):
+        self.assertUsesIndex('/api/cargo/', 'cargo', 'cargo_created_idx')
+    
+    def test_cargo_list_by_status(self):
+        self.assertUsesIndex('/api/cargo/?status=pending', 'cargo', 'cargo_status_created_idx')
+    
+    def test_cargo_list_by_warehouse(self):
+        self.assertUsesIndex(f'/api/cargo/?warehouse_id={self.cargo.warehouse_id}', 'cargo', 'cargo_warehouse_created_idx')
+    
+    def test_cargo_list_by_customer(self):
+        self.assertUsesIndex(f'/api/cargo/?customer_id={self.customer.customer_id}', 'cargo', 'cargo_customer_created_idx')
+    
+    def test_cargo_history(self):
+        self.assertUsesIndex(f'/api/cargo/{self.cargo.cargo_id}/history/', 'cargo_history', 'cargo_history_cargo_upd_idx')
+
+
+class CargoQueryCountTests(QueryCountMixin, TestCase):
+    """Cargo endpoints load the related rows they serialize in their own queries"""
+    
+    def setUp(self):
+        self.customer = create_customer()
+        self.user = create_user(self.customer.organization)
+        self.cargo = create_cargo(self.customer, created_by=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def test_cargo_list(self):
+        self.assertConstantQueries(
+            '/api/cargo/',
+            lambda: [create_cargo(create_customer(), created_by=self.user) for _ in range(5)],
+            expected=2
+        )
+    
+    def test_cargo_history(self):
+        def add_history():
+            for index in range(5):
+                user = create_user(self.customer.organization, username=f'clerk{index}')
+                CargoHistory.objects.create(cargo=self.cargo, new_status='in_transit', updated_by=user)
+        
+        CargoHistory.objects.create(cargo=self.cargo, new_status='pending', updated_by=self.user)
+        self.assertConstantQueries(f'/api/cargo/{self.cargo.cargo_id}/history/', add_history)
+    
+    def test_cargo_detail(self):
+        self.assertEqual(self.count_queries(f'/api/cargo/{self.cargo.cargo_id}/'), 1)
+
+
+class BulkUpdateStatusTests(TestCase):
+    """A container moves in one batch, and moving it again changes nothing"""
+    
+    def setUp(self):
+        self.customer = create_customer()
+        self.first = create_cargo(self.customer, container_id='CONT-1', status='in_transit')
+        self.warehouse = self.first.warehouse
+        self.container = [self.first] + [
+            create_cargo(self.customer, self.warehouse, container_id='CONT-1', status='in_transit') for _ in range(2)
+        ]
+    
+    def test_repeated_container_arrival(self):
+        result = bulk_update_status('arrived', container_id='CONT-1')
+        self.assertEqual(sorted(result['updated']), sorted(cargo.cargo_id for cargo in self.container))
+        self.assertEqual(result['invoices_created'], 3)
+        
+        result = bulk_update_status('arrived', container_id='CONT-1')
+        self.assertEqual((result['updated'], result['invoices_created']), ([], 0))
+        self.assertEqual(set(result['skipped'].values()), {'already_arrived'})
+        
+        for cargo in self.container:
+            self.assertEqual(Invoice.objects.filter(cargo=cargo).count(), 1)
+            self.assertEqual(CargoHistory.objects.filter(cargo=cargo, new_status='arrived').count(), 1)
+            self.assertEqual(len(Cargo.objects.get(pk=cargo.pk).timeline), 1)
+    
+    def test_skipped_cargo(self):
+        pending = create_cargo(self.customer, self.warehouse)
+        result = bulk_update_status('arrived', cargo_ids=[pending.cargo_id, 0], container_id='CONT-1')
+        
+        self.assertEqual(len(result['updated']), 3)
+        self.assertEqual(result['skipped'], {pending.cargo_id: 'invalid_transition_from_pending', 0: 'not_found'})
+        self.assertEqual(Cargo.objects.get(pk=pending.pk).status, 'pending')
+    
+    def test_queries_do_not_grow_with_the_container(self):
+        for _ in range(10):
+            create_cargo(self.customer, self.warehouse, container_id='CONT-2', status='in_transit')
+        
+        with CaptureQueriesContext(connection) as small:
+            bulk_update_status('arrived', container_id='CONT-1')
+        with CaptureQueriesContext(connection) as large:
+            bulk_update_status('arrived', container_id='CONT-2')
+        self.assertEqual(len(large), len(small))
+
+
+class TransitionStatusTests(TestCase):
+    """transition_status() moves a cargo one allowed step, and only while it is still in the expected status"""
+    
+    def setUp(self):
+        self.cargo = create_cargo(create_customer(), status='in_transit')
+    
+    def test_rejected_transition(self):
+        for expected_status, new_status in (('in_transit', 'delivered'), ('in_transit', 'pending'), ('delivered', 'arrived')):
+            with self.assertRaisesMessage(ValueError, f'Cannot change cargo status from {expected_status} to {new_status}'):
+                transition_status(self.cargo.cargo_id, expected_status, new_status)
+        
+        self.assertEqual(Cargo.objects.get(pk=self.cargo.pk).status, 'in_transit')
+        self.assertFalse(CargoHistory.objects.exists())
+    
+    def test_lost_compare_and_set_has_no_side_effects(self):
+        self.assertEqual(transition_status(self.cargo.cargo_id, 'pending', 'in_transit'), 0)
+        
+        cargo = Cargo.objects.get(pk=self.cargo.pk)
+        self.assertEqual((cargo.status, cargo.timeline), ('in_transit', []))
+        self.assertFalse(CargoHistory.objects.exists())
+    
+    def test_arrival_is_invoiced_once(self):
+        self.assertEqual(transition_status(self.cargo.cargo_id, 'in_transit', 'arrived', remarks='At the warehouse'), 1)
+        self.assertEqual(transition_status(self.cargo.cargo_id, 'in_transit', 'arrived'), 0)
+        
+        invoice = Invoice.objects.get(cargo=self.cargo)
+        self.assertEqual(invoice.amount, (self.cargo.cargo_value * Decimal('0.30')).quantize(Decimal('0.01')))
+        history = CargoHistory.objects.get(cargo=self.cargo)
+        self.assertEqual((history.previous_status, history.new_status, history.remarks), ('in_transit', 'arrived', 'At the warehouse'))
+        self.assertEqual(len(Cargo.objects.get(pk=self.cargo.pk).timeline), 1)
+
+
+class ManifestImportTests(TestCase):
+    """Manifests register valid lines in bulk and report every invalid one"""
+    
+    header = 'cargo_name,origin_location,destination_location,cargo_weight,cargo_value,customer_id,customer_phone,cbm,length,width,height'
+    
+    def setUp(self):
+        self.customer = create_customer()
+        self.warehouse = Warehouse.objects.create(
+            warehouse_name='Manifest Warehouse', location='Dar es Salaam', organization=self.customer.organization, capacity=100
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(create_user(self.customer.organization))
+    
+    def line(self, **fields):
+        return {
+            'cargo_name': 'Spare parts', 'origin_location': 'Guangzhou', 'destination_location': 'Dar es Salaam',
+            'cargo_weight': '12.5', 'cargo_value': '900', 'customer_id': self.customer.customer_id, 'cbm': '1.2',
+            **fields
+        }
+    
+    def csv_lines(self, *lines):
+        columns = self.header.split(',')
+        return [self.header] + [','.join(str(line.get(column, '')) for column in columns) for line in lines]
+    
+    def upload(self, name, content, **data):
+        manifest = SimpleUploadedFile(name, '\n'.join(content).encode())
+        response = self.client.post('/api/cargo/import/', {'file': manifest, **data}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        return response.data['data']
+    
+    def test_csv_manifest(self):
+        report = self.upload('manifest.csv', self.csv_lines(
+            self.line(),
+            self.line(customer_id='', customer_phone=self.customer.phone_number, cbm='', length='100', width='50', height='40'),
+        ), warehouse_id=self.warehouse.warehouse_id)
+        
+        self.assertEqual(report, {'total_lines': 2, 'created': 2, 'invalid_count': 0, 'invalid': []})
+        cargo = list(Cargo.objects.order_by('cargo_id'))
+        self.assertEqual([item.cbm for item in cargo], [Decimal('1.20'), Decimal('200.00')])
+        self.assertEqual({item.customer_id for item in cargo}, {self.customer.customer_id})
+        self.assertEqual({item.warehouse_id for item in cargo}, {self.warehouse.warehouse_id})
+        self.assertEqual(len({item.tracking_number for item in cargo}), 2)
+        for item in cargo:
+            self.assertEqual((item.status, item.timeline[0]['remarks']), ('pending', MANIFEST_REMARKS))
+        self.assertEqual(
+            list(CargoHistory.objects.order_by('cargo_id').values_list('cargo_id', 'previous_status', 'new_status')),
+            [(item.cargo_id, None, 'pending') for item in cargo]
+        )
+    
+    def test_json_lines_manifest(self):
+        report = self.upload('manifest.jsonl', [
+            json.dumps(self.line(warehouse_id=self.warehouse.warehouse_id)),
+            '',
+            '[1, 2]',
+            '{not json',
+            json.dumps(self.line(cargo_name='Tyres', warehouse_id=self.warehouse.warehouse_id)),
+        ])
+        
+        self.assertEqual((report['total_lines'], report['created']), (4, 2))
+        self.assertEqual(report['invalid'], [
+            {'line': 3, 'reason': 'invalid_line'},
+            {'line': 4, 'reason': 'invalid_line'},
+        ])
+        self.assertEqual(sorted(Cargo.objects.values_list('cargo_name', flat=True)), ['Spare parts', 'Tyres'])
+    
+    def test_invalid_lines_are_reported(self):
+        create_customer(self.customer.organization)  # Shares the phone number of self.customer
+        lines = [
+            self.line(cargo_name=''),
+            self.line(cargo_weight='0'),
+            self.line(cargo_value='abc'),
+            self.line(cbm=''),
+            self.line(customer_id=''),
+            self.line(customer_id='x'),
+            self.line(customer_id=999999),
+            self.line(customer_id='', customer_phone=self.customer.phone_number),
+            self.line(customer_id='', customer_phone='255799999999'),
+            self.line(),
+        ]
+        
+        report = import_manifest(self.csv_lines(*lines), warehouse_id=999999)
+        
+        self.assertEqual((report['total_lines'], report['created'], report['invalid_count']), (10, 0, 10))
+        self.assertEqual([error['reason'] for error in report['invalid']], [
+            'missing_cargo_name',
+            'invalid_cargo_weight',
+            'invalid_cargo_value',
+            'missing_cbm_or_dimensions',
+            'missing_customer',
+            'invalid_customer_or_warehouse',
+            'unknown_customer',
+            'ambiguous_customer_phone',
+            'unknown_customer',
+            'unknown_warehouse',
+        ])
+        self.assertEqual(report['invalid'][0]['line'], 2)
+        self.assertFalse(Cargo.objects.exists())
+        self.assertFalse(CargoHistory.objects.exists())
+    
+    def test_queries_do_not_grow_with_the_chunk(self):
+        def count_queries(count):
+            lines = self.csv_lines(*[self.line(cargo_name=f'Crate {i}') for i in range(count)])
+            with CaptureQueriesContext(connection) as queries:
+                report = import_manifest(lines, warehouse_id=self.warehouse.warehouse_id)
+            self.assertEqual(report['created'], count)
+            return len(queries)
+        
+        self.assertEqual(count_queries(2), count_queries(20))
+        self.assertEqual(CargoHistory.objects.count(), 22)
+    
+    def test_chunks(self):
+        lines = self.csv_lines(*[self.line(cargo_name=f'Crate {i}') for i in range(5)] + [self.line(cargo_weight='')])
+        
+        report = import_manifest(lines, warehouse_id=self.warehouse.warehouse_id, chunk_size=2)
+        
+        self.assertEqual((report['total_lines'], report['created']), (6, 5))
+        self.assertEqual(report['invalid'], [{'line': 7, 'reason': 'invalid_cargo_weight'}])
+        self.assertEqual(CargoHistory.objects.filter(new_status='pending').count(), 5)
+
+
+class PublicTrackingTests(TestCase):
+    """Tracking documents are cached, answer conditional GETs and are dropped when the cargo changes"""
+    
+    def setUp(self):
+        cache.clear()
+        self.cargo = create_cargo(create_customer())
+        self.url = f'/api/cargo/track/{self.cargo.tracking_number}/'
+        self.client = APIClient()
+    
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['tracking_number'], self.cargo.tracking_number)
+        etag = response['ETag']
+        
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+            cached = self.client.get(self.url, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(cached.status_code, 200)
+        self.assertEqual(cached['ETag'], etag)
+    
+    def test_status_change_invalidates(self):
+        etag = self.client.get(self.url)['ETag']
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            transition_status(self.cargo.cargo_id, 'pending', 'in_transit')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['data']['status'], 'in_transit')
+        self.assertEqual(response.data['data']['timeline'][-1]['status'], 'in_transit')
+    
+    def test_bulk_status_change_invalidates(self):
+        etag = self.client.get(self.url)['ETag']
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_update_status('in_transit', cargo_ids=[self.cargo.cargo_id])
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['status'], 'in_transit')
+    
+    @override_settings(TRACKING_NOT_FOUND_TTL=60)
+    def test_unknown_tracking_number_is_cached(self):
+        url = '/api/cargo/track/TRK-UNKNOWN/'
+        self.assertEqual(self.client.get(url).status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 404)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            create_cargo(self.cargo.customer, self.cargo.warehouse, tracking_number='TRK-UNKNOWN')
+        self.assertEqual(self.client.get(url).status_code, 200)
+    
+    @override_settings(TRACKING_NOT_FOUND_TTL=0)
+    def test_unknown_tracking_number_without_negative_cache(self):
+        url = '/api/cargo/track/TRK-UNKNOWN/'
+        self.assertEqual(self.client.get(url).status_code, 404)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).status_code, 404)
+    
+    def test_overlong_tracking_number(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(f"/api/cargo/track/{'X' * 51}/").status_code, 404)
+
+
+class CargoTimelineTests(TestCase):
+    """The timeline stored on the cargo row lists the same entries as its CargoHistory"""
+    
+    def setUp(self):
+        self.customer = create_customer()
+        self.warehouse = create_cargo(self.customer).warehouse
+        self.client = APIClient()
+        self.client.force_authenticate(create_user(self.customer.organization))
+    
+    def register(self):
+        return create_cargo(self.customer, self.warehouse, container_id='CONT-9').cargo_id
+    
+    def assertTimelineInSync(self, cargo_id, statuses):
+        history = CargoHistory.objects.filter(cargo_id=cargo_id).order_by('updated_at', 'pk')
+        timeline = Cargo.objects.get(pk=cargo_id).timeline
+        self.assertEqual(timeline, [row.timeline_entry() for row in history])
+        self.assertEqual([entry['status'] for entry in timeline], statuses)
+        
+        response = self.client.get(f'/api/cargo/{cargo_id}/history/?view=timeline')
+        self.assertEqual(response.data['timeline'], timeline[::-1])
+    
+    def test_single_transitions(self):
+        cargo_id = self.register()
+        self.assertTimelineInSync(cargo_id, [])
+        
+        for new_status in ('in_transit', 'arrived', 'delivered'):
+            response = self.client.patch(
+                f'/api/cargo/{cargo_id}/status/', {'status': new_status, 'remarks': f'Now {new_status}'}, format='json'
+            )
+            self.assertEqual(response.status_code, 200, response.data)
+        
+        self.assertTimelineInSync(cargo_id, ['in_transit', 'arrived', 'delivered'])
+        self.assertEqual(Cargo.objects.get(pk=cargo_id).timeline[-1]['remarks'], 'Now delivered')
+    
+    def test_bulk_transitions(self):
+        cargo_ids = [self.register() for _ in range(3)]
+        
+        for new_status in ('in_transit', 'arrived', 'arrived'):
+            response = self.client.post(
+                '/api/cargo/status/bulk/', {'container_id': 'CONT-9', 'status': new_status}, format='json'
+            )
+            self.assertEqual(response.status_code, 200, response.data)
+        bulk_update_status('delivered', cargo_ids=cargo_ids[:1])
+        
+        self.assertTimelineInSync(cargo_ids[0], ['in_transit', 'arrived', 'delivered'])
+        for cargo_id in cargo_ids[1:]:
+            self.assertTimelineInSync(cargo_id, ['in_transit', 'arrived'])
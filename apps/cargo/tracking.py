@@ -0,0 +1,97 @@
+"""
+Public tracking cache
+The public tracking document of a cargo is rendered once and kept in the
+cache under its tracking number, with an ETag (hash of the document) and
+a Last-Modified time for conditional GETs. Unknown tracking numbers are
+cached too, for a shorter time, so repeated guesses do not reach the
+database. Entries are deleted once the transaction that changes a cargo or
+inserts its CargoHistory commits: single saves through the signal receivers
+in apps/cargo/signals.py, bulk inserts and updates by calling
+invalidate_tracking() directly. Other fields shown in the document
+(customer and warehouse names) are refreshed when the entry expires.
+
+Invalidation reaches every worker only through a shared cache (CACHES in
+settings, Redis by default). With the per-process memory cache a change is
+only seen by the worker that made it; the others serve the old document
+for up to TRACKING_CACHE_TTL, and unknown numbers are not cached
+(TRACKING_NOT_FOUND_TTL = 0).
+"""
+import hashlib
+import json
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction as db_transaction
+from apps.cargo.models import Cargo
+from apps.cargo.serializers import CargoSerializer
+
+
+NOT_FOUND = 'not_found'
+MAX_TRACKING_NUMBER_LENGTH = Cargo._meta.get_field('tracking_number').max_length
+
+
+def get_tracking_ttl():
+    """Seconds a tracking document is cached"""
+    return getattr(settings, 'TRACKING_CACHE_TTL', 5 * 60)
+
+
+def get_tracking_not_found_ttl():
+    """Seconds an unknown tracking number is cached, 0 to not cache them"""
+    return getattr(settings, 'TRACKING_NOT_FOUND_TTL', 60)
+
+
+def _cache_key(tracking_number):
+    digest = hashlib.sha256(tracking_number.encode()).hexdigest()
+    return f"tracking:{digest}"
+
+
+def render_tracking(cargo):
+    """
+    Public tracking document of a cargo: its details, the timeline stored on
+    the cargo row and the current location
+    Returns: (data, etag, last_modified timestamp)
+    """
+    data = dict(CargoSerializer(cargo).data)
+    data['timeline'] = cargo.timeline
+    data['current_location'] = cargo.destination_location if cargo.status == 'arrived' else cargo.origin_location
+    
+    payload = json.dumps(data, sort_keys=True, default=str)
+    etag = f'"{hashlib.sha256(payload.encode()).hexdigest()[:32]}"'
+    return data, etag, int(cargo.updated_at.timestamp())
+
+
+def get_tracking(tracking_number):
+    """
+    Cached tracking document for a tracking number
+    Returns: (data, etag, last_modified timestamp), or None if no cargo has that number
+    """
+    if len(tracking_number) > MAX_TRACKING_NUMBER_LENGTH:
+        return None
+    
+    key = _cache_key(tracking_number)
+    cached = cache.get(key)
+    if cached is not None:
+        return None if cached == NOT_FOUND else cached
+    
+    try:
+        cargo = Cargo.objects.select_related('customer', 'warehouse', 'created_by').get(tracking_number=tracking_number)
+    except Cargo.DoesNotExist:
+        not_found_ttl = get_tracking_not_found_ttl()
+        if not_found_ttl > 0:
+            cache.set(key, NOT_FOUND, not_found_ttl)
+        return None
+    
+    document = render_tracking(cargo)
+    cache.set(key, document, get_tracking_ttl())
+    return document
+
+
+def invalidate_tracking(tracking_numbers):
+    """Drop the cached documents once the current transaction commits"""
+    keys = [_cache_key(tracking_number) for tracking_number in tracking_numbers]
+    if keys:
+        db_transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_cargo_tracking(cargo_ids):
+    """invalidate_tracking() for cargo given by ID"""
+    invalidate_tracking(Cargo.objects.filter(cargo_id__in=cargo_ids).values_list('tracking_number', flat=True))
@@ -5,6 +5,8 @@ app_name = 'cargo'
 
 urlpatterns = [
     path('', views.cargo_list_create, name='list-create'),
+    path('import/', views.cargo_import_manifest, name='import-manifest'),
+    path('status/bulk/', views.cargo_bulk_update_status, name='bulk-update-status'),
     path('<int:pk>/', views.cargo_detail, name='detail'),
     path('<int:pk>/status/', views.cargo_update_status, name='update-status'),
     path('<int:pk>/history/', views.cargo_history, name='history'),
@@ -0,0 +1,221 @@
+"""
+Cargo status changes
+Status changes follow Cargo.STATUS_TRANSITIONS. A single cargo is moved
+with a compare-and-set UPDATE ... WHERE status = <expected>, so of two
+concurrent updates only one wins and the other sees 0 rows updated; the
+history row and the side effects of the transition (invoicing on arrival)
+are only written by the winner.
+
+A whole container (or a list of cargo) is moved in one database
+transaction: the cargo rows are locked and updated with one UPDATE, and
+their CargoHistory rows and, on arrival, their invoices are written with
+one bulk INSERT each. Auto-payments are settled with one batch per
+customer wallet once the outermost transaction commits, so settlement
+never runs inside (or is rolled back with) the caller's transaction.
+
+Every CargoHistory row is also appended to Cargo.timeline in the same
+transaction, so public tracking reads the timeline from the cargo row.
+"""
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.utils import timezone
+from apps.cargo.models import Cargo, CargoHistory
+from apps.cargo.tracking import invalidate_cargo_tracking
+from apps.core.utils import unique_numbers
+
+
+# Arrival invoice: 30% of the cargo value, due a week after arrival
+ARRIVAL_INVOICE_RATE = Decimal('0.30')
+ARRIVAL_INVOICE_DUE_DAYS = 7
+CENT = Decimal('0.01')
+TIMELINE_BATCH_SIZE = 1000
+
+
+def arrival_invoice_amount(cargo_value):
+    return (cargo_value * ARRIVAL_INVOICE_RATE).quantize(CENT)
+
+
+def is_valid_transition(from_status, to_status):
+    return to_status in Cargo.STATUS_TRANSITIONS.get(from_status, ())
+
+
+def transition_status(cargo_id, expected_status, new_status, user=None, remarks=''):
+    """
+    Move a cargo from `expected_status` to `new_status` if it is still in
+    `expected_status`. The history row and, on arrival, the invoice are
+    written in the same transaction as the status change, and the invoice
+    is auto-paid once the outermost transaction commits.
+    
+    Returns: the number of cargo updated (0 if the status has changed meanwhile)
+    Raises: ValueError if the transition is not allowed
+    """
+    if not is_valid_transition(expected_status, new_status):
+        raise ValueError(f"Cannot change cargo status from {expected_status} to {new_status}")
+    
+    with db_transaction.atomic():
+        updated = Cargo.objects.filter(cargo_id=cargo_id, status=expected_status).update(
+            status=new_status, updated_at=timezone.now()
+        )
+        if not updated:
+            return 0
+        
+        history = CargoHistory.objects.create(
+            cargo_id=cargo_id,
+            previous_status=expected_status,
+            new_status=new_status,
+            updated_by=user,
+            remarks=remarks
+        )
+        append_timeline([history])
+        
+        invoices = []
+        if new_status == 'arrived':
+            invoices = _invoice_arrivals(
+                Cargo.objects.filter(cargo_id=cargo_id).values_list('cargo_id', 'cargo_value', 'customer_id'), user
+            )
+    
+    if invoices:
+        _auto_pay_on_commit(invoices, user)
+    return updated
+
+
+def append_timeline(history):
+    """
+    Append new CargoHistory rows to the timeline of their cargo, with one
+    read and one bulk update. Called in the transaction that inserts them,
+    with the cargo rows locked (or just created).
+    """
+    entries = {}
+    for row in history:
+        entries.setdefault(row.cargo_id, []).append(row.timeline_entry())
+    
+    cargo = list(Cargo.objects.filter(cargo_id__in=entries).only('cargo_id', 'timeline'))
+    for item in cargo:
+        item.timeline = item.timeline + entries[item.cargo_id]
+    Cargo.objects.bulk_update(cargo, ['timeline'], batch_size=TIMELINE_BATCH_SIZE)
+
+
+def _invoice_arrivals(cargo, user):
+    """
+    Invoice arrived cargo, given as (cargo_id, cargo_value, customer_id) rows
+    Returns: list of (invoice, customer_id)
+    """
+    from apps.invoices.models import Invoice, generate_control_number
+    
+    cargo = list(cargo)
+    control_numbers = unique_numbers(len(cargo), generate_control_number, Invoice.objects, 'control_number')
+    due_date = timezone.localdate() + timedelta(days=ARRIVAL_INVOICE_DUE_DAYS)
+    invoices = Invoice.objects.bulk_create([
+        Invoice(
+            cargo_id=cargo_id,
+            control_number=control_number,
+            amount=arrival_invoice_amount(cargo_value),
+            currency=settings.BASE_CURRENCY,
+            due_date=due_date,
+            status='pending',
+            created_by=user
+        )
+        for (cargo_id, cargo_value, _), control_number in zip(cargo, control_numbers)
+    ])
+    return [(invoice, customer_id) for invoice, (_, _, customer_id) in zip(invoices, cargo)]
+
+
+def bulk_update_status(new_status, user=None, cargo_ids=None, container_id=None, remarks=''):
+    """
+    Move the cargo in `cargo_ids` and/or container `container_id` to
+    `new_status`. Cargo already in that status, or that cannot move to it,
+    is skipped, so repeating a call changes nothing and creates no second
+    invoice. Arrived cargo is invoiced, and the invoices of customers with
+    auto-payment enabled are paid from their wallets as far as each balance
+    goes.
+    
+    Returns: dict with `updated` (cargo IDs), `skipped` (cargo_id -> reason),
+    `invoices_created` and `auto_paid` (number of invoices paid, None if
+    settlement waits for the caller's transaction to commit)
+    """
+    cargo = Cargo.objects.none()
+    if cargo_ids:
+        cargo = cargo | Cargo.objects.filter(cargo_id__in=cargo_ids)
+    if container_id:
+        cargo = cargo | Cargo.objects.filter(container_id=container_id)
+    
+    now = timezone.now()
+    with db_transaction.atomic():
+        rows = list(
+            cargo.select_for_update().order_by('cargo_id').values_list('cargo_id', 'status', 'cargo_value', 'customer_id')
+        )
+        found = {cargo_id for cargo_id, _, _, _ in rows}
+        skipped = {cargo_id: 'not_found' for cargo_id in cargo_ids or () if cargo_id not in found}
+        for cargo_id, status, _, _ in rows:
+            if status == new_status:
+                skipped[cargo_id] = f'already_{status}'
+            elif not is_valid_transition(status, new_status):
+                skipped[cargo_id] = f'invalid_transition_from_{status}'
+        rows = [row for row in rows if row[0] not in skipped]
+        
+        updated = [cargo_id for cargo_id, _, _, _ in rows]
+        if not updated:
+            return {'updated': [], 'skipped': skipped, 'invoices_created': 0, 'auto_paid': 0}
+        
+        Cargo.objects.filter(cargo_id__in=updated).update(status=new_status, updated_at=now)
+        invalidate_cargo_tracking(updated)
+        history = CargoHistory.objects.bulk_create([
+            CargoHistory(
+                cargo_id=cargo_id,
+                previous_status=previous_status,
+                new_status=new_status,
+                updated_by=user,
+                remarks=remarks
+            )
+            for cargo_id, previous_status, _, _ in rows
+        ])
+        append_timeline(history)
+        
+        invoices = []
+        if new_status == 'arrived':
+            invoices = _invoice_arrivals(
+                ((cargo_id, cargo_value, customer_id) for cargo_id, _, cargo_value, customer_id in rows), user
+            )
+    
+    return {
+        'updated': updated,
+        'skipped': skipped,
+        'invoices_created': len(invoices),
+        'auto_paid': _auto_pay_on_commit(invoices, user) if invoices else 0,
+    }
+
+
+def _auto_pay_on_commit(invoices, user):
+    """
+    Run _auto_pay() once the outermost transaction commits (at once outside
+    a transaction). Returns the number paid, or None if it is deferred.
+    """
+    paid = []
+    db_transaction.on_commit(lambda: paid.append(_auto_pay(invoices, user)))
+    return paid[0] if paid else None
+
+
+def _auto_pay(invoices, user):
+    """
+    Pay new invoices, given as (invoice, customer_id) pairs, from auto-pay
+    wallets with one settlement per wallet. Returns the number paid.
+    """
+    from apps.payments.models import Wallet
+    from apps.payments.utils import settle_pending_invoices
+    
+    by_customer = {}
+    for invoice, customer_id in invoices:
+        by_customer.setdefault(customer_id, []).append(invoice.invoice_id)
+    
+    paid = 0
+    wallets = Wallet.objects.filter(customer_id__in=by_customer, auto_payment_enabled=True, is_active=True)
+    for wallet in wallets:
+        try:
+            settled, _, _ = settle_pending_invoices(wallet, user, invoice_ids=by_customer[wallet.customer_id])
+        except ValueError:
+            # e.g. no exchange rate for the wallet currency: left to `manage.py settle_pending_invoices`
+            continue
+        paid += len(settled)
+    return paid
@@ -2,18 +2,20 @@ from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
+from django.db import transaction as db_transaction
 from django.db.models import Q
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from apps.core.pagination import StandardResultsSetPagination, get_page_info, get_paginator
 from apps.cargo.models import Cargo, CargoHistory
 from apps.cargo.serializers import CargoSerializer, CargoHistorySerializer
+from apps.cargo.manifest import import_manifest, MANIFEST_FORMATS
+from apps.cargo.tracking import get_tracking
+from apps.cargo.utils import append_timeline, bulk_update_status, transition_status
 from apps.notifications.models import Notification
-from datetime import date
 
 
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 20
-    page_size_query_param = 'page_size'
-    max_page_size = 100
+MAX_BULK_CARGO = 5000
 
 
 @api_view(['GET', 'POST'])
@@ -21,7 +23,7 @@ class StandardResultsSetPagination(PageNumberPagination):
 def cargo_list_create(request):
     """List all cargo or register new cargo"""
     if request.method == 'GET':
-        cargo_list = Cargo.objects.all()
+        cargo_list = Cargo.objects.select_related('customer', 'warehouse', 'created_by').defer('timeline')
         
         # Filters
         status_filter = request.query_params.get('status', None)
@@ -44,14 +46,11 @@ def cargo_list_create(request):
                 Q(cargo_name__icontains=search)
             )
         
-        paginator = StandardResultsSetPagination()
+        paginator = get_paginator(request)
         result_page = paginator.paginate_queryset(cargo_list, request)
         
         serializer = CargoSerializer(result_page, many=True)
-        return paginator.get_paginated_response({
-            'count': paginator.page.paginator.count,
-            'results': serializer.data
-        })
+        return paginator.get_paginated_response(serializer.data)
     
     elif request.method == 'POST':
         data = request.data.copy()
@@ -59,16 +58,18 @@ def cargo_list_create(request):
         
         serializer = CargoSerializer(data=data)
         if serializer.is_valid():
-            serializer.save()
-            
-            # Create cargo history
-            CargoHistory.objects.create(
-                cargo=serializer.instance,
-                previous_status=None,
-                new_status='pending',
-                updated_by=request.user,
-                remarks='Cargo registered'
-            )
+            with db_transaction.atomic():
+                serializer.save()
+                
+                # Create cargo history
+                history = CargoHistory.objects.create(
+                    cargo=serializer.instance,
+                    previous_status=None,
+                    new_status='pending',
+                    updated_by=request.user,
+                    remarks='Cargo registered'
+                )
+                append_timeline([history])
             
             # Send notification (placeholder - will implement properly later)
             
@@ -83,12 +84,47 @@ def cargo_list_create(request):
         }, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def cargo_import_manifest(request):
+    """Register the cargo listed in an uploaded manifest (CSV or JSON lines)"""
+    manifest = request.FILES.get('file')
+    if not manifest:
+        return Response({
+            'success': False,
+            'error': 'Manifest file is required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    file_format = request.data.get('format') or ('jsonl' if manifest.name.endswith(('.jsonl', '.ndjson')) else 'csv')
+    if file_format not in MANIFEST_FORMATS:
+        return Response({
+            'success': False,
+            'error': f"Format must be one of: {', '.join(MANIFEST_FORMATS)}"
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        warehouse_id = int(request.data['warehouse_id']) if request.data.get('warehouse_id') else None
+    except (TypeError, ValueError):
+        return Response({
+            'success': False,
+            'error': 'Invalid warehouse ID'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    report = import_manifest(manifest, file_format=file_format, warehouse_id=warehouse_id, user=request.user)
+    
+    return Response({
+        'success': True,
+        'message': f"{report['created']} of {report['total_lines']} manifest line(s) registered",
+        'data': report
+    }, status=status.HTTP_200_OK)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def cargo_detail(request, pk):
     """Get cargo details"""
     try:
-        cargo = Cargo.objects.get(cargo_id=pk)
+        cargo = Cargo.objects.select_related('customer', 'warehouse', 'created_by').get(cargo_id=pk)
     except Cargo.DoesNotExist:
         return Response({
             'success': False,
@@ -107,7 +143,7 @@ def cargo_detail(request, pk):
 def cargo_update_status(request, pk):
     """Update cargo status"""
     try:
-        cargo = Cargo.objects.get(cargo_id=pk)
+        cargo = Cargo.objects.select_related('customer', 'warehouse', 'created_by').get(cargo_id=pk)
     except Cargo.DoesNotExist:
         return Response({
             'success': False,
@@ -123,36 +159,23 @@ def cargo_update_status(request, pk):
             'error': 'Status is required'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    previous_status = cargo.status
-    cargo.status = new_status
-    cargo.save()
-    
-    # Create history
-    CargoHistory.objects.create(
-        cargo=cargo,
-        previous_status=previous_status,
-        new_status=new_status,
-        updated_by=request.user,
-        remarks=remarks
-    )
-    
-    # If status is 'arrived', generate invoice
-    if new_status == 'arrived':
-        from apps.invoices.models import Invoice
-        from datetime import datetime, timedelta
-        from apps.payments.utils import process_auto_payment
-        
-        invoice = Invoice.objects.create(
-            cargo=cargo,
-            amount=cargo.cargo_value * 0.3,  # 30% of cargo value as dummy invoice
-            currency='USD',
-            due_date=date.today() + timedelta(days=7),
-            status='pending',
-            created_by=request.user
-        )
-        
-        # Check for auto-payment
-        auto_payment_success, auto_payment_message, auto_payment_data = process_auto_payment(invoice, request.user)
+    # Scanners send the status they saw; otherwise the status just read is expected
+    expected_status = request.data.get('expected_status') or cargo.status
+    try:
+        updated = transition_status(cargo.cargo_id, expected_status, new_status, request.user, remarks)
+    except ValueError as e:
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    cargo.refresh_from_db()
+    if not updated:
+        return Response({
+            'success': False,
+            'error': f'Cargo status is now {cargo.status}, not {expected_status}',
+            'current_status': cargo.status
+        }, status=status.HTTP_409_CONFLICT)
     
     serializer = CargoSerializer(cargo)
     return Response({
@@ -162,57 +185,109 @@ def cargo_update_status(request, pk):
     })
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def cargo_bulk_update_status(request):
+    """Update the status of a whole container or a list of cargo at once"""
+    cargo_ids = request.data.get('cargo_ids') or []
+    container_id = request.data.get('container_id')
+    new_status = request.data.get('status')
+    remarks = request.data.get('remarks', '')
+    
+    if not new_status:
+        return Response({
+            'success': False,
+            'error': 'Status is required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if new_status not in dict(Cargo._meta.get_field('status').choices):
+        return Response({
+            'success': False,
+            'error': 'Invalid status'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if not cargo_ids and not container_id:
+        return Response({
+            'success': False,
+            'error': 'Cargo IDs or container ID are required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        cargo_ids = [int(cargo_id) for cargo_id in cargo_ids]
+    except (ValueError, TypeError):
+        return Response({
+            'success': False,
+            'error': 'Invalid cargo ID'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if len(cargo_ids) > MAX_BULK_CARGO:
+        return Response({
+            'success': False,
+            'error': f'At most {MAX_BULK_CARGO} cargo can be updated per request'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    result = bulk_update_status(new_status, request.user, cargo_ids, container_id, remarks)
+    
+    return Response({
+        'success': True,
+        'message': f"{len(result['updated'])} cargo updated, {len(result['skipped'])} skipped",
+        'data': result
+    })
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def cargo_history(request, pk):
-    """Get cargo history"""
+    """
+    Get cargo history, paginated newest first. `?view=timeline` returns the
+    compact timeline stored on the cargo instead, without reading CargoHistory.
+    """
     try:
-        cargo = Cargo.objects.get(cargo_id=pk)
+        cargo = Cargo.objects.only('cargo_id', 'tracking_number', 'timeline').get(cargo_id=pk)
     except Cargo.DoesNotExist:
         return Response({
             'success': False,
             'error': 'Cargo not found'
         }, status=status.HTTP_404_NOT_FOUND)
     
-    history = CargoHistory.objects.filter(cargo=cargo).order_by('-updated_at')
-    serializer = CargoHistorySerializer(history, many=True)
+    if request.query_params.get('view') == 'timeline':
+        paginator = StandardResultsSetPagination()
+        results = {'timeline': paginator.paginate_queryset(cargo.timeline[::-1], request)}
+    else:
+        history = CargoHistory.objects.filter(cargo=cargo).select_related('updated_by').order_by('-updated_at')
+        
+        paginator = get_paginator(request, ordering_field='updated_at')
+        result_page = paginator.paginate_queryset(history, request)
+        results = {'history': CargoHistorySerializer(result_page, many=True).data}
     
     return Response({
         'success': True,
-        'cargo_id': pk,
+        'cargo_id': cargo.cargo_id,
         'tracking_number': cargo.tracking_number,
-        'history': serializer.data
+        **get_page_info(paginator),
+        **results
     })
 
 
 @api_view(['GET'])
 @permission_classes([])
 def public_tracking(request, tracking_number):
-    """Public tracking endpoint"""
-    try:
-        cargo = Cargo.objects.get(tracking_number=tracking_number)
-    except Cargo.DoesNotExist:
+    """Public tracking endpoint, cached and answering conditional GETs with 304"""
+    document = get_tracking(tracking_number)
+    if document is None:
         return Response({
             'success': False,
             'error': 'Cargo not found'
         }, status=status.HTTP_404_NOT_FOUND)
     
-    history = CargoHistory.objects.filter(cargo=cargo).order_by('updated_at')
-    timeline = []
-    
-    for h in history:
-        timeline.append({
-            'status': h.new_status,
-            'timestamp': h.updated_at.isoformat(),
-            'remarks': h.remarks
+    data, etag, last_modified = document
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = Response({
+            'success': True,
+            'data': data
         })
-    
-    serializer = CargoSerializer(cargo)
-    data = serializer.data
-    data['timeline'] = timeline
-    data['current_location'] = cargo.destination_location if cargo.status == 'arrived' else cargo.origin_location
-    
-    return Response({
-        'success': True,
-        'data': data
-    })
\ No newline at end of file
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, public=True, no_cache=True)
+    return response
@@ -0,0 +1,141 @@
+"""
+Shared pagination classes
+- StandardResultsSetPagination: page-number pagination used by every list view
+- KeysetPagination: opt-in cursor pagination on (timestamp, pk) for high-volume lists
+- get_page_info: count/next/previous of a page from either, for views with their own envelope
+"""
+import base64
+import re
+from django.db import connection
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class StandardResultsSetPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    
+    def get_paginated_response(self, data):
+        return super().get_paginated_response({
+            'count': self.page.paginator.count,
+            'results': data
+        })
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on (ordering_field, pk), newest first.
+    
+    Each page is a `WHERE (ts, pk) < (cursor_ts, cursor_pk) ORDER BY ts DESC,
+    pk DESC LIMIT n` query, so deep pages cost the same as the first one and
+    no COUNT(*) is issued unless the client asks for it with
+    `?count=exact` or `?count=estimate` (planner estimate on PostgreSQL).
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    
+    def __init__(self, ordering_field='created_at'):
+        self.ordering_field = ordering_field
+    
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+    
+    def encode_cursor(self, obj):
+        position = f"{getattr(obj, self.ordering_field).isoformat()}|{obj.pk}"
+        return base64.urlsafe_b64encode(position.encode()).decode()
+    
+    def decode_cursor(self, cursor):
+        try:
+            timestamp, pk = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+            timestamp = parse_datetime(timestamp)
+            pk = int(pk)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound('Invalid cursor')
+        if timestamp is None:
+            raise NotFound('Invalid cursor')
+        return timestamp, pk
+    
+    def get_count(self, queryset, mode):
+        if mode == 'exact':
+            return queryset.count()
+        if mode == 'estimate':
+            if connection.vendor == 'postgresql':
+                match = re.search(r'rows=(\d+)', queryset.order_by().explain())
+                if match:
+                    return int(match.group(1))
+            return queryset.count()
+        return None
+    
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.count = self.get_count(queryset, request.query_params.get(self.count_query_param))
+        
+        queryset = queryset.order_by(f'-{self.ordering_field}', '-pk')
+        
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            timestamp, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(**{f'{self.ordering_field}__lt': timestamp}) |
+                Q(**{self.ordering_field: timestamp, 'pk__lt': pk})
+            )
+        
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+        self.next_cursor = self.encode_cursor(results[-1]) if self.has_next else None
+        return results
+    
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+    
+    def get_paginated_response(self, data):
+        response = {
+            'next': self.get_next_link(),
+            'results': data
+        }
+        if self.count is not None:
+            response['count'] = self.count
+        return Response(response)
+
+
+def get_paginator(request, ordering_field='created_at'):
+    """
+    Return the paginator for a high-volume list view. Clients opt into
+    keyset pagination with `?pagination=cursor` (or by following a `cursor`
+    link); otherwise the standard page-number pagination is used.
+    """
+    if request.query_params.get('pagination') == 'cursor' or 'cursor' in request.query_params:
+        return KeysetPagination(ordering_field=ordering_field)
+    return StandardResultsSetPagination()
+
+
+def get_page_info(paginator):
+    """
+    `count`, `next` and `previous` of the page just paginated, the same keys
+    for both paginators. Keyset pages have no previous link, and their count
+    is None unless the client asked for one with `?count=`.
+    """
+    if isinstance(paginator, KeysetPagination):
+        return {'count': paginator.count, 'next': paginator.get_next_link(), 'previous': None}
+    return {
+        'count': paginator.page.paginator.count,
+        'next': paginator.get_next_link(),
+        'previous': paginator.get_previous_link(),
+    }
@@ -0,0 +1,110 @@
+"""
+Test helpers
+- create_customer, create_user, create_cargo, create_invoice: minimal rows for tests
+- QueryPlanMixin: assert that the page query of a list endpoint uses an index
+- QueryCountMixin: assert that an endpoint's query count does not grow with its rows
+"""
+from datetime import date
+from decimal import Decimal
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from apps.cargo.models import Cargo
+from apps.customers.models import Customer
+from apps.invoices.models import Invoice
+from apps.organizations.models import Organization
+from apps.users.models import User
+from apps.warehouses.models import Warehouse
+
+
+def create_customer(organization=None):
+    """Customer of `organization` (default: a new organization)"""
+    if organization is None:
+        organization = Organization.objects.create(
+            name='Test Org', address='Dar es Salaam', contact_phone='255700000000',
+            contact_email='org@example.com', status='active'
+        )
+    return Customer.objects.create(customer_name='Test Customer', phone_number='255711111111', organization=organization)
+
+
+def create_user(organization, username='admin'):
+    """Admin of `organization`, without a password (tests authenticate with force_authenticate())"""
+    return User.objects.create_user(
+        username=username, email=f'{username}@example.com', password=None,
+        full_name='Test User', role='admin', organization=organization
+    )
+
+
+def create_cargo(customer, warehouse=None, **fields):
+    """Cargo of `customer` in `warehouse` (default: a new warehouse of the customer's organization)"""
+    if warehouse is None:
+        warehouse = Warehouse.objects.create(
+            warehouse_name='Test Warehouse', location='Dar es Salaam', organization=customer.organization, capacity=100
+        )
+    return Cargo.objects.create(
+        customer=customer, warehouse=warehouse, cargo_name='Test Cargo', origin_location='Guangzhou',
+        destination_location='Dar es Salaam', cargo_weight=10, cargo_value=1000, cbm=1, **fields
+    )
+
+
+def create_invoice(customer, amount, cargo=None):
+    """Pending invoice for `cargo` (default: a new cargo of the customer)"""
+    return Invoice.objects.create(
+        cargo=cargo or create_cargo(customer), amount=Decimal(str(amount)), due_date=date.today()
+    )
+
+
+class QueryPlanMixin:
+    """
+    assertUsesIndex() requests a list endpoint with self.client, takes the
+    page query it ran on a table and checks its plan with EXPLAIN. PostgreSQL
+    is told to avoid sequential scans, since test tables are too small for
+    the planner to prefer an index on its own.
+    """
+    
+    def query_plan(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}")
+            return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+    
+    def assertUsesIndex(self, url, table, *index_names):
+        """The page query of `url` on `table` uses one of `index_names`"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        
+        table = connection.ops.quote_name(table)
+        page_queries = [
+            query['sql'] for query in queries.captured_queries
+            if f'FROM {table}' in query['sql'] and 'LIMIT' in query['sql']
+        ]
+        self.assertTrue(page_queries, f"{url} ran no page query on {table}")
+        plan = self.query_plan(page_queries[0])
+        self.assertTrue(
+            any(index_name in plan for index_name in index_names),
+            f"{url} does not use {' or '.join(index_names)}:\n{plan}"
+        )
+
+
+class QueryCountMixin:
+    """
+    Query counts of endpoints requested with self.client. A list endpoint
+    that loads the relations of its rows up front runs as many queries for
+    a full page as for a single row.
+    """
+    
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+    
+    def assertConstantQueries(self, url, add_rows, expected=None):
+        """`url` runs the same number of queries (`expected` if given) before and after add_rows()"""
+        before = self.count_queries(url)
+        add_rows()
+        after = self.count_queries(url)
+        self.assertEqual(after, before, f"{url} runs {before} queries for fewer rows and {after} for more")
+        if expected is not None:
+            self.assertEqual(after, expected)
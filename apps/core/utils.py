@@ -0,0 +1,60 @@
+"""
+Shared helpers
+- iter_lines: rows of an uploaded or opened CSV / JSON lines file, read lazily
+- unique_numbers: batches of random codes (tracking, control, release numbers) checked for collisions
+"""
+import codecs
+import csv
+import json
+
+
+def iter_lines(lines, file_format='csv'):
+    """
+    Yield (line_number, row dict) from an iterable of CSV or JSON lines;
+    a JSON line that is not an object yields None as its row.
+    Accepts bytes or str lines so uploaded files and open files both work.
+    Raises: ValueError for another format
+    """
+    lines = iter(lines)
+    first = next(lines, None)
+    if first is None:
+        return
+    if isinstance(first, bytes):
+        lines = codecs.iterdecode(_prepend(first, lines), 'utf-8-sig')
+    else:
+        lines = _prepend(first, lines)
+    
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+    elif file_format == 'jsonl':
+        for line_number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row if isinstance(row, dict) else None
+    else:
+        raise ValueError(f"Unsupported file format: {file_format}")
+
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+
+def unique_numbers(count, generate, queryset, field):
+    """
+    `count` new values from `generate()`, unique within the batch and not
+    used yet in `field` of `queryset` (their short random parts can collide)
+    """
+    numbers = set()
+    while len(numbers) < count:
+        candidates = {generate() for _ in range(count - len(numbers))} - numbers
+        taken = set(queryset.filter(**{f'{field}__in': candidates}).values_list(field, flat=True))
+        numbers |= candidates - taken
+    return list(numbers)
@@ -0,0 +1,21 @@
+"""
+Customers tests
+"""
+from django.test import TestCase
+from rest_framework.test import APIClient
+from apps.core.testing import QueryCountMixin, create_customer, create_user
+
+
+class CustomerQueryCountTests(QueryCountMixin, TestCase):
+    """Customer endpoints load the organization of each customer in the same query"""
+    
+    def setUp(self):
+        self.customer = create_customer()
+        self.client = APIClient()
+        self.client.force_authenticate(create_user(self.customer.organization))
+    
+    def test_customer_list(self):
+        self.assertConstantQueries('/api/customers/', lambda: [create_customer() for _ in range(5)], expected=2)
+    
+    def test_customer_detail(self):
+        self.assertEqual(self.count_queries(f'/api/customers/{self.customer.customer_id}/'), 1)
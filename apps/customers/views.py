@@ -2,24 +2,18 @@ from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
 from django.db.models import Q
+from apps.core.pagination import StandardResultsSetPagination
 from apps.customers.models import Customer
 from apps.customers.serializers import CustomerSerializer
 
 
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 20
-    page_size_query_param = 'page_size'
-    max_page_size = 100
-
-
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
 def customer_list_create(request):
     """List all customers or create a new one"""
     if request.method == 'GET':
-        customers = Customer.objects.all()
+        customers = Customer.objects.select_related('organization')
         
         # Filter by organization
         organization_id = request.query_params.get('organization_id', None)
@@ -39,10 +33,7 @@ def customer_list_create(request):
         result_page = paginator.paginate_queryset(customers, request)
         
         serializer = CustomerSerializer(result_page, many=True)
-        return paginator.get_paginated_response({
-            'count': paginator.page.paginator.count,
-            'results': serializer.data
-        })
+        return paginator.get_paginated_response(serializer.data)
     
     elif request.method == 'POST':
         serializer = CustomerSerializer(data=request.data)
@@ -64,7 +55,7 @@ def customer_list_create(request):
 def customer_detail(request, pk):
     """Get, update, or delete a customer"""
     try:
-        customer = Customer.objects.get(customer_id=pk)
+        customer = Customer.objects.select_related('organization').get(customer_id=pk)
     except Customer.DoesNotExist:
         return Response({
             'success': False,
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargo', '0003_list_view_indexes'),
+        ('invoices', '0002_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['-created_at'], name='invoice_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['status', '-created_at'], name='invoice_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['cargo', '-created_at'], name='invoice_cargo_created_idx'),
+        ),
+    ]
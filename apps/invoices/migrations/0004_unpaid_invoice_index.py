@@ -0,0 +1,20 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('cargo', '0003_list_view_indexes'),
+        ('invoices', '0003_list_view_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+    
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'overdue'])), fields=['cargo', 'created_at'], name='invoice_unpaid_cargo_idx'),
+        ),
+    ]
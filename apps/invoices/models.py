@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Q
 from apps.core.models import TimestampedModel
 import uuid
 from datetime import datetime, timedelta
@@ -36,6 +37,16 @@ class Invoice(TimestampedModel):
         verbose_name = 'Invoice'
         verbose_name_plural = 'Invoices'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], name='invoice_created_idx'),
+            models.Index(fields=['status', '-created_at'], name='invoice_status_created_idx'),
+            models.Index(fields=['cargo', '-created_at'], name='invoice_cargo_created_idx'),
+            models.Index(
+                fields=['cargo', 'created_at'],
+                condition=Q(status__in=['pending', 'overdue']),
+                name='invoice_unpaid_cargo_idx'
+            ),
+        ]
         
     def __str__(self):
         return f"{self.control_number} - ${self.amount}"
@@ -0,0 +1,43 @@
+"""
+Invoices tests
+"""
+from django.test import TestCase
+from rest_framework.test import APIClient
+from apps.core.testing import QueryCountMixin, QueryPlanMixin, create_customer, create_invoice, create_user
+
+
+class InvoiceListIndexTests(QueryPlanMixin, TestCase):
+    """Every filter of the invoice list is served from an index"""
+    
+    def setUp(self):
+        customer = create_customer()
+        self.invoice = create_invoice(customer, 10)
+        self.client = APIClient()
+        self.client.force_authenticate(create_user(customer.organization))
+    
+    def test_invoice_list(self):
+        self.assertUsesIndex('/api/invoices/', 'invoices', 'invoice_created_idx')
+    
+    def test_invoice_list_by_status(self):
+        self.assertUsesIndex('/api/invoices/?status=pending', 'invoices', 'invoice_status_created_idx')
+    
+    def test_invoice_list_by_cargo(self):
+        self.assertUsesIndex(f'/api/invoices/?cargo_id={self.invoice.cargo_id}', 'invoices', 'invoice_cargo_created_idx')
+
+
+class InvoiceQueryCountTests(QueryCountMixin, TestCase):
+    """Invoice endpoints load the cargo and customer of each invoice in the same query"""
+    
+    def setUp(self):
+        customer = create_customer()
+        self.invoice = create_invoice(customer, 10)
+        self.client = APIClient()
+        self.client.force_authenticate(create_user(customer.organization))
+    
+    def test_invoice_list(self):
+        self.assertConstantQueries(
+            '/api/invoices/', lambda: [create_invoice(create_customer(), 10) for _ in range(5)], expected=2
+        )
+    
+    def test_invoice_detail(self):
+        self.assertEqual(self.count_queries(f'/api/invoices/{self.invoice.invoice_id}/'), 1)
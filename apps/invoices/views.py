@@ -2,24 +2,19 @@ from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
+from django.conf import settings
 from django.db.models import Q
 from datetime import datetime, timedelta
+from apps.core.pagination import StandardResultsSetPagination
 from apps.invoices.models import Invoice, StorageFee
 from apps.invoices.serializers import InvoiceSerializer, StorageFeeSerializer
 
 
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 20
-    page_size_query_param = 'page_size'
-    max_page_size = 100
-
-
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def invoice_list(request):
     """List all invoices"""
-    invoices = Invoice.objects.all()
+    invoices = Invoice.objects.select_related('cargo__customer')
     
     # Filters
     status_filter = request.query_params.get('status', None)
@@ -34,10 +29,7 @@ def invoice_list(request):
     result_page = paginator.paginate_queryset(invoices, request)
     
     serializer = InvoiceSerializer(result_page, many=True)
-    return paginator.get_paginated_response({
-        'count': paginator.page.paginator.count,
-        'results': serializer.data
-    })
+    return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(['GET'])
@@ -45,7 +37,7 @@ def invoice_list(request):
 def invoice_detail(request, pk):
     """Get invoice details"""
     try:
-        invoice = Invoice.objects.get(invoice_id=pk)
+        invoice = Invoice.objects.select_related('cargo__customer').get(invoice_id=pk)
     except Invoice.DoesNotExist:
         return Response({
             'success': False,
@@ -65,6 +57,7 @@ def generate_invoice(request):
     """Generate invoice for cargo"""
     cargo_id = request.data.get('cargo_id')
     amount = request.data.get('amount')
+    currency = request.data.get('currency', settings.BASE_CURRENCY)
     
     if not cargo_id or not amount:
         return Response({
@@ -72,6 +65,12 @@ def generate_invoice(request):
             'error': 'Cargo ID and amount are required'
         }, status=status.HTTP_400_BAD_REQUEST)
     
+    if currency not in settings.SUPPORTED_CURRENCIES:
+        return Response({
+            'success': False,
+            'error': f"Currency must be one of: {', '.join(settings.SUPPORTED_CURRENCIES)}"
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
     from apps.cargo.models import Cargo
     
     try:
@@ -85,7 +84,7 @@ def generate_invoice(request):
     invoice = Invoice.objects.create(
         cargo=cargo,
         amount=amount,
-        currency='USD',
+        currency=currency,
         due_date=datetime.now().date() + timedelta(days=7),
         status='pending',
         created_by=request.user
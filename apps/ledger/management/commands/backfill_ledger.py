@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from apps.ledger.utils import backfill_ledger, BACKFILL_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Post existing wallet transactions and payment transactions to the general ledger'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=BACKFILL_CHUNK_SIZE,
+                            help='Source rows per database transaction')
+    
+    def handle(self, *args, **options):
+        totals = {}
+        for source_type, last_id, posted in backfill_ledger(chunk_size=options['chunk_size']):
+            totals[source_type] = totals.get(source_type, 0) + posted
+            self.stdout.write(f'  ... {source_type}: {totals[source_type]} posted, up to id {last_id}')
+        
+        for source_type, posted in totals.items():
+            self.stdout.write(self.style.SUCCESS(f'✓ Posted {posted} {source_type} entry(ies)'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from apps.ledger.utils import rollup_balances, ROLLUP_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Add new ledger postings to the account balances (run every few minutes)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=ROLLUP_BATCH_SIZE,
+                            help='Postings per database transaction')
+    
+    def handle(self, *args, **options):
+        rolled_up = rollup_balances(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'✓ Rolled up {rolled_up} posting(s)'))
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    
+    initial = True
+    
+    dependencies = [
+    ]
+    
+    operations = [
+        migrations.CreateModel(
+            name='LedgerAccount',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('account_id', models.AutoField(primary_key=True, serialize=False)),
+                ('code', models.CharField(help_text='e.g. cash:mobile_money, wallet:42, revenue:cargo', max_length=100, unique=True)),
+                ('name', models.CharField(max_length=255)),
+                ('account_type', models.CharField(choices=[('asset', 'Asset'), ('liability', 'Liability'), ('revenue', 'Revenue'), ('expense', 'Expense')], max_length=20)),
+                ('balance', models.DecimalField(decimal_places=2, default=0.0, help_text='Debits minus credits', max_digits=14)),
+            ],
+            options={
+                'verbose_name': 'Ledger Account',
+                'verbose_name_plural': 'Ledger Accounts',
+                'db_table': 'ledger_accounts',
+                'ordering': ['code'],
+            },
+        ),
+        migrations.CreateModel(
+            name='JournalEntry',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('entry_id', models.AutoField(primary_key=True, serialize=False)),
+                ('source_type', models.CharField(choices=[('wallet_transaction', 'Wallet Transaction'), ('transaction', 'Transaction')], max_length=50)),
+                ('source_id', models.PositiveIntegerField()),
+                ('description', models.TextField(blank=True, null=True)),
+                ('occurred_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Journal Entry',
+                'verbose_name_plural': 'Journal Entries',
+                'db_table': 'ledger_journal_entries',
+                'ordering': ['-occurred_at'],
+                'constraints': [models.UniqueConstraint(fields=('source_type', 'source_id'), name='unique_journal_entry_source')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Posting',
+            fields=[
+                ('posting_id', models.AutoField(primary_key=True, serialize=False)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('occurred_at', models.DateTimeField()),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='postings', to='ledger.ledgeraccount')),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='ledger.journalentry')),
+            ],
+            options={
+                'verbose_name': 'Posting',
+                'verbose_name_plural': 'Postings',
+                'db_table': 'ledger_postings',
+                'ordering': ['-occurred_at'],
+                'indexes': [models.Index(fields=['account', '-occurred_at'], name='posting_account_occurred_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ledger', '0001_initial'),
+    ]
+
+    operations = [
+        # Existing postings are already included in the running balances
+        migrations.AddField(
+            model_name='posting',
+            name='rolled_up',
+            field=models.BooleanField(default=True, help_text='Included in the account balance'),
+        ),
+        migrations.AlterField(
+            model_name='posting',
+            name='rolled_up',
+            field=models.BooleanField(default=False, help_text='Included in the account balance'),
+        ),
+        migrations.AlterField(
+            model_name='ledgeraccount',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, default=0.0, help_text='Debits minus credits of the rolled-up postings', max_digits=14),
+        ),
+        migrations.AddIndex(
+            model_name='posting',
+            index=models.Index(condition=models.Q(('rolled_up', False)), fields=['account'], name='posting_pending_rollup_idx'),
+        ),
+    ]
@@ -0,0 +1,80 @@
+from django.db import models
+from apps.core.models import TimestampedModel
+
+
+class LedgerAccount(TimestampedModel):
+    """General ledger account with a rolled-up balance (debits minus credits)"""
+    account_id = models.AutoField(primary_key=True)
+    code = models.CharField(max_length=100, unique=True, help_text="e.g. cash:mobile_money, wallet:42, revenue:cargo")
+    name = models.CharField(max_length=255)
+    account_type = models.CharField(max_length=20, choices=[
+        ('asset', 'Asset'),
+        ('liability', 'Liability'),
+        ('revenue', 'Revenue'),
+        ('expense', 'Expense'),
+    ])
+    balance = models.DecimalField(max_digits=14, decimal_places=2, default=0.00, help_text="Debits minus credits of the rolled-up postings")
+    
+    # Account types whose balance is normally on the credit side
+    CREDIT_NORMAL_TYPES = ('liability', 'revenue')
+    
+    class Meta:
+        db_table = 'ledger_accounts'
+        verbose_name = 'Ledger Account'
+        verbose_name_plural = 'Ledger Accounts'
+        ordering = ['code']
+    
+    def __str__(self):
+        return f"{self.code} - ${self.normal_balance}"
+    
+    @property
+    def normal_balance(self):
+        """Balance signed so that it is positive on the account's normal side"""
+        return -self.balance if self.account_type in self.CREDIT_NORMAL_TYPES else self.balance
+
+
+class JournalEntry(TimestampedModel):
+    """Balanced set of postings for one money movement"""
+    entry_id = models.AutoField(primary_key=True)
+    source_type = models.CharField(max_length=50, choices=[
+        ('wallet_transaction', 'Wallet Transaction'),
+        ('transaction', 'Transaction'),
+    ])
+    source_id = models.PositiveIntegerField()
+    description = models.TextField(blank=True, null=True)
+    occurred_at = models.DateTimeField()
+    
+    class Meta:
+        db_table = 'ledger_journal_entries'
+        verbose_name = 'Journal Entry'
+        verbose_name_plural = 'Journal Entries'
+        ordering = ['-occurred_at']
+        constraints = [
+            models.UniqueConstraint(fields=['source_type', 'source_id'], name='unique_journal_entry_source'),
+        ]
+    
+    def __str__(self):
+        return f"{self.source_type} {self.source_id}"
+
+
+class Posting(models.Model):
+    """One side of a journal entry, positive amounts are debits"""
+    posting_id = models.AutoField(primary_key=True)
+    entry = models.ForeignKey(JournalEntry, on_delete=models.CASCADE, related_name='postings')
+    account = models.ForeignKey(LedgerAccount, on_delete=models.PROTECT, related_name='postings')
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+    occurred_at = models.DateTimeField()
+    rolled_up = models.BooleanField(default=False, help_text="Included in the account balance")
+    
+    class Meta:
+        db_table = 'ledger_postings'
+        verbose_name = 'Posting'
+        verbose_name_plural = 'Postings'
+        ordering = ['-occurred_at']
+        indexes = [
+            models.Index(fields=['account', '-occurred_at'], name='posting_account_occurred_idx'),
+            models.Index(fields=['account'], condition=models.Q(rolled_up=False), name='posting_pending_rollup_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.account.code} {self.amount}"
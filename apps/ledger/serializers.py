@@ -0,0 +1,34 @@
+from rest_framework import serializers
+from apps.ledger.models import LedgerAccount, Posting
+
+
+class LedgerAccountSerializer(serializers.ModelSerializer):
+    """Serializer for Ledger Account model, annotated with_current_balance()"""
+    balance = serializers.DecimalField(source='current_balance', max_digits=14, decimal_places=2, read_only=True)
+    normal_balance = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = LedgerAccount
+        fields = ['account_id', 'code', 'name', 'account_type', 'balance', 'normal_balance',
+                  'created_at', 'updated_at']
+        read_only_fields = fields
+    
+    def get_normal_balance(self, obj):
+        """Current balance signed so that it is positive on the account's normal side"""
+        balance = obj.current_balance
+        return self.fields['balance'].to_representation(
+            -balance if obj.account_type in LedgerAccount.CREDIT_NORMAL_TYPES else balance
+        )
+
+
+class PostingSerializer(serializers.ModelSerializer):
+    """Serializer for Posting model"""
+    source_type = serializers.CharField(source='entry.source_type', read_only=True)
+    source_id = serializers.IntegerField(source='entry.source_id', read_only=True)
+    description = serializers.CharField(source='entry.description', read_only=True, allow_null=True)
+    
+    class Meta:
+        model = Posting
+        fields = ['posting_id', 'entry_id', 'source_type', 'source_id', 'description',
+                  'account_id', 'amount', 'occurred_at']
+        read_only_fields = fields
@@ -0,0 +1,103 @@
+"""
+Ledger tests
+"""
+from decimal import Decimal
+from django.test import TestCase
+from django.utils import timezone
+from apps.core.testing import create_customer, create_invoice
+from apps.ledger.models import JournalEntry, LedgerAccount, Posting
+from apps.ledger.utils import (
+    GATEWAY_ACCOUNT, REFUNDS_ACCOUNT, REVENUE_ACCOUNT, backfill_ledger, post_entries, rollup_balances, trial_balance
+)
+from apps.payments.models import Payment, Wallet
+from apps.payments.refunds import refund_payment
+from apps.payments.utils import finalize_payment, settle_invoice_from_wallet
+
+
+def balances():
+    return dict(LedgerAccount.objects.values_list('code', 'balance'))
+
+
+class PostEntriesTests(TestCase):
+    """Journal entries are written balanced and rolled up into account balances exactly once"""
+    
+    def entry(self, source_id, *lines):
+        return {
+            'source_type': 'transaction',
+            'source_id': source_id,
+            'description': f"Entry {source_id}",
+            'occurred_at': timezone.now(),
+            'lines': list(lines),
+        }
+    
+    def test_unbalanced_entry_is_rejected(self):
+        balanced = self.entry(1, (GATEWAY_ACCOUNT, Decimal('10.00')), (REVENUE_ACCOUNT, Decimal('-10.00')))
+        unbalanced = self.entry(2, (GATEWAY_ACCOUNT, Decimal('10.00')), (REVENUE_ACCOUNT, Decimal('-9.99')))
+        
+        with self.assertRaisesMessage(ValueError, 'Journal entry for transaction 2 does not balance'):
+            post_entries([balanced, unbalanced])
+        
+        self.assertFalse(JournalEntry.objects.exists())
+        self.assertFalse(Posting.objects.exists())
+    
+    def test_rollup_is_idempotent(self):
+        post_entries([
+            self.entry(source_id, (GATEWAY_ACCOUNT, Decimal('10.00')), (REVENUE_ACCOUNT, Decimal('-10.00')))
+            for source_id in range(1, 4)
+        ])
+        
+        self.assertEqual(balances(), {GATEWAY_ACCOUNT: Decimal('0.00'), REVENUE_ACCOUNT: Decimal('0.00')})
+        self.assertEqual(rollup_balances(batch_size=4), 6)
+        self.assertEqual(rollup_balances(batch_size=4), 0)
+        self.assertEqual(balances(), {GATEWAY_ACCOUNT: Decimal('30.00'), REVENUE_ACCOUNT: Decimal('-30.00')})
+        self.assertFalse(Posting.objects.filter(rolled_up=False).exists())
+
+
+class TrialBalanceTests(TestCase):
+    """Deposits, payments and refunds leave the ledger balanced"""
+    
+    def setUp(self):
+        customer = create_customer()
+        self.wallet = Wallet.objects.create(customer=customer)
+        self.wallet.deposit(100, 'DEP-1')
+        self.wallet.refresh_from_db()
+        
+        wallet_payment, _, _ = settle_invoice_from_wallet(self.wallet, create_invoice(customer, 40))
+        refund_payment(wallet_payment)
+        
+        invoice = create_invoice(customer, 25)
+        payment = Payment.objects.create(
+            invoice=invoice, amount_paid=invoice.amount, payment_reference='MM-1', payment_method='mobile_money'
+        )
+        finalize_payment(payment)
+    
+    def assertTrialBalance(self):
+        report = trial_balance()
+        self.assertEqual(report['total_debits'], Decimal('165.00'))
+        self.assertEqual(report['total_credits'], Decimal('165.00'))
+        self.assertEqual(
+            {row['code']: row['debit'] - row['credit'] for row in report['accounts']},
+            {
+                GATEWAY_ACCOUNT: Decimal('100.00'),
+                'cash:mobile_money': Decimal('25.00'),
+                REFUNDS_ACCOUNT: Decimal('40.00'),
+                REVENUE_ACCOUNT: Decimal('-65.00'),
+                f"wallet:{self.wallet.pk}": Decimal('-100.00'),
+            }
+        )
+    
+    def test_trial_balance_before_and_after_rollup(self):
+        self.assertTrialBalance()
+        rollup_balances()
+        self.assertTrialBalance()
+        self.assertEqual(sum(balances().values()), Decimal('0.00'))
+    
+    def test_backfill_reposts_missing_entries_once(self):
+        entries = JournalEntry.objects.count()
+        JournalEntry.objects.all().delete()
+        
+        posted = sum(count for _, _, count in backfill_ledger(chunk_size=2))
+        
+        self.assertEqual(posted, entries)
+        self.assertEqual(sum(count for _, _, count in backfill_ledger(chunk_size=2)), 0)
+        self.assertTrialBalance()
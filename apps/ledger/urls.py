@@ -0,0 +1,10 @@
+from django.urls import path
+from apps.ledger import views
+
+app_name = 'ledger'
+
+urlpatterns = [
+    path('accounts/', views.account_list, name='account-list'),
+    path('accounts/<int:pk>/postings/', views.account_postings, name='account-postings'),
+    path('trial-balance/', views.trial_balance_view, name='trial-balance'),
+]
@@ -0,0 +1,313 @@
+"""
+Double-entry posting
+Every money movement is written as a JournalEntry whose postings sum to
+zero. Postings are append-only: writing them does not touch the account
+rows, so payments on different wallets never wait on the shared cash and
+revenue accounts. rollup_balances() (`manage.py rollup_ledger_balances`)
+folds new postings into the account balances in batches, and balances are
+read as the rolled-up balance plus the postings not rolled up yet, so they
+are exact whenever the rollup last ran. Postings are kept in BASE_CURRENCY;
+amounts in other currencies are converted at the rate of the day they
+occurred.
+"""
+from decimal import Decimal
+from django.db import transaction as db_transaction
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from apps.ledger.models import LedgerAccount, JournalEntry, Posting
+from apps.payments.fx import base_currency, convert
+
+
+GATEWAY_ACCOUNT = 'cash:gateway'
+REVENUE_ACCOUNT = 'revenue:cargo'
+REFUNDS_ACCOUNT = 'refunds'
+BACKFILL_CHUNK_SIZE = 1000
+ROLLUP_BATCH_SIZE = 5000
+ZERO = Decimal('0.00')
+CENT = Decimal('0.01')
+
+# Account credited (or debited, for refunds) by each Transaction type
+TRANSACTION_ACCOUNTS = {
+    'cargo_payment': REVENUE_ACCOUNT,
+    'storage_fee': 'revenue:storage',
+    'penalty': 'revenue:penalty',
+    'refund': REFUNDS_ACCOUNT,
+}
+
+
+def describe_account(code):
+    """Returns: (name, account_type) for an account code"""
+    kind, _, key = code.partition(':')
+    if kind == 'cash':
+        return f"Cash - {key.replace('_', ' ').title()}", 'asset'
+    if kind == 'wallet':
+        return f"Customer wallet {key}", 'liability'
+    if kind == 'revenue':
+        return f"Revenue - {key.replace('_', ' ').title()}", 'revenue'
+    if kind == REFUNDS_ACCOUNT:
+        return 'Refunds', 'expense'
+    raise ValueError(f"Unknown ledger account: {code}")
+
+
+def get_account_ids(codes):
+    """Returns: dict of code -> account_id, creating missing accounts"""
+    codes = set(codes)
+    accounts = dict(LedgerAccount.objects.filter(code__in=codes).values_list('code', 'account_id'))
+    missing = codes - accounts.keys()
+    if missing:
+        LedgerAccount.objects.bulk_create([
+            LedgerAccount(code=code, name=name, account_type=account_type)
+            for code, (name, account_type) in ((code, describe_account(code)) for code in sorted(missing))
+        ], ignore_conflicts=True)
+        accounts.update(LedgerAccount.objects.filter(code__in=missing).values_list('code', 'account_id'))
+    return accounts
+
+
+def post_entries(entries):
+    """
+    Write journal entries with one INSERT for the entries and one for the
+    postings. Account balances are updated later by rollup_balances().
+    
+    Each entry is a dict with `source_type`, `source_id`, `description`,
+    `occurred_at` and `lines`, a list of (account code, amount) pairs where
+    debits are positive and credits negative. None entries are ignored.
+    Returns the created JournalEntry objects.
+    Raises: ValueError if an entry does not balance
+    """
+    entries = [entry for entry in entries if entry]
+    if not entries:
+        return []
+    
+    for entry in entries:
+        if sum(amount for _, amount in entry['lines']) != ZERO:
+            raise ValueError(f"Journal entry for {entry['source_type']} {entry['source_id']} does not balance")
+    
+    # No savepoint: entries are posted with the rows they record, a failed
+    # INSERT fails the caller's transaction anyway
+    with db_transaction.atomic(savepoint=False):
+        accounts = get_account_ids(code for entry in entries for code, _ in entry['lines'])
+        
+        journal_entries = JournalEntry.objects.bulk_create([
+            JournalEntry(
+                source_type=entry['source_type'],
+                source_id=entry['source_id'],
+                description=entry['description'],
+                occurred_at=entry['occurred_at']
+            )
+            for entry in entries
+        ])
+        
+        Posting.objects.bulk_create([
+            Posting(
+                entry=journal_entry,
+                account_id=accounts[code],
+                amount=amount,
+                occurred_at=journal_entry.occurred_at
+            )
+            for journal_entry, entry in zip(journal_entries, entries)
+            for code, amount in entry['lines']
+        ])
+    
+    return journal_entries
+
+
+def rollup_balances(batch_size=ROLLUP_BATCH_SIZE):
+    """
+    Add the postings not rolled up yet to their account balances, oldest
+    first, `batch_size` postings per database transaction. A batch is
+    claimed with a conditional UPDATE, so concurrent runs never add a
+    posting twice: a run that loses part of its batch to another rolls back
+    and takes the next one.
+    Returns the number of postings rolled up.
+    """
+    rolled_up = 0
+    while True:
+        with db_transaction.atomic():
+            posting_ids = list(
+                Posting.objects.filter(rolled_up=False).order_by('posting_id').values_list('posting_id', flat=True)[:batch_size]
+            )
+            if not posting_ids:
+                return rolled_up
+            
+            claimed = Posting.objects.filter(posting_id__in=posting_ids, rolled_up=False).update(rolled_up=True)
+            if claimed != len(posting_ids):
+                db_transaction.set_rollback(True)
+                continue
+            
+            deltas = dict(
+                Posting.objects.filter(posting_id__in=posting_ids).order_by()
+                .values('account_id').annotate(total=Sum('amount')).values_list('account_id', 'total')
+            )
+            LedgerAccount.objects.filter(account_id__in=deltas).update(
+                balance=F('balance') + Case(
+                    *[When(account_id=account_id, then=Value(delta)) for account_id, delta in deltas.items()],
+                    output_field=DecimalField(max_digits=14, decimal_places=2)
+                ),
+                updated_at=timezone.now()
+            )
+        rolled_up += len(posting_ids)
+
+
+def with_current_balance(accounts):
+    """Annotate accounts with `current_balance`: the balance plus the postings not rolled up yet"""
+    pending = (
+        Posting.objects.filter(account=OuterRef('pk'), rolled_up=False).order_by()
+        .values('account').annotate(total=Sum('amount')).values('total')
+    )
+    return accounts.annotate(current_balance=ExpressionWrapper(
+        F('balance') + Coalesce(Subquery(pending), Value(ZERO)),
+        output_field=DecimalField(max_digits=14, decimal_places=2)
+    ))
+
+
+def wallet_transaction_entry(wallet_transaction):
+    """Journal entry for a settled WalletTransaction (None otherwise)"""
+    if wallet_transaction.status != 'success':
+        return None
+    
+    occurred_at = wallet_transaction.created_at or timezone.now()
+    amount = convert(wallet_transaction.amount, wallet_transaction.wallet.currency, base_currency(), occurred_at)
+    wallet_account = f"wallet:{wallet_transaction.wallet_id}"
+    transaction_type = wallet_transaction.transaction_type
+    
+    if transaction_type == 'deposit':
+        lines = [(GATEWAY_ACCOUNT, amount), (wallet_account, -amount)]
+    elif transaction_type == 'withdrawal':
+        lines = [(wallet_account, amount), (GATEWAY_ACCOUNT, -amount)]
+    elif transaction_type == 'refund':
+        lines = [(REFUNDS_ACCOUNT, amount), (wallet_account, -amount)]
+    else:
+        lines = [(wallet_account, amount), (REVENUE_ACCOUNT, -amount)]
+    
+    return {
+        'source_type': 'wallet_transaction',
+        'source_id': wallet_transaction.transaction_id,
+        'description': wallet_transaction.description,
+        'occurred_at': occurred_at,
+        'lines': lines,
+    }
+
+
+def transaction_entry(transaction, payment_method):
+    """
+    Journal entry for a settled Transaction paid with `payment_method`.
+    Wallet payments return None: their WalletTransaction is posted instead.
+    """
+    if transaction.status != 'success' or payment_method == 'wallet':
+        return None
+    
+    occurred_at = transaction.created_at or timezone.now()
+    amount = convert(transaction.amount, transaction.currency, base_currency(), occurred_at)
+    cash_account = f"cash:{payment_method}"
+    account = TRANSACTION_ACCOUNTS[transaction.transaction_type]
+    
+    if transaction.transaction_type == 'refund':
+        lines = [(account, amount), (cash_account, -amount)]
+    else:
+        lines = [(cash_account, amount), (account, -amount)]
+    
+    return {
+        'source_type': 'transaction',
+        'source_id': transaction.transaction_id,
+        'description': f"{transaction.get_transaction_type_display()} {transaction.reference}",
+        'occurred_at': occurred_at,
+        'lines': lines,
+    }
+
+
+def post_wallet_transactions(wallet_transactions):
+    """Post saved WalletTransaction rows"""
+    return post_entries(wallet_transaction_entry(t) for t in wallet_transactions)
+
+
+def post_transactions(transactions):
+    """Post saved Transaction rows, given as (transaction, payment_method) pairs"""
+    return post_entries(transaction_entry(t, payment_method) for t, payment_method in transactions)
+
+
+def trial_balance(account_type=None):
+    """
+    Trial balance from the current account balances, one row per account.
+    Returns: dict with `accounts`, `total_debits` and `total_credits`
+    """
+    accounts = with_current_balance(LedgerAccount.objects.order_by('code'))
+    if account_type:
+        accounts = accounts.filter(account_type=account_type)
+    
+    rows = []
+    total_debits = total_credits = ZERO
+    for code, name, kind, balance in accounts.values_list('code', 'name', 'account_type', 'current_balance'):
+        balance = balance.quantize(CENT)
+        debit = balance if balance > 0 else ZERO
+        credit = -balance if balance < 0 else ZERO
+        total_debits += debit
+        total_credits += credit
+        rows.append({
+            'code': code,
+            'name': name,
+            'account_type': kind,
+            'debit': debit,
+            'credit': credit,
+        })
+    
+    return {
+        'accounts': rows,
+        'total_debits': total_debits,
+        'total_credits': total_credits,
+    }
+
+
+def account_type_totals():
+    """Returns: dict of account_type -> balance (debits minus credits)"""
+    totals = dict(
+        LedgerAccount.objects.order_by()
+        .values('account_type')
+        .annotate(total=Sum('balance'))
+        .values_list('account_type', 'total')
+    )
+    pending = (
+        Posting.objects.filter(rolled_up=False).order_by()
+        .values('account__account_type')
+        .annotate(total=Sum('amount'))
+        .values_list('account__account_type', 'total')
+    )
+    for account_type, total in pending:
+        totals[account_type] = (totals.get(account_type, ZERO) + total).quantize(CENT)
+    return totals
+
+
+def _backfill_chunks(queryset, source_type, entry_for, chunk_size):
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_id).order_by('pk')[:chunk_size])
+        if not chunk:
+            return
+        last_id = chunk[-1].pk
+        
+        posted = set(
+            JournalEntry.objects.filter(
+                source_type=source_type, source_id__in=[row.pk for row in chunk]
+            ).values_list('source_id', flat=True)
+        )
+        journal_entries = post_entries(entry_for(row) for row in chunk if row.pk not in posted)
+        yield source_type, last_id, len(journal_entries)
+
+
+def backfill_ledger(chunk_size=BACKFILL_CHUNK_SIZE):
+    """
+    Post existing WalletTransaction and Transaction history that has no
+    journal entry yet, `chunk_size` rows per database transaction. Rows that
+    are already posted are skipped, so the backfill can be re-run safely.
+    Yields (source_type, last_source_id, entries_posted) after every chunk.
+    """
+    from apps.payments.models import Transaction, WalletTransaction
+    
+    yield from _backfill_chunks(
+        WalletTransaction.objects.filter(status='success').select_related('wallet'),
+        'wallet_transaction', wallet_transaction_entry, chunk_size
+    )
+    yield from _backfill_chunks(
+        Transaction.objects.filter(status='success').select_related('payment'),
+        'transaction', lambda t: transaction_entry(t, t.payment.payment_method), chunk_size
+    )
@@ -0,0 +1,74 @@
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from apps.core.pagination import StandardResultsSetPagination, get_paginator
+from apps.ledger.models import LedgerAccount, Posting
+from apps.ledger.serializers import LedgerAccountSerializer, PostingSerializer
+from apps.ledger.utils import trial_balance, account_type_totals, with_current_balance
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def account_list(request):
+    """List ledger accounts with their current balances"""
+    accounts = with_current_balance(LedgerAccount.objects.order_by('code'))
+    
+    # Filter by account type
+    account_type = request.query_params.get('account_type', None)
+    if account_type:
+        accounts = accounts.filter(account_type=account_type)
+    
+    # Filter by code prefix (e.g. cash:, wallet:, revenue:)
+    code = request.query_params.get('code', None)
+    if code:
+        accounts = accounts.filter(code__startswith=code)
+    
+    paginator = StandardResultsSetPagination()
+    result_page = paginator.paginate_queryset(accounts, request)
+    
+    serializer = LedgerAccountSerializer(result_page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def account_postings(request, pk):
+    """List the postings of a ledger account"""
+    try:
+        account = LedgerAccount.objects.get(account_id=pk)
+    except LedgerAccount.DoesNotExist:
+        return Response({
+            'success': False,
+            'error': 'Account not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    postings = Posting.objects.filter(account=account).select_related('entry').order_by('-occurred_at')
+    
+    paginator = get_paginator(request, ordering_field='occurred_at')
+    result_page = paginator.paginate_queryset(postings, request)
+    
+    serializer = PostingSerializer(result_page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def trial_balance_view(request):
+    """Trial balance and per-type totals from the running account balances"""
+    report = trial_balance(request.query_params.get('account_type'))
+    
+    return Response({
+        'success': True,
+        'data': {
+            'accounts': [
+                dict(row, debit=float(row['debit']), credit=float(row['credit']))
+                for row in report['accounts']
+            ],
+            'total_debits': float(report['total_debits']),
+            'total_credits': float(report['total_credits']),
+            'account_type_totals': {
+                account_type: float(total) for account_type, total in account_type_totals().items()
+            }
+        }
+    }, status=status.HTTP_200_OK)
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cargo', '0003_list_view_indexes'),
+        ('customers', '0001_initial'),
+        ('notifications', '0002_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['-sent_at'], name='notification_sent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['customer', '-sent_at'], name='notification_customer_sent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['cargo', '-sent_at'], name='notification_cargo_sent_idx'),
+        ),
+    ]
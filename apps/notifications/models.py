@@ -37,6 +37,11 @@ class Notification(TimestampedModel):
         verbose_name = 'Notification'
         verbose_name_plural = 'Notifications'
         ordering = ['-sent_at']
+        indexes = [
+            models.Index(fields=['-sent_at'], name='notification_sent_idx'),
+            models.Index(fields=['customer', '-sent_at'], name='notification_customer_sent_idx'),
+            models.Index(fields=['cargo', '-sent_at'], name='notification_cargo_sent_idx'),
+        ]
         
     def __str__(self):
         return f"{self.notification_type} to {self.customer.customer_name} via {self.delivery_method}"
@@ -0,0 +1,53 @@
+"""
+Notifications tests
+"""
+from django.test import TestCase
+from rest_framework.test import APIClient
+from apps.core.testing import QueryCountMixin, QueryPlanMixin, create_cargo, create_customer, create_user
+from apps.notifications.models import Notification
+
+
+class NotificationListIndexTests(QueryPlanMixin, TestCase):
+    """Every filter of the notification list is served from an index"""
+    
+    def setUp(self):
+        self.customer = create_customer()
+        self.cargo = create_cargo(self.customer)
+        Notification.objects.create(
+            customer=self.customer, cargo=self.cargo, notification_type='registration',
+            delivery_method='sms', content='Cargo registered'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(create_user(self.customer.organization))
+    
+    def test_notification_list(self):
+        self.assertUsesIndex('/api/notifications/', 'notifications', 'notification_sent_idx')
+    
+    def test_notification_list_by_customer(self):
+        self.assertUsesIndex(
+            f'/api/notifications/?customer_id={self.customer.customer_id}', 'notifications', 'notification_customer_sent_idx'
+        )
+    
+    def test_notification_list_by_cargo(self):
+        self.assertUsesIndex(f'/api/notifications/?cargo_id={self.cargo.cargo_id}', 'notifications', 'notification_cargo_sent_idx')
+
+
+class NotificationQueryCountTests(QueryCountMixin, TestCase):
+    """The notification list loads the customer and cargo of each notification in the same query"""
+    
+    def setUp(self):
+        customer = create_customer()
+        self.client = APIClient()
+        self.client.force_authenticate(create_user(customer.organization))
+    
+    def test_notification_list(self):
+        def add_notifications():
+            for _ in range(5):
+                customer = create_customer()
+                Notification.objects.create(
+                    customer=customer, cargo=create_cargo(customer), notification_type='arrival',
+                    delivery_method='whatsapp', content='Cargo arrived'
+                )
+        
+        add_notifications()
+        self.assertConstantQueries('/api/notifications/', add_notifications, expected=2)
@@ -2,23 +2,17 @@ from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
+from apps.core.pagination import get_paginator
 from apps.notifications.models import Notification
 from apps.notifications.serializers import NotificationSerializer
 from apps.customers.models import Customer
 
 
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 20
-    page_size_query_param = 'page_size'
-    max_page_size = 100
-
-
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def notification_list(request):
     """List all notifications"""
-    notifications = Notification.objects.all()
+    notifications = Notification.objects.select_related('customer', 'cargo')
     
     # Filter by customer
     customer_id = request.query_params.get('customer_id', None)
@@ -30,14 +24,11 @@ def notification_list(request):
     if cargo_id:
         notifications = notifications.filter(cargo_id=cargo_id)
     
-    paginator = StandardResultsSetPagination()
+    paginator = get_paginator(request, ordering_field='sent_at')
     result_page = paginator.paginate_queryset(notifications, request)
     
     serializer = NotificationSerializer(result_page, many=True)
-    return paginator.get_paginated_response({
-        'count': paginator.page.paginator.count,
-        'results': serializer.data
-    })
+    return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(['POST'])
@@ -2,18 +2,12 @@ from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
 from django.db.models import Q
+from apps.core.pagination import StandardResultsSetPagination
 from apps.organizations.models import Organization
 from apps.organizations.serializers import OrganizationSerializer
 
 
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 20
-    page_size_query_param = 'page_size'
-    max_page_size = 100
-
-
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
 def organization_list_create(request):
@@ -33,10 +27,7 @@ def organization_list_create(request):
         result_page = paginator.paginate_queryset(organizations, request)
         
         serializer = OrganizationSerializer(result_page, many=True)
-        return paginator.get_paginated_response({
-            'count': paginator.page.paginator.count,
-            'results': serializer.data
-        })
+        return paginator.get_paginated_response(serializer.data)
     
     elif request.method == 'POST':
         serializer = OrganizationSerializer(data=request.data)
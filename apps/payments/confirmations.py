@@ -0,0 +1,220 @@
+"""
+Gateway confirmations
+Deposits and payments that the gateway confirms asynchronously are recorded
+as pending GatewayOperations and finalized when the signed gateway callback
+arrives, or when the reconciliation worker finds them verified
+"""
+import hashlib
+import hmac
+import logging
+from datetime import timedelta
+from decimal import Decimal
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from apps.payments.models import GatewayOperation, Payment
+from apps.payments.references import generate_payment_reference, normalize_reference
+from apps.payments.services import PaymentGatewayService, get_gateway_settings
+
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_BATCH_SIZE = 500
+# Gateway statuses that mean the operation will never be confirmed
+FAILED_STATUSES = ('failed', 'declined', 'cancelled', 'rejected')
+
+
+def start_deposit(wallet, amount, payment_method, description=None, user=None):
+    """
+    Start a wallet deposit at the gateway. Deposits the gateway settles
+    immediately are credited at once (without settling auto-pay invoices,
+    the caller does that); deposits it reports as pending are credited later.
+    
+    Returns: the GatewayOperation (status completed or pending)
+    Raises: ValueError if the gateway rejects the deposit
+    """
+    success, reference, gateway_response = PaymentGatewayService.process_deposit(
+        amount=amount,
+        payment_method=payment_method,
+        customer_phone=wallet.customer.phone_number,
+        customer_email=wallet.customer.email
+    )
+    if not success:
+        raise ValueError("Payment gateway error")
+    
+    operation = GatewayOperation.objects.create(
+        operation_type='deposit',
+        reference=normalize_reference(reference),
+        amount=Decimal(str(amount)),
+        payment_method=payment_method,
+        description=description or f"Deposit of ${amount}",
+        wallet=wallet,
+        gateway_response=gateway_response,
+        created_by=user
+    )
+    if gateway_response.get('status') == 'pending':
+        return operation
+    
+    operation, _ = complete_operation(operation.reference, True, gateway_response, settle_invoices=False)
+    return operation
+
+
+def start_payment(invoice, amount, payment_method, reference=None, user=None):
+    """
+    Record an invoice payment as pending until the gateway confirms it.
+    Returns: the GatewayOperation, with its pending Payment
+    Raises: ValueError if the invoice is paid or already awaiting a payment,
+    or the reference is already used for `payment_method`
+    """
+    if invoice.status == 'paid':
+        raise ValueError("Invoice already paid")
+    
+    try:
+        with db_transaction.atomic():
+            if GatewayOperation.objects.filter(payment__invoice=invoice, status='pending').exists():
+                raise ValueError("Invoice already has a payment awaiting confirmation")
+            
+            payment = Payment.objects.create(
+                invoice=invoice,
+                amount_paid=amount,
+                payment_reference=normalize_reference(reference) or generate_payment_reference(),
+                payment_method=payment_method,
+                status='pending',
+                processed_by=user
+            )
+            operation = GatewayOperation.objects.create(
+                operation_type='payment',
+                reference=payment.payment_reference,
+                amount=payment.amount_paid,
+                payment_method=payment_method,
+                description=f"Payment for invoice {invoice.control_number}",
+                payment=payment,
+                created_by=user
+            )
+    except IntegrityError:
+        raise ValueError("Payment reference already used")
+    
+    return operation
+
+
+def complete_operation(reference, success, gateway_response=None, settle_invoices=True):
+    """
+    Finalize a pending operation once: a confirmed deposit is credited to
+    the wallet (and, when `settle_invoices` is set, pays the wallet's
+    waiting invoices if auto-pay is on), a confirmed payment marks its
+    invoice paid; an unsuccessful one is marked failed. Repeated
+    confirmations (callback retries, worker and callback racing) find the
+    operation no longer pending and change nothing.
+    
+    Returns: (operation, changed: bool)
+    Raises: ValueError if the reference is unknown
+    """
+    from apps.payments.utils import finalize_payment
+    
+    now = timezone.now()
+    with db_transaction.atomic():
+        operation = GatewayOperation.objects.select_for_update().select_related(
+            'wallet', 'payment__invoice'
+        ).filter(reference=reference).first()
+        if operation is None:
+            raise ValueError("Unknown gateway reference")
+        if operation.status != 'pending':
+            return operation, False
+        
+        if gateway_response is not None:
+            operation.gateway_response = gateway_response
+        operation.completed_at = now
+        operation.status = 'completed' if success else 'failed'
+        
+        if success and operation.operation_type == 'deposit':
+            operation.wallet_transaction = operation.wallet.apply_transaction(
+                'deposit', operation.amount, operation.reference, operation.description,
+                gateway_response=operation.gateway_response
+            )
+        elif success:
+            try:
+                with db_transaction.atomic():
+                    finalize_payment(operation.payment, operation.created_by, operation.gateway_response)
+            except ValueError as e:
+                # Paid twice: keep the gateway response so the money can be refunded
+                logger.warning("Confirmed payment %s not applied: %s", reference, e)
+                operation.status = 'failed'
+        
+        if operation.payment_id and operation.status == 'failed':
+            Payment.objects.filter(pk=operation.payment_id).update(status='failed', updated_at=now)
+        
+        operation.save(update_fields=['status', 'gateway_response', 'wallet_transaction', 'completed_at', 'updated_at'])
+    
+    wallet = operation.wallet
+    if settle_invoices and operation.wallet_transaction_id and wallet.auto_payment_enabled and wallet.is_active:
+        from apps.payments.utils import settle_pending_invoices
+        
+        try:
+            settle_pending_invoices(wallet, operation.created_by)
+        except ValueError as e:
+            logger.warning("Auto-payment after deposit %s failed: %s", reference, e)
+    
+    return operation, True
+
+
+def sign_callback(body):
+    """HMAC-SHA256 hex signature of a callback body (bytes)"""
+    secret = get_gateway_settings()['WEBHOOK_SECRET']
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_callback_signature(body, signature):
+    """Check a callback signature in constant time; always fails without a configured secret"""
+    if not get_gateway_settings()['WEBHOOK_SECRET'] or not signature:
+        return False
+    return hmac.compare_digest(sign_callback(body), signature)
+
+
+def reconcile_gateway_operations(batch_size=RECONCILE_BATCH_SIZE, max_concurrency=None):
+    """
+    Poll the gateway for one batch of stale pending operations: those older
+    than VERIFY_AFTER seconds and not polled in the last VERIFY_AFTER
+    seconds. The batch is claimed with SKIP LOCKED (so several workers can
+    run side by side) and verified concurrently with verify_payments().
+    Verified operations are completed, operations the gateway reports as
+    failed or still pending after PENDING_TTL seconds are failed.
+    
+    Returns: dict with checked/completed/failed/pending counts
+    """
+    config = get_gateway_settings()
+    now = timezone.now()
+    stale = now - timedelta(seconds=config['VERIFY_AFTER'])
+    expired = now - timedelta(seconds=config['PENDING_TTL'])
+    
+    with db_transaction.atomic():
+        operations = list(
+            GatewayOperation.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', created_at__lte=stale)
+            .filter(Q(last_checked_at__isnull=True) | Q(last_checked_at__lte=stale))
+            .order_by('created_at')
+            .values_list('reference', 'created_at')[:batch_size]
+        )
+        GatewayOperation.objects.filter(reference__in=[reference for reference, _ in operations]).update(
+            checks=F('checks') + 1,
+            last_checked_at=now,
+            updated_at=now
+        )
+    
+    counts = {'checked': len(operations), 'completed': 0, 'failed': 0, 'pending': 0}
+    if not operations:
+        return counts
+    
+    results = PaymentGatewayService.verify_payments([reference for reference, _ in operations], max_concurrency)
+    for reference, created_at in operations:
+        verified, gateway_response = results[reference]
+        if verified:
+            operation, changed = complete_operation(reference, True, gateway_response)
+        elif gateway_response.get('status') in FAILED_STATUSES or created_at <= expired:
+            operation, changed = complete_operation(reference, False, gateway_response)
+        else:
+            counts['pending'] += 1
+            continue
+        if changed:
+            counts[operation.status] += 1
+    
+    return counts
@@ -0,0 +1,151 @@
+"""
+Currency conversion
+Rates come from the ExchangeRate table: the rate for a date is the latest
+rate on or before it, for the pair itself, its inverse, or crossed through
+BASE_CURRENCY. Rates found are memoized per process by (date, pair), so
+settlements and reports hit the table once per distinct date and pair;
+missing rates are not memoized. The memo is keyed by a rates version kept
+in the shared cache, which set_rate() replaces, so a rate stored by any
+process or by `manage.py set_exchange_rate` is seen by every worker.
+"""
+import uuid
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from apps.payments.models import ExchangeRate
+
+try:
+    import numpy as np
+except ImportError:  # Optional: conversion of report columns falls back to plain Python
+    np = None
+
+
+RATE_CACHE_SIZE = 4096
+RATES_VERSION_KEY = 'fx:rates_version'
+CENT = Decimal('0.01')
+
+
+def base_currency():
+    return getattr(settings, 'BASE_CURRENCY', 'USD')
+
+
+def _as_date(on_date):
+    if on_date is None:
+        return timezone.localdate()
+    if isinstance(on_date, datetime):
+        return timezone.localtime(on_date).date() if timezone.is_aware(on_date) else on_date.date()
+    return on_date
+
+
+def _stored_rate(rate_date, base, quote):
+    return (
+        ExchangeRate.objects.filter(base_currency=base, quote_currency=quote, rate_date__lte=rate_date)
+        .order_by('-rate_date')
+        .values_list('rate', flat=True)
+        .first()
+    )
+
+
+class RateNotFound(LookupError):
+    """Raised by _memoized_rate() so that misses are not memoized"""
+
+
+@lru_cache(maxsize=RATE_CACHE_SIZE)
+def _memoized_rate(version, rate_date, from_currency, to_currency):
+    rate = _stored_rate(rate_date, from_currency, to_currency)
+    if rate is not None:
+        return rate
+    inverse = _stored_rate(rate_date, to_currency, from_currency)
+    if inverse:
+        return Decimal(1) / inverse
+    raise RateNotFound
+
+
+def _rates_version():
+    """Current rates version from the shared cache, created if missing (e.g. after eviction)"""
+    version = cache.get(RATES_VERSION_KEY)
+    if version is None:
+        cache.add(RATES_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(RATES_VERSION_KEY)
+    return version
+
+
+def _cached_rate(version, rate_date, from_currency, to_currency):
+    """Rate or None"""
+    try:
+        return _memoized_rate(version, rate_date, from_currency, to_currency)
+    except RateNotFound:
+        return None
+
+
+def get_rate(from_currency, to_currency, on_date=None):
+    """
+    Units of `to_currency` per unit of `from_currency` on `on_date` (default: today)
+    Raises: ValueError if no rate is known for the pair
+    """
+    if from_currency == to_currency:
+        return Decimal(1)
+    rate_date = _as_date(on_date)
+    
+    version = _rates_version()
+    rate = _cached_rate(version, rate_date, from_currency, to_currency)
+    if rate is None and base_currency() not in (from_currency, to_currency):
+        to_base = _cached_rate(version, rate_date, from_currency, base_currency())
+        from_base = _cached_rate(version, rate_date, base_currency(), to_currency)
+        if to_base is not None and from_base is not None:
+            rate = to_base * from_base
+    if rate is None:
+        raise ValueError(f"No exchange rate for {from_currency}/{to_currency} on {rate_date}")
+    return rate
+
+
+def convert(amount, from_currency, to_currency, on_date=None):
+    """Convert an amount, rounded half-up to cents"""
+    amount = Decimal(str(amount))
+    if from_currency == to_currency:
+        return amount
+    return (amount * get_rate(from_currency, to_currency, on_date)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def convert_column(amounts, currencies, dates, to_currency):
+    """
+    Convert parallel columns of amounts, currency codes and dates to
+    `to_currency`. Rows are factorized by their (currency, date) key, rates
+    are looked up once per distinct key, and with NumPy installed the
+    per-row rate gather, multiply and rounding run as array operations.
+    Returns an array (NumPy) or list of floats rounded to cents.
+    Raises: ValueError if a rate is missing
+    """
+    keys = {}
+    codes = [keys.setdefault(key, len(keys)) for key in zip(currencies, dates)]
+    rates = [float(get_rate(currency, to_currency, on_date)) for currency, on_date in keys]
+    
+    if np is None:
+        return [round(float(amount) * rates[code], 2) for amount, code in zip(amounts, codes)]
+    
+    codes = np.asarray(codes, dtype=np.intp)
+    return np.round(np.asarray(amounts, dtype=np.float64) * np.asarray(rates)[codes], 2)
+
+
+def set_rate(base, quote, rate, on_date=None, source=None):
+    """Store (or replace) the rate for a pair and date and invalidate every process's memoized rates"""
+    rate = Decimal(str(rate))
+    if rate <= 0:
+        raise ValueError("Exchange rate must be positive")
+    exchange_rate, _ = ExchangeRate.objects.update_or_create(
+        base_currency=base,
+        quote_currency=quote,
+        rate_date=_as_date(on_date),
+        defaults={'rate': rate, 'source': source}
+    )
+    clear_rate_cache()
+    return exchange_rate
+
+
+def clear_rate_cache():
+    """New rates version in the shared cache; the old memo entries are no longer used"""
+    cache.set(RATES_VERSION_KEY, uuid.uuid4().hex, None)
+    _memoized_rate.cache_clear()
@@ -0,0 +1,163 @@
+"""
+Local payment gateway stub
+A tiny HTTP server speaking the same JSON API as HttpGatewayClient, for
+tests and local development without a real provider
+"""
+import json
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class GatewayStubHandler(BaseHTTPRequestHandler):
+    """Handles /deposits, /payments/<reference> and /refunds"""
+    
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+    
+    def _send(self, status_code, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+    
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return {}
+    
+    def _replay(self):
+        """Returns: (Idempotency-Key, stored (status, body) for a repeated key or None)"""
+        key = self.headers.get('Idempotency-Key')
+        if key and key in self.server.responses:
+            return key, (200, self.server.responses[key])
+        return key, None
+    
+    def _handle(self, handler):
+        """Count the request, answer 503 while failures are left, otherwise run handler() for (status, body)"""
+        server = self.server
+        with server.lock:
+            server.request_count += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            failing = server.failures > 0
+            if failing:
+                server.failures -= 1
+        try:
+            if server.latency:
+                time.sleep(server.latency)
+            if failing:
+                result = (503, {"status": "error", "message": "Service unavailable (Gateway Stub)"})
+            else:
+                result = handler()
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+        self._send(*result)
+    
+    def do_GET(self):
+        self._handle(self._get)
+    
+    def do_POST(self):
+        self._handle(self._post)
+    
+    def _get(self):
+        if not self.path.startswith('/payments/'):
+            return 404, {"status": "error", "message": "Not found"}
+        
+        reference = self.path[len('/payments/'):]
+        known = reference in self.server.references
+        return 200, {
+            "status": "verified" if known else "not_found",
+            "transaction_id": reference,
+            "verified": known,
+            "message": "Payment verified (Gateway Stub)" if known else "Unknown reference (Gateway Stub)"
+        }
+    
+    def _post(self):
+        key, replayed = self._replay()
+        if replayed:
+            return replayed
+        
+        body = self._read_json()
+        if self.path == '/deposits':
+            reference = body.get('reference') or f"DEP-{uuid.uuid4().hex[:12].upper()}"
+            response = {
+                "status": self.server.deposit_status,
+                "transaction_id": reference,
+                "amount": body.get('amount'),
+                "payment_method": body.get('payment_method'),
+                "message": "Deposit accepted (Gateway Stub)"
+            }
+        elif self.path == '/refunds':
+            reference = body.get('reference') or f"REF-{uuid.uuid4().hex[:12].upper()}"
+            response = {
+                "status": "success",
+                "refund_id": reference,
+                "original_transaction": body.get('original_reference'),
+                "amount": body.get('amount'),
+                "message": "Refund processed successfully (Gateway Stub)"
+            }
+        else:
+            return 404, {"status": "error", "message": "Not found"}
+        
+        with self.server.lock:
+            self.server.references.add(reference)
+            if key:
+                self.server.responses[key] = response
+        return 200, response
+
+
+class GatewayStubServer(ThreadingHTTPServer):
+    """
+    Threaded stub gateway. Use as a context manager to run it in the
+    background:
+        
+        with GatewayStubServer() as stub:
+            client = HttpGatewayClient(stub.url)
+    
+    The first `failures` requests are answered with 503. request_count and
+    max_in_flight record how many requests arrived and how many were served
+    at once.
+    """
+    daemon_threads = True
+    
+    def __init__(self, host='127.0.0.1', port=0, latency=0, deposit_status='success', failures=0, verbose=False):
+        super().__init__((host, port), GatewayStubHandler)
+        self.latency = latency
+        self.deposit_status = deposit_status
+        self.failures = failures
+        self.verbose = verbose
+        self.request_count = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.references = set()
+        self.responses = {}
+        self.lock = threading.Lock()
+        self._thread = None
+    
+    def handle_error(self, request, client_address):
+        # A client that timed out has closed the connection before the response
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+    
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
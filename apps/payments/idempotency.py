@@ -0,0 +1,138 @@
+"""
+Idempotency-Key support for payment endpoints
+A retried request carrying the same Idempotency-Key gets the stored response
+back without running the view again
+"""
+import functools
+import hashlib
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction as db_transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from apps.payments.models import IdempotencyKey
+
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def get_idempotency_ttl():
+    """Seconds a stored response can be replayed"""
+    return getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)
+
+
+def _cache_key(user_id, scope, key):
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return f"idempotency:{user_id}:{scope}:{digest}"
+
+
+def _request_hash(request, kwargs):
+    payload = json.dumps({'args': kwargs, 'data': request.data}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _replay(request_hash, stored_hash, response_status, response_body):
+    if request_hash != stored_hash:
+        return Response({
+            'success': False,
+            'error': 'Idempotency-Key was already used with a different request'
+        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    response = Response(response_body, status=response_status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(scope):
+    """
+    Make a view replayable with an Idempotency-Key header.
+    
+    The stored response is looked up in the local cache first, then in the
+    IdempotencyKey table. The first request reserves the key in the database
+    (unique per user, scope and key), so a concurrent retry gets 409 instead
+    of running the view twice. 5xx responses and exceptions release the key
+    so the client can retry. Requests without the header are not affected.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return view(request, *args, **kwargs)
+            
+            if len(key) > MAX_KEY_LENGTH:
+                return Response({
+                    'success': False,
+                    'error': f'Idempotency-Key must be at most {MAX_KEY_LENGTH} characters'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            user_id = request.user.pk
+            request_hash = _request_hash(request, kwargs)
+            cache_key = _cache_key(user_id, scope, key)
+            
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return _replay(request_hash, *cached)
+            
+            now = timezone.now()
+            ttl = get_idempotency_ttl()
+            lookup = {'user_id': user_id, 'scope': scope, 'key': key}
+            
+            # Expired keys are evicted lazily so they can be reused
+            IdempotencyKey.objects.filter(expires_at__lte=now, **lookup).delete()
+            try:
+                with db_transaction.atomic():
+                    record = IdempotencyKey.objects.create(
+                        request_hash=request_hash,
+                        expires_at=now + timedelta(seconds=ttl),
+                        **lookup
+                    )
+            except IntegrityError:
+                stored = IdempotencyKey.objects.filter(**lookup).values_list(
+                    'request_hash', 'response_status', 'response_body', 'expires_at'
+                ).first()
+                if stored is None or stored[1] is None:
+                    return Response({
+                        'success': False,
+                        'error': 'A request with this Idempotency-Key is still being processed'
+                    }, status=status.HTTP_409_CONFLICT)
+                remaining = int((stored[3] - now).total_seconds())
+                if remaining > 0:
+                    cache.set(cache_key, stored[:3], remaining)
+                return _replay(request_hash, *stored[:3])
+            
+            try:
+                response = view(request, *args, **kwargs)
+            except Exception:
+                record.delete()
+                raise
+            
+            if response.status_code >= 500:
+                record.delete()
+                return response
+            
+            record.response_status = response.status_code
+            record.response_body = json.loads(json.dumps(response.data, default=str))
+            record.save(update_fields=['response_status', 'response_body', 'updated_at'])
+            cache.set(cache_key, (request_hash, record.response_status, record.response_body), ttl)
+            
+            return response
+        return wrapper
+    return decorator
+
+
+def purge_expired_idempotency_keys(batch_size=1000):
+    """Delete expired keys in batches, returns the number deleted"""
+    deleted = 0
+    now = timezone.now()
+    while True:
+        ids = list(
+            IdempotencyKey.objects.filter(expires_at__lte=now)
+            .values_list('idempotency_key_id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(idempotency_key_id__in=ids).delete()[0]
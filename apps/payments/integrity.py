@@ -0,0 +1,178 @@
+"""
+Wallet ledger integrity checks
+Streams every wallet's WalletTransaction chain in created_at order and
+checks it for continuity and against the wallet balance
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from itertools import islice
+from django.db import connections
+from django.db.models import Sum
+from apps.payments.models import Wallet, WalletBalanceShard, WalletTransaction
+
+
+VERIFY_BATCH_SIZE = 200
+ITERATOR_CHUNK_SIZE = 5000
+MAX_DISCREPANCIES_PER_WALLET = 20
+ZERO = Decimal('0.00')
+
+
+class _LedgerCheck:
+    """Running checks over one wallet's settled ledger rows"""
+    
+    def __init__(self, wallet_id):
+        self.wallet_id = wallet_id
+        self.transactions = 0
+        self.opening_balance = None
+        self.previous_balance = None
+        self.net = ZERO
+        self.discrepancies = []
+        self.discrepancy_count = 0
+    
+    def report(self, kind, transaction_id=None, expected=None, actual=None):
+        self.discrepancy_count += 1
+        if len(self.discrepancies) < MAX_DISCREPANCIES_PER_WALLET:
+            self.discrepancies.append({
+                'type': kind,
+                'transaction_id': transaction_id,
+                'expected': str(expected),
+                'actual': str(actual),
+            })
+    
+    def add(self, transaction_id, transaction_type, amount, balance_before, balance_after, chained):
+        self.transactions += 1
+        signed = -amount if transaction_type in WalletTransaction.DEBIT_TYPES else amount
+        
+        if self.opening_balance is None:
+            self.opening_balance = balance_before
+            if balance_before != ZERO:
+                self.report('opening_balance', transaction_id, ZERO, balance_before)
+        elif chained and balance_before != self.previous_balance:
+            self.report('chain_break', transaction_id, self.previous_balance, balance_before)
+        
+        if balance_before + signed != balance_after:
+            self.report('amount_mismatch', transaction_id, balance_before + signed, balance_after)
+        
+        self.net += signed
+        self.previous_balance = balance_after
+    
+    def finish(self, balance):
+        expected = (self.opening_balance or ZERO) + self.net
+        if expected != balance:
+            self.report('balance_mismatch', None, expected, balance)
+        if not self.discrepancy_count:
+            return None
+        return {
+            'wallet_id': self.wallet_id,
+            'transactions': self.transactions,
+            'discrepancy_count': self.discrepancy_count,
+            'discrepancies': self.discrepancies,
+        }
+
+
+def _wallet_balances(wallet_ids):
+    """wallet_id -> (total balance, sharded)"""
+    balances = {
+        wallet_id: (balance, bool(shards))
+        for wallet_id, balance, shards in Wallet.objects.filter(
+            wallet_id__in=wallet_ids
+        ).values_list('wallet_id', 'balance', 'balance_shards')
+    }
+    shard_totals = (
+        WalletBalanceShard.objects.filter(wallet_id__in=wallet_ids)
+        .order_by()
+        .values('wallet_id')
+        .annotate(total=Sum('balance'))
+        .values_list('wallet_id', 'total')
+    )
+    for wallet_id, total in shard_totals:
+        if wallet_id in balances:
+            balance, sharded = balances[wallet_id]
+            balances[wallet_id] = (balance + total, sharded)
+    return balances
+
+
+def verify_wallet_batch(wallet_ids):
+    """
+    Verify a batch of wallets.
+    
+    The settled ledger rows of the whole batch are streamed with one query
+    ordered by (wallet, created_at, pk), through a server-side cursor on
+    PostgreSQL, so memory use does not depend on the ledger size. Each row
+    must satisfy balance_before +/- amount == balance_after and continue the
+    previous row's balance_after, and the opening balance plus the net of
+    all rows must equal the wallet balance. Sharded wallets write their
+    balance_before/balance_after from concurrent views of the total, so only
+    the per-row arithmetic and the final balance are checked for them.
+    
+    Returns a dict with the number of wallets and transactions checked and
+    the wallets with discrepancies.
+    """
+    balances = _wallet_balances(wallet_ids)
+    rows = (
+        WalletTransaction.objects.filter(wallet_id__in=list(balances), status='success')
+        .order_by('wallet_id', 'created_at', 'pk')
+        .values_list('wallet_id', 'transaction_id', 'transaction_type', 'amount', 'balance_before', 'balance_after')
+        .iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+    )
+    
+    checks = {}
+    transactions = 0
+    for wallet_id, *row in rows:
+        check = checks.get(wallet_id)
+        if check is None:
+            check = checks[wallet_id] = _LedgerCheck(wallet_id)
+        check.add(*row, chained=not balances[wallet_id][1])
+        transactions += 1
+    
+    discrepancies = []
+    for wallet_id, (balance, _) in sorted(balances.items()):
+        result = checks.get(wallet_id, _LedgerCheck(wallet_id)).finish(balance)
+        if result:
+            discrepancies.append(result)
+    
+    return {
+        'wallets': len(balances),
+        'transactions': transactions,
+        'discrepancies': discrepancies,
+    }
+
+
+def _init_worker():
+    import django
+    django.setup()
+    # Never reuse database connections inherited from the parent process
+    connections.close_all()
+
+
+def _batches(wallet_ids, batch_size):
+    wallet_ids = iter(wallet_ids)
+    while True:
+        batch = list(islice(wallet_ids, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def verify_wallets(wallet_ids=None, workers=None, batch_size=VERIFY_BATCH_SIZE):
+    """
+    Verify all (or the given) wallets, yielding verify_wallet_batch() results
+    in wallet_id order. Batches are spread over a pool of `workers`
+    processes (default: one per CPU); `workers=1` runs in this process.
+    Balances are compared as they are when each batch is read, so run it on
+    a quiet system or re-check the reported wallets.
+    """
+    if wallet_ids is None:
+        wallet_ids = list(Wallet.objects.order_by('wallet_id').values_list('wallet_id', flat=True))
+    batches = _batches(wallet_ids, batch_size)
+    workers = workers or os.cpu_count() or 1
+    
+    if workers == 1:
+        for batch in batches:
+            yield verify_wallet_batch(batch)
+        return
+    
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        yield from executor.map(verify_wallet_batch, batches)
@@ -0,0 +1,101 @@
+import threading
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import connection
+from apps.customers.models import Customer
+from apps.organizations.models import Organization
+from apps.payments.models import Wallet
+
+
+class Command(BaseCommand):
+    help = (
+        'Run concurrent deposits and withdrawals against one wallet per shard count and report throughput '
+        'and lost updates. Writes a benchmark organization, customers and wallets: use a scratch database'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--operations', type=int, default=400, help='Operations per run, shared by the threads')
+        parser.add_argument('--amount', type=Decimal, default=Decimal('1.00'))
+        parser.add_argument('--shards', type=int, nargs='+', default=[0],
+                            help='Shard counts to compare, 0 keeps the balance on the wallet row')
+    
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            self.stdout.write(self.style.WARNING(
+                'SQLite has no row locks and serializes writers, run against PostgreSQL for meaningful numbers'
+            ))
+        
+        organization = Organization.objects.create(
+            name='Benchmark', address='-', contact_phone='-', contact_email='benchmark@example.com', status='active'
+        )
+        for shard_count in options['shards']:
+            wallet = Wallet.objects.create(
+                customer=Customer.objects.create(customer_name='Benchmark', phone_number='-', organization=organization)
+            )
+            wallet.deposit(options['amount'] * options['operations'], f'BENCH-{wallet.pk}-OPEN')
+            if shard_count:
+                wallet.set_balance_shards(shard_count)
+            label = f'{shard_count} shards' if shard_count else 'single row'
+            self.report(label, self.run(wallet, options))
+    
+    def run(self, wallet, options):
+        """Alternate withdrawals and deposits of `amount` from `threads` threads"""
+        amount = options['amount']
+        operations = options['operations']
+        threads = options['threads']
+        
+        opening = Wallet.objects.get(pk=wallet.pk).current_balance
+        
+        barrier = threading.Barrier(threads)
+        lock = threading.Lock()
+        counts = {'deposit': 0, 'withdrawal': 0, 'error': 0}
+        
+        def worker(offset):
+            instance = Wallet.objects.get(pk=wallet.pk)
+            barrier.wait()
+            try:
+                for i in range(offset, operations, threads):
+                    reference = f'BENCH-{wallet.pk}-{i}'
+                    try:
+                        if i % 2:
+                            instance.deposit(amount, reference)
+                            operation = 'deposit'
+                        else:
+                            instance.withdraw(amount, reference)
+                            operation = 'withdrawal'
+                    except Exception:
+                        operation = 'error'
+                    with lock:
+                        counts[operation] += 1
+            finally:
+                connection.close()
+        
+        workers = [threading.Thread(target=worker, args=(offset,)) for offset in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        
+        wallet = Wallet.objects.get(pk=wallet.pk)
+        expected = opening + amount * (counts['deposit'] - counts['withdrawal'])
+        return {
+            'succeeded': counts['deposit'] + counts['withdrawal'],
+            'errors': counts['error'],
+            'seconds': elapsed,
+            'lost': expected - wallet.current_balance,
+        }
+    
+    def report(self, label, result):
+        line = (
+            f"{label}: {result['succeeded']} operation(s) in {result['seconds']:.2f}s "
+            f"({result['succeeded'] / result['seconds']:.0f}/s), {result['errors']} error(s), "
+            f"balance off by ${result['lost']}"
+        )
+        if result['lost']:
+            self.stdout.write(self.style.ERROR(f'✗ {line}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'✓ {line}'))
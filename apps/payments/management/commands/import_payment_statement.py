@@ -0,0 +1,50 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from apps.payments.reconciliation import import_payment_statement, STATEMENT_CHUNK_SIZE, STATEMENT_FORMATS
+from apps.users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Reconcile a gateway/bank payment statement (CSV or JSON lines) against pending invoices'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path to the statement file')
+        parser.add_argument('--format', choices=STATEMENT_FORMATS, help='Statement format (default: from file extension)')
+        parser.add_argument('--payment-method', default='mobile_money', help='Payment method for lines without one')
+        parser.add_argument('--user', help='Username recorded as the processor of the payments')
+        parser.add_argument('--chunk-size', type=int, default=STATEMENT_CHUNK_SIZE)
+        parser.add_argument('--report', help='Write the full reconciliation report to this JSON file')
+    
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']} not found")
+        
+        try:
+            with open(path, encoding='utf-8-sig', newline='') as statement:
+                report = import_payment_statement(
+                    statement,
+                    file_format=file_format,
+                    payment_method=options['payment_method'],
+                    user=user,
+                    chunk_size=options['chunk_size']
+                )
+        except OSError as e:
+            raise CommandError(str(e))
+        
+        if options['report']:
+            with open(options['report'], 'w') as output:
+                json.dump(report, output, indent=2)
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ {report['matched']} of {report['total_lines']} line(s) matched (${report['matched_amount']})"
+        ))
+        self.stdout.write(f"  Duplicates: {len(report['duplicates'])}")
+        self.stdout.write(f"  Unmatched: {len(report['unmatched'])}")
+        self.stdout.write(f"  Invalid: {len(report['invalid'])}")
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from apps.payments.models import Refund, RefundBatch
+from apps.payments.refunds import process_refund_batch, process_refunds, resumable_refunds, REFUND_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Process pending refunds and resume failed or interrupted ones'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, dest='batch_id', help='Only process this refund batch')
+        parser.add_argument('--chunk-size', type=int, default=REFUND_CHUNK_SIZE,
+                            help='Refunds claimed per chunk')
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Concurrent gateway requests (default: the gateway MAX_CONCURRENCY setting)')
+    
+    def handle(self, *args, **options):
+        if options['batch_id']:
+            try:
+                batches = [RefundBatch.objects.get(batch_id=options['batch_id'])]
+            except RefundBatch.DoesNotExist:
+                raise CommandError(f"Refund batch {options['batch_id']} not found")
+        else:
+            batch_ids = Refund.objects.filter(
+                resumable_refunds(), batch__isnull=False
+            ).order_by('batch_id').values_list('batch_id', flat=True).distinct()
+            batches = RefundBatch.objects.filter(batch_id__in=list(batch_ids)).order_by('batch_id')
+        
+        completed = failed = 0
+        for batch in batches:
+            counts = process_refund_batch(batch, options['chunk_size'], options['concurrency'])
+            completed += counts['completed']
+            failed += counts['failed']
+            self.stdout.write(f"  Batch {batch.batch_id}: {counts['completed']} completed, {counts['failed']} failed ({batch.status})")
+        
+        if not options['batch_id']:
+            # Single refunds outside any batch
+            counts = process_refunds(
+                Refund.objects.filter(resumable_refunds(), batch__isnull=True)
+                .order_by('refund_id').values_list('refund_id', flat=True),
+                options['chunk_size'], options['concurrency']
+            )
+            completed += counts['completed']
+            failed += counts['failed']
+        
+        summary = f'{completed} refund(s) completed, {failed} failed'
+        if failed:
+            self.stdout.write(self.style.ERROR(f'✗ {summary}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'✓ {summary}'))
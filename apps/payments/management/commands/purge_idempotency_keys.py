@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from apps.payments.idempotency import purge_expired_idempotency_keys
+
+
+class Command(BaseCommand):
+    help = 'Delete expired Idempotency-Key records'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+    
+    def handle(self, *args, **options):
+        deleted = purge_expired_idempotency_keys(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'✓ Deleted {deleted} expired idempotency key(s)'))
@@ -0,0 +1,41 @@
+import time
+from django.core.management.base import BaseCommand
+from apps.payments.confirmations import reconcile_gateway_operations, RECONCILE_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Verify stale pending deposits and payments with the gateway and finalize them'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=RECONCILE_BATCH_SIZE,
+                            help='Pending operations verified per batch')
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Concurrent gateway requests (default: the gateway MAX_CONCURRENCY setting)')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep running, sleeping this many seconds after each partial batch')
+    
+    def handle(self, *args, **options):
+        totals = {'checked': 0, 'completed': 0, 'failed': 0, 'pending': 0}
+        try:
+            while True:
+                counts = reconcile_gateway_operations(options['batch_size'], options['concurrency'])
+                for key, value in counts.items():
+                    totals[key] += value
+                if counts['checked']:
+                    self.stdout.write(
+                        f"  ... {counts['checked']} checked: {counts['completed']} completed, "
+                        f"{counts['failed']} failed, {counts['pending']} still pending"
+                    )
+                if counts['checked'] == options['batch_size']:
+                    # Full batch, more operations may be waiting
+                    continue
+                if options['interval'] is None:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ {totals['checked']} operation(s) checked: {totals['completed']} completed, "
+            f"{totals['failed']} failed, {totals['pending']} still pending"
+        ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from apps.payments.utils import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = 'Release wallet holds that expired before being captured or released'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+    
+    def handle(self, *args, **options):
+        released = release_expired_holds(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'✓ Released {released} expired hold(s)'))
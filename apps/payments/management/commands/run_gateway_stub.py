@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from apps.payments.gateway_stub import GatewayStubServer
+
+
+class Command(BaseCommand):
+    help = 'Run a local payment gateway stub for development and tests'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8089)
+        parser.add_argument('--latency', type=float, default=0, help='Seconds to sleep before each response')
+        parser.add_argument('--deposit-status', choices=['success', 'pending'], default='success')
+    
+    def handle(self, *args, **options):
+        server = GatewayStubServer(
+            host=options['host'],
+            port=options['port'],
+            latency=options['latency'],
+            deposit_status=options['deposit_status'],
+            verbose=True
+        )
+        self.stdout.write(self.style.SUCCESS(f'✓ Gateway stub listening on {server.url}'))
+        self.stdout.write('  Set PAYMENT_GATEWAY_BACKEND=http and PAYMENT_GATEWAY_URL to use it')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
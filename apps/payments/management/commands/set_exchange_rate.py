@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from apps.payments.fx import set_rate
+
+
+class Command(BaseCommand):
+    help = 'Store the exchange rate of a currency pair for a date (1 BASE = RATE QUOTE)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('base', help='Base currency, e.g. USD')
+        parser.add_argument('quote', help='Quote currency, e.g. TZS')
+        parser.add_argument('rate')
+        parser.add_argument('--date', help='Rate date YYYY-MM-DD (default: today)')
+        parser.add_argument('--source', help='Where the rate comes from, e.g. BOT')
+    
+    def handle(self, *args, **options):
+        on_date = None
+        if options['date']:
+            on_date = parse_date(options['date'])
+            if on_date is None:
+                raise CommandError('Invalid date, use YYYY-MM-DD')
+        
+        try:
+            exchange_rate = set_rate(
+                options['base'].upper(), options['quote'].upper(), options['rate'],
+                on_date=on_date, source=options['source']
+            )
+        except (ValueError, ArithmeticError) as e:
+            raise CommandError(f'Invalid rate: {e}')
+        
+        self.stdout.write(self.style.SUCCESS(f'✓ {exchange_rate}'))
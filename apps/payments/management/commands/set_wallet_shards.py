@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from apps.payments.models import Wallet
+
+
+class Command(BaseCommand):
+    help = 'Spread a wallet balance over N shards (0 folds it back onto the wallet row)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('wallet_id', type=int)
+        parser.add_argument('shard_count', type=int)
+    
+    def handle(self, *args, **options):
+        try:
+            wallet = Wallet.objects.get(wallet_id=options['wallet_id'])
+        except Wallet.DoesNotExist:
+            raise CommandError(f"Wallet {options['wallet_id']} not found")
+        
+        try:
+            wallet.set_balance_shards(options['shard_count'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Wallet {wallet.wallet_id} now uses {wallet.balance_shards} shard(s), '
+            f'balance ${wallet.current_balance}'
+        ))
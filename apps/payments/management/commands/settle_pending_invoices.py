@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from apps.payments.utils import settle_all_pending_invoices, SETTLEMENT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Settle unpaid invoices from auto-pay wallets, oldest first'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=SETTLEMENT_CHUNK_SIZE,
+                            help='Wallets processed per chunk')
+        parser.add_argument('--after-wallet-id', type=int, default=0,
+                            help='Resume after this wallet_id (printed after every chunk)')
+    
+    def handle(self, *args, **options):
+        wallets = invoices = 0
+        for last_wallet_id, processed, settled in settle_all_pending_invoices(
+            after_wallet_id=options['after_wallet_id'],
+            chunk_size=options['chunk_size']
+        ):
+            wallets += processed
+            invoices += settled
+            self.stdout.write(f'  ... {wallets} wallet(s), {invoices} invoice(s) settled, last wallet_id {last_wallet_id}')
+        
+        self.stdout.write(self.style.SUCCESS(f'✓ Settled {invoices} invoice(s) from {wallets} wallet(s)'))
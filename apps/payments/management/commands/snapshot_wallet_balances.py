@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from apps.payments.statements import SNAPSHOT_PERIODS, build_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Write daily/monthly wallet balance snapshots for every complete period since the last run'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--period', choices=SNAPSHOT_PERIODS, action='append',
+                            help='Snapshot period (repeatable, default: daily and monthly)')
+        parser.add_argument('--wallet', type=int, action='append', dest='wallet_ids',
+                            help='Only snapshot this wallet (repeatable)')
+    
+    def handle(self, *args, **options):
+        for period in options['period'] or SNAPSHOT_PERIODS:
+            created = build_snapshots(period=period, wallet_ids=options['wallet_ids'])
+            self.stdout.write(self.style.SUCCESS(f'✓ Created {created} {period} snapshot(s)'))
@@ -0,0 +1,45 @@
+import json
+from django.core.management.base import BaseCommand
+from apps.payments.integrity import verify_wallets, VERIFY_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Check wallet transaction chains for continuity and against wallet balances'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Worker processes (default: one per CPU)')
+        parser.add_argument('--batch-size', type=int, default=VERIFY_BATCH_SIZE,
+                            help='Wallets per worker task')
+        parser.add_argument('--wallet', type=int, action='append', dest='wallet_ids',
+                            help='Only verify this wallet (repeatable)')
+        parser.add_argument('--report', help='Write one JSON line per wallet with discrepancies to this file')
+    
+    def handle(self, *args, **options):
+        report = open(options['report'], 'w') if options['report'] else None
+        wallets = transactions = flagged = 0
+        
+        try:
+            for result in verify_wallets(
+                wallet_ids=options['wallet_ids'],
+                workers=options['workers'],
+                batch_size=options['batch_size']
+            ):
+                wallets += result['wallets']
+                transactions += result['transactions']
+                flagged += len(result['discrepancies'])
+                for wallet in result['discrepancies']:
+                    line = json.dumps(wallet)
+                    if report:
+                        report.write(line + '\n')
+                    else:
+                        self.stdout.write(line)
+        finally:
+            if report:
+                report.close()
+        
+        summary = f'{wallets} wallet(s), {transactions} transaction(s) checked, {flagged} wallet(s) with discrepancies'
+        if flagged:
+            self.stdout.write(self.style.ERROR(f'✗ {summary}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'✓ {summary}'))
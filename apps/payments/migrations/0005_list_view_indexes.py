@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0003_list_view_indexes'),
+        ('payments', '0004_idempotencykey'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['-created_at'], name='payment_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wallettransaction',
+            index=models.Index(fields=['wallet', '-created_at'], name='wallet_txn_wallet_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wallettransaction',
+            index=models.Index(fields=['wallet', 'transaction_type', '-created_at'], name='wallet_txn_wallet_type_idx'),
+        ),
+    ]
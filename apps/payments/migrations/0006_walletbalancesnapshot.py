@@ -0,0 +1,40 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0005_list_view_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletBalanceSnapshot',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('snapshot_id', models.AutoField(primary_key=True, serialize=False)),
+                ('period', models.CharField(choices=[('daily', 'Daily'), ('monthly', 'Monthly')], max_length=10)),
+                ('period_start', models.DateTimeField()),
+                ('period_end', models.DateTimeField(help_text='Exclusive end of the period')),
+                ('opening_balance', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('closing_balance', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('total_credits', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('total_debits', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('transaction_count', models.PositiveIntegerField(default=0)),
+                ('last_transaction_id', models.IntegerField(help_text='Last WalletTransaction included in the snapshot')),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='payments.wallet')),
+            ],
+            options={
+                'verbose_name': 'Wallet Balance Snapshot',
+                'verbose_name_plural': 'Wallet Balance Snapshots',
+                'db_table': 'wallet_balance_snapshots',
+                'ordering': ['-period_end'],
+                'indexes': [models.Index(fields=['wallet', 'period', '-period_end'], name='wallet_snapshot_end_idx')],
+                'constraints': [models.UniqueConstraint(fields=('wallet', 'period', 'period_start'), name='unique_wallet_snapshot_period')],
+            },
+        ),
+    ]
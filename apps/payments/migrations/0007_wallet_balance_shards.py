@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('payments', '0006_walletbalancesnapshot'),
+    ]
+    
+    operations = [
+        migrations.AddField(
+            model_name='wallet',
+            name='balance_shards',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Number of balance sub-counters for high-volume wallets, 0 keeps the balance on the wallet row'),
+        ),
+        migrations.CreateModel(
+            name='WalletBalanceShard',
+            fields=[
+                ('shard_id', models.AutoField(primary_key=True, serialize=False)),
+                ('shard_index', models.PositiveSmallIntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, default=0.0, max_digits=10)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='payments.wallet')),
+            ],
+            options={
+                'verbose_name': 'Wallet Balance Shard',
+                'verbose_name_plural': 'Wallet Balance Shards',
+                'db_table': 'wallet_balance_shards',
+                'ordering': ['wallet', 'shard_index'],
+                'constraints': [models.UniqueConstraint(fields=('wallet', 'shard_index'), name='unique_wallet_shard_index')],
+            },
+        ),
+    ]
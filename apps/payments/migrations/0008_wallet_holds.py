@@ -0,0 +1,49 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('invoices', '0003_list_view_indexes'),
+        ('payments', '0007_wallet_balance_shards'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+    
+    operations = [
+        migrations.AddField(
+            model_name='wallet',
+            name='held_balance',
+            field=models.DecimalField(decimal_places=2, default=0.0, help_text='Funds reserved by active holds', max_digits=10),
+        ),
+        migrations.CreateModel(
+            name='WalletHold',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('hold_id', models.AutoField(primary_key=True, serialize=False)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('captured_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('status', models.CharField(choices=[('active', 'Active'), ('captured', 'Captured'), ('released', 'Released'), ('expired', 'Expired')], default='active', max_length=20)),
+                ('reference', models.CharField(db_index=True, max_length=100)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('expires_at', models.DateTimeField()),
+                ('captured_at', models.DateTimeField(blank=True, null=True)),
+                ('released_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='wallet_holds', to=settings.AUTH_USER_MODEL)),
+                ('invoice', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='wallet_holds', to='invoices.invoice')),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='payments.wallet')),
+                ('wallet_transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='holds', to='payments.wallettransaction')),
+            ],
+            options={
+                'verbose_name': 'Wallet Hold',
+                'verbose_name_plural': 'Wallet Holds',
+                'db_table': 'wallet_holds',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'expires_at'], name='wallet_hold_status_exp_idx'), models.Index(fields=['wallet', '-created_at'], name='wallet_hold_wallet_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0008_wallet_holds'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed'), ('refunded', 'Refunded')], default='pending', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='RefundBatch',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('batch_id', models.AutoField(primary_key=True, serialize=False)),
+                ('reason', models.TextField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('partially_failed', 'Partially Failed')], default='pending', max_length=20)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='refund_batches', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Refund Batch',
+                'verbose_name_plural': 'Refund Batches',
+                'db_table': 'refund_batches',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Refund',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('refund_id', models.AutoField(primary_key=True, serialize=False)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('reference', models.CharField(help_text='Sent to the gateway as the idempotency key', max_length=100, unique=True)),
+                ('reason', models.TextField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('gateway_response', models.JSONField(blank=True, null=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='refunds', to=settings.AUTH_USER_MODEL)),
+                ('payment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='refund', to='payments.payment')),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='refunds', to='payments.transaction')),
+                ('wallet_transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='refunds', to='payments.wallettransaction')),
+                ('batch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='refunds', to='payments.refundbatch')),
+            ],
+            options={
+                'verbose_name': 'Refund',
+                'verbose_name_plural': 'Refunds',
+                'db_table': 'refunds',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['batch', 'status'], name='refund_batch_status_idx'), models.Index(fields=['status', 'created_at'], name='refund_status_created_idx')],
+            },
+        ),
+    ]
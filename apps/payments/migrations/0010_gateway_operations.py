@@ -0,0 +1,45 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0009_refunds'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GatewayOperation',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('operation_id', models.AutoField(primary_key=True, serialize=False)),
+                ('operation_type', models.CharField(choices=[('deposit', 'Wallet Deposit'), ('payment', 'Invoice Payment')], max_length=20)),
+                ('reference', models.CharField(help_text='Reference the gateway confirms', max_length=100, unique=True)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('payment_method', models.CharField(max_length=50)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('gateway_response', models.JSONField(blank=True, help_text='Latest response or callback from the gateway', null=True)),
+                ('checks', models.PositiveIntegerField(default=0, help_text='Times the reconciliation worker polled the gateway')),
+                ('last_checked_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='gateway_operations', to=settings.AUTH_USER_MODEL)),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='gateway_operations', to='payments.payment')),
+                ('wallet', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='gateway_operations', to='payments.wallet')),
+                ('wallet_transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='gateway_operations', to='payments.wallettransaction')),
+            ],
+            options={
+                'verbose_name': 'Gateway Operation',
+                'verbose_name_plural': 'Gateway Operations',
+                'db_table': 'gateway_operations',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='gateway_op_status_created_idx')],
+            },
+        ),
+    ]
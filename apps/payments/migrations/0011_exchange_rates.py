@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0010_gateway_operations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('rate_id', models.AutoField(primary_key=True, serialize=False)),
+                ('rate_date', models.DateField()),
+                ('base_currency', models.CharField(max_length=3)),
+                ('quote_currency', models.CharField(max_length=3)),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=18)),
+                ('source', models.CharField(blank=True, max_length=50, null=True)),
+            ],
+            options={
+                'verbose_name': 'Exchange Rate',
+                'verbose_name_plural': 'Exchange Rates',
+                'db_table': 'exchange_rates',
+                'ordering': ['-rate_date'],
+                'constraints': [models.UniqueConstraint(fields=('base_currency', 'quote_currency', 'rate_date'), name='exchange_rate_pair_date_uniq')],
+            },
+        ),
+    ]
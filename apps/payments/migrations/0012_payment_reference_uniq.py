@@ -0,0 +1,52 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def normalize_payment_references(apps, schema_editor):
+    """
+    Normalize existing references; a later payment that repeats a reference
+    for the same method gets its payment_id appended so the constraint holds
+    """
+    Payment = apps.get_model('payments', 'Payment')
+    seen = set()
+    changed = []
+    payments = Payment.objects.order_by('payment_id').only('payment_id', 'payment_method', 'payment_reference')
+    for payment in payments.iterator(chunk_size=2000):
+        reference = ''.join(payment.payment_reference.split()).upper()
+        if (payment.payment_method, reference) in seen:
+            suffix = f"-{payment.payment_id}"
+            reference = reference[:100 - len(suffix)] + suffix
+        seen.add((payment.payment_method, reference))
+        if reference != payment.payment_reference:
+            payment.payment_reference = reference
+            changed.append(payment)
+    Payment.objects.bulk_update(changed, ['payment_reference'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0004_unpaid_invoice_index'),
+        ('payments', '0011_exchange_rates'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_payment_references, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='payment',
+            name='payment_reference',
+            field=models.CharField(help_text='Normalized, see apps.payments.references', max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='wallettransaction',
+            name='reference',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AddConstraint(
+            model_name='payment',
+            constraint=models.UniqueConstraint(fields=('payment_reference', 'payment_method'), name='payment_reference_method_uniq'),
+        ),
+    ]
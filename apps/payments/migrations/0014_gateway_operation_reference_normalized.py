@@ -0,0 +1,45 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:01
+
+from django.db import migrations, models
+
+
+def normalize_operation_references(apps, schema_editor):
+    """
+    Normalize existing references like Payment references in 0012. References
+    that are already normalized keep their value; one that would repeat
+    another gets its operation_id appended so the unique constraint holds
+    """
+    GatewayOperation = apps.get_model('payments', 'GatewayOperation')
+    operations = list(GatewayOperation.objects.order_by('operation_id').values_list('operation_id', 'reference'))
+    normalized = {
+        operation_id: ''.join(reference.split()).upper() for operation_id, reference in operations
+    }
+    seen = {reference for operation_id, reference in operations if normalized[operation_id] == reference}
+    
+    changed = []
+    for operation_id, reference in operations:
+        if normalized[operation_id] == reference:
+            continue
+        reference = normalized[operation_id]
+        if reference in seen:
+            suffix = f"-{operation_id}"
+            reference = reference[:100 - len(suffix)] + suffix
+        seen.add(reference)
+        changed.append(GatewayOperation(operation_id=operation_id, reference=reference))
+    GatewayOperation.objects.bulk_update(changed, ['reference'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('payments', '0013_wallet_transaction_created_by'),
+    ]
+    
+    operations = [
+        migrations.RunPython(normalize_operation_references, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='gatewayoperation',
+            name='reference',
+            field=models.CharField(help_text='Reference the gateway confirms, normalized (see apps.payments.references)', max_length=100, unique=True),
+        ),
+    ]
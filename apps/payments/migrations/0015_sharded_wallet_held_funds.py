@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:20
+
+from django.db import migrations
+
+
+def move_held_funds_to_wallet_row(apps, schema_editor):
+    """
+    Sharded wallets now keep the funds of active holds on the wallet row.
+    Move each sharded wallet's held balance out of its shards, in shard
+    order, onto the row
+    """
+    Wallet = apps.get_model('payments', 'Wallet')
+    WalletBalanceShard = apps.get_model('payments', 'WalletBalanceShard')
+    
+    for wallet in Wallet.objects.filter(balance_shards__gt=0, held_balance__gt=0):
+        remaining = wallet.held_balance - wallet.balance
+        for shard in WalletBalanceShard.objects.filter(wallet_id=wallet.pk).order_by('shard_index'):
+            if remaining <= 0:
+                break
+            taken = min(shard.balance, remaining)
+            if taken > 0:
+                shard.balance -= taken
+                shard.save(update_fields=['balance'])
+                remaining -= taken
+        wallet.balance = wallet.held_balance - remaining
+        wallet.save(update_fields=['balance'])
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('payments', '0014_gateway_operation_reference_normalized'),
+    ]
+    
+    operations = [
+        migrations.RunPython(move_held_funds_to_wallet_row, migrations.RunPython.noop),
+    ]
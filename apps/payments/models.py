@@ -1,4 +1,11 @@
-from django.db import models
+import random
+import uuid
+from datetime import timedelta
+from decimal import Decimal, ROUND_DOWN
+from django.conf import settings
+from django.db import models, transaction as db_transaction
+from django.db.models import F
+from django.utils import timezone
 from apps.core.models import TimestampedModel
 
 
@@ -6,7 +13,7 @@ class Payment(TimestampedModel):
     payment_id = models.AutoField(primary_key=True)
     invoice = models.ForeignKey('invoices.Invoice', on_delete=models.CASCADE, related_name='payments')
     amount_paid = models.DecimalField(max_digits=10, decimal_places=2)
-    payment_reference = models.CharField(max_length=100)
+    payment_reference = models.CharField(max_length=100, help_text="Normalized, see apps.payments.references")
     payment_method = models.CharField(max_length=50, choices=[
         ('mobile_money', 'Mobile Money'),
         ('bank', 'Bank Transfer'),
@@ -17,6 +24,7 @@ class Payment(TimestampedModel):
         ('pending', 'Pending'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
+        ('refunded', 'Refunded'),
     ], default='pending')
     processed_by = models.ForeignKey('users.User', on_delete=models.SET_NULL, null=True, related_name='processed_payments')
     processed_at = models.DateTimeField(null=True, blank=True)
@@ -26,7 +34,14 @@ class Payment(TimestampedModel):
         verbose_name = 'Payment'
         verbose_name_plural = 'Payments'
         ordering = ['-created_at']
-        
+        indexes = [
+            models.Index(fields=['-created_at'], name='payment_created_idx'),
+        ]
+        constraints = [
+            # Reference first so lookups by reference alone use the index too
+            models.UniqueConstraint(fields=['payment_reference', 'payment_method'], name='payment_reference_method_uniq'),
+        ]
+    
     def __str__(self):
         return f"Payment {self.payment_reference} - ${self.amount_paid}"
 
@@ -55,7 +70,7 @@ class Transaction(TimestampedModel):
         verbose_name = 'Transaction'
         verbose_name_plural = 'Transactions'
         ordering = ['-created_at']
-        
+    
     def __str__(self):
         return f"{self.transaction_type} - ${self.amount} - {self.status}"
 
@@ -78,7 +93,7 @@ class ReleaseOrder(TimestampedModel):
         db_table = 'release_orders'
         verbose_name = 'Release Order'
         verbose_name_plural = 'Release Orders'
-        
+    
     def __str__(self):
         return f"{self.release_code} - {self.cargo.tracking_number}"
 
@@ -88,103 +103,454 @@ class Wallet(TimestampedModel):
     wallet_id = models.AutoField(primary_key=True)
     customer = models.OneToOneField('customers.Customer', on_delete=models.CASCADE, related_name='wallet')
     balance = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    held_balance = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, help_text="Funds reserved by active holds")
     currency = models.CharField(max_length=3, default='USD')
     is_active = models.BooleanField(default=True)
     auto_payment_enabled = models.BooleanField(default=False, help_text="Auto-pay invoices from wallet when generated")
+    balance_shards = models.PositiveSmallIntegerField(
+        default=0,
+        help_text="Number of balance sub-counters for high-volume wallets, 0 keeps the balance on the wallet row"
+    )
     
     class Meta:
         db_table = 'wallets'
         verbose_name = 'Wallet'
         verbose_name_plural = 'Wallets'
-        
+    
     def __str__(self):
-        return f"Wallet - {self.customer.customer_name} - ${self.balance}"
+        return f"Wallet - {self.customer.customer_name} - ${self.current_balance}"
+    
+    @property
+    def current_balance(self):
+        """Total balance: the wallet row plus its shards when sharded"""
+        if not self.balance_shards:
+            return self.balance
+        return self.balance + sum(shard.balance for shard in self.shards.all())
+    
+    @property
+    def available_balance(self):
+        """Balance that is not reserved by active holds"""
+        return self.current_balance - self.held_balance
     
     def has_sufficient_balance(self, amount):
-        """Check if wallet has sufficient balance"""
-        return self.balance >= amount
+        """Check if wallet has sufficient available balance"""
+        return self.available_balance >= Decimal(str(amount))
     
-    def deposit(self, amount, reference, description=None):
-        """Deposit money into wallet"""
-        from apps.payments.models import WalletTransaction
+    def lock_balance(self):
+        """
+        Lock the wallet row (and every shard when sharded) for the rest of the
+        current transaction, refresh held_balance and return the total balance
+        """
+        balance, self.held_balance = Wallet.objects.select_for_update().values_list(
+            'balance', 'held_balance'
+        ).get(pk=self.pk)
+        if self.balance_shards:
+            balance += sum(
+                WalletBalanceShard.objects.select_for_update()
+                .filter(wallet_id=self.pk)
+                .order_by('shard_index')
+                .values_list('balance', flat=True)
+            )
+        return balance
+    
+    def set_balance_shards(self, shard_count):
+        """
+        Spread the available balance evenly over `shard_count` sub-counters,
+        keeping the funds of active holds on the wallet row, or fold it all
+        back onto the wallet row when `shard_count` is 0. Shards are never
+        deleted, so resharding only moves money between rows. Change the
+        shard count while the wallet is idle.
+        """
+        if shard_count < 0:
+            raise ValueError("Shard count cannot be negative")
         
-        if amount <= 0:
-            raise ValueError("Deposit amount must be positive")
+        with db_transaction.atomic():
+            total = self.lock_balance()
+            available = total - self.held_balance
+            if shard_count and available < 0:
+                raise ValueError("Wallet holds exceed its balance")
+            shards = {
+                shard.shard_index: shard
+                for shard in WalletBalanceShard.objects.select_for_update().filter(wallet_id=self.pk)
+            }
+            for shard_index in range(shard_count):
+                if shard_index not in shards:
+                    shards[shard_index] = WalletBalanceShard(wallet_id=self.pk, shard_index=shard_index)
+            
+            share = (available / shard_count).quantize(Decimal('0.01'), rounding=ROUND_DOWN) if shard_count else Decimal('0.00')
+            for shard_index, shard in shards.items():
+                shard.balance = share if shard_index < shard_count else Decimal('0.00')
+            if shard_count:
+                # Rounding remainder goes to the first shard
+                shards[0].balance += available - share * shard_count
+            
+            existing = [shard for shard in shards.values() if shard.pk]
+            WalletBalanceShard.objects.bulk_create([shard for shard in shards.values() if not shard.pk])
+            WalletBalanceShard.objects.bulk_update(existing, ['balance'])
+            
+            balance = self.held_balance if shard_count else total
+            Wallet.objects.filter(pk=self.pk).update(
+                balance=balance,
+                balance_shards=shard_count,
+                updated_at=timezone.now()
+            )
         
-        balance_before = self.balance
-        self.balance += amount
-        self.save()
+        self.balance = balance
+        self.balance_shards = shard_count
+    
+    def apply_transactions(self, entries):
+        """
+        Apply ledger entries to the wallet in a single database transaction.
         
-        # Create transaction record
-        WalletTransaction.objects.create(
-            wallet=self,
-            transaction_type='deposit',
-            amount=amount,
-            balance_before=balance_before,
-            balance_after=self.balance,
-            reference=reference,
-            description=description or f"Deposit of ${amount}",
-            status='success'
+        The wallet row is locked with SELECT ... FOR UPDATE, the balance is
+        moved with one F() expression UPDATE and the WalletTransaction rows
+        are written with one bulk INSERT. Each entry is a dict with
+        `transaction_type`, `amount`, `reference` and optional `description`
+        plus any extra WalletTransaction fields (invoice, payment, ...).
+        The entries are posted to the general ledger in the same transaction.
+        Returns the created WalletTransaction objects in entry order.
+        
+        Sharded wallets (balance_shards > 0) never lock the wallet row, see
+        _apply_sharded_transactions().
+        """
+        with db_transaction.atomic():
+            return self._apply_transactions(entries)
+    
+    def _apply_transactions(self, entries):
+        """apply_transactions() without a savepoint of its own. Must run inside a transaction."""
+        from apps.ledger.utils import post_wallet_transactions
+        
+        if self.balance_shards:
+            wallet_transactions = self._apply_sharded_transactions(entries)
+        else:
+            wallet_transactions = self._apply_locked_transactions(entries)
+        post_wallet_transactions(wallet_transactions)
+        return wallet_transactions
+    
+    def _apply_locked_transactions(self, entries):
+        """Apply ledger entries under the wallet row lock. Must run inside a transaction."""
+        balance, held_balance = Wallet.objects.select_for_update().values_list(
+            'balance', 'held_balance'
+        ).get(pk=self.pk)
+        
+        wallet_transactions = []
+        for transaction_type, amount, fields in self._parse_entries(entries):
+            if transaction_type in WalletTransaction.DEBIT_TYPES:
+                if balance - held_balance < amount:
+                    raise ValueError("Insufficient wallet balance")
+                balance_after = balance - amount
+            else:
+                balance_after = balance + amount
+            
+            wallet_transactions.append(WalletTransaction(
+                wallet=self,
+                transaction_type=transaction_type,
+                amount=amount,
+                balance_before=balance,
+                balance_after=balance_after,
+                **fields
+            ))
+            balance = balance_after
+        
+        delta = sum(
+            (-t.amount if t.transaction_type in WalletTransaction.DEBIT_TYPES else t.amount)
+            for t in wallet_transactions
+        )
+        Wallet.objects.filter(pk=self.pk).update(
+            balance=F('balance') + delta,
+            updated_at=timezone.now()
         )
+        WalletTransaction.objects.bulk_create(wallet_transactions)
         
-        return self.balance
+        self.balance = balance
+        return wallet_transactions
     
-    def withdraw(self, amount, reference, description=None):
-        """Withdraw money from wallet"""
-        from apps.payments.models import WalletTransaction
+    def _parse_entries(self, entries):
+        """Yield (transaction_type, Decimal amount, other fields) for each entry"""
+        for entry in entries:
+            entry = dict(entry)
+            transaction_type = entry.pop('transaction_type')
+            amount = Decimal(str(entry.pop('amount')))
+            
+            if amount <= 0:
+                raise ValueError(f"{transaction_type.replace('_', ' ').capitalize()} amount must be positive")
+            
+            entry.setdefault('status', 'success')
+            yield transaction_type, amount, entry
+    
+    def _apply_sharded_transactions(self, entries):
+        """
+        Apply ledger entries to a sharded wallet. Must run inside a transaction.
         
-        if amount <= 0:
-            raise ValueError("Withdrawal amount must be positive")
+        The shards only carry the available balance: authorize_hold() moves
+        held funds onto the wallet row. Credits go to a random shard with a
+        blind F() UPDATE. A debit locks one shard that covers the amount with
+        SKIP LOCKED, so concurrent payments spread over the shards instead of
+        queueing on one row; only when no free shard is large enough are all
+        shards locked (in index order) and drained one after another. Shards
+        never go negative, so debits cannot spend held funds.
         
-        if not self.has_sufficient_balance(amount):
-            raise ValueError("Insufficient wallet balance")
+        Debits are not serialized, so balance_before/balance_after are the
+        wallet total as seen by this transaction and do not form a chain;
+        balance_at() and statements sum amounts instead.
+        """
+        entries = list(self._parse_entries(entries))
+        shards = WalletBalanceShard.objects.filter(wallet_id=self.pk)
         
-        balance_before = self.balance
-        self.balance -= amount
-        self.save()
+        if sum(1 for transaction_type, _, _ in entries if transaction_type in WalletTransaction.DEBIT_TYPES) > 1:
+            # Several debits lock shards up front in a fixed order so two
+            # batches can never wait on each other's shards
+            list(shards.select_for_update().order_by('shard_index').values_list('pk', flat=True))
         
-        # Create transaction record
-        WalletTransaction.objects.create(
-            wallet=self,
-            transaction_type='withdrawal',
-            amount=amount,
-            balance_before=balance_before,
-            balance_after=self.balance,
-            reference=reference,
-            description=description or f"Withdrawal of ${amount}",
-            status='success'
+        held_funds = Wallet.objects.values_list('balance', flat=True).get(pk=self.pk)
+        balance = sum(shards.values_list('balance', flat=True), held_funds)
+        
+        wallet_transactions = []
+        for transaction_type, amount, fields in entries:
+            if transaction_type in WalletTransaction.DEBIT_TYPES:
+                # Early exit only, _debit_shards() checks under the shard locks
+                if balance - held_funds < amount:
+                    raise ValueError("Insufficient wallet balance")
+                self._debit_shards(shards, amount)
+                balance_after = balance - amount
+            else:
+                self._credit_shards(self.pk, self.balance_shards, amount)
+                balance_after = balance + amount
+            
+            wallet_transactions.append(WalletTransaction(
+                wallet=self,
+                transaction_type=transaction_type,
+                amount=amount,
+                balance_before=balance,
+                balance_after=balance_after,
+                **fields
+            ))
+            balance = balance_after
+        
+        WalletTransaction.objects.bulk_create(wallet_transactions)
+        return wallet_transactions
+    
+    @staticmethod
+    def _credit_shards(wallet_id, shard_count, amount):
+        WalletBalanceShard.objects.filter(wallet_id=wallet_id, shard_index=random.randrange(shard_count)).update(
+            balance=F('balance') + amount
+        )
+    
+    @classmethod
+    def return_held_funds(cls, wallet_id, shard_count, amount):
+        """
+        Return `amount` of held funds to the available balance. On a sharded
+        wallet the money moves from the wallet row back to a shard.
+        """
+        if not shard_count:
+            Wallet.objects.filter(pk=wallet_id).update(
+                held_balance=F('held_balance') - amount,
+                updated_at=timezone.now()
+            )
+            return
+        Wallet.objects.filter(pk=wallet_id).update(
+            balance=F('balance') - amount,
+            held_balance=F('held_balance') - amount,
+            updated_at=timezone.now()
         )
+        cls._credit_shards(wallet_id, shard_count, amount)
+    
+    def _debit_shards(self, shards, amount):
+        shard_id = (
+            shards.select_for_update(skip_locked=True)
+            .filter(balance__gte=amount)
+            .order_by('?')
+            .values_list('pk', flat=True)
+            .first()
+        )
+        if shard_id is not None:
+            shards.filter(pk=shard_id).update(balance=F('balance') - amount)
+            return
+        
+        # No single free shard covers the amount: lock them all and drain in order
+        locked = list(shards.select_for_update().order_by('shard_index'))
+        if sum(shard.balance for shard in locked) < amount:
+            raise ValueError("Insufficient wallet balance")
         
-        return self.balance
+        remaining = amount
+        for shard in locked:
+            taken = min(shard.balance, remaining)
+            shard.balance -= taken
+            remaining -= taken
+            if not remaining:
+                break
+        WalletBalanceShard.objects.bulk_update(locked, ['balance'])
+    
+    def apply_transaction(self, transaction_type, amount, reference, description=None, **fields):
+        """Apply a single ledger entry to the wallet, see apply_transactions()"""
+        return self.apply_transactions([dict(
+            transaction_type=transaction_type,
+            amount=amount,
+            reference=reference,
+            description=description,
+            **fields
+        )])[0]
+    
+    def deposit(self, amount, reference, description=None, **fields):
+        """Deposit money into wallet"""
+        return self.apply_transaction(
+            'deposit', amount, reference,
+            description or f"Deposit of ${amount}",
+            **fields
+        ).balance_after
+    
+    def withdraw(self, amount, reference, description=None):
+        """Withdraw money from wallet"""
+        return self.apply_transaction(
+            'withdrawal', amount, reference,
+            description or f"Withdrawal of ${amount}"
+        ).balance_after
     
     def pay_invoice(self, invoice, amount, description=None):
         """Pay invoice from wallet"""
-        from apps.payments.models import WalletTransaction
-        
+        return self.apply_transaction(
+            'payment', amount, f"INV-{invoice.control_number}",
+            description or f"Payment for invoice {invoice.control_number}",
+            invoice=invoice
+        ).balance_after
+    
+    def authorize_hold(self, amount, reference=None, description=None, invoice=None, expires_in=None, user=None):
+        """
+        Reserve `amount` of the available balance. The wallet row is locked
+        while the available balance is checked and only the held balance
+        column is updated. On a sharded wallet the amount is debited from the
+        shards onto the wallet row instead, so debits that lock a single
+        shard can never spend it. The money is debited later by
+        capture_hold() or returned by release_hold() / the expired-hold
+        sweeper.
+        Returns the WalletHold.
+        Raises: ValueError if the amount is not positive or not available
+        """
+        amount = Decimal(str(amount))
         if amount <= 0:
-            raise ValueError("Payment amount must be positive")
+            raise ValueError("Hold amount must be positive")
+        if expires_in is None:
+            expires_in = getattr(settings, 'WALLET_HOLD_TTL', 15 * 60)
         
-        if not self.has_sufficient_balance(amount):
-            raise ValueError("Insufficient wallet balance")
+        with db_transaction.atomic():
+            if self.balance_shards:
+                self._debit_shards(WalletBalanceShard.objects.filter(wallet_id=self.pk), amount)
+                Wallet.objects.filter(pk=self.pk).update(
+                    balance=F('balance') + amount,
+                    held_balance=F('held_balance') + amount,
+                    updated_at=timezone.now()
+                )
+                self.balance, self.held_balance = Wallet.objects.values_list(
+                    'balance', 'held_balance'
+                ).get(pk=self.pk)
+            else:
+                balance = self.lock_balance()
+                if balance - self.held_balance < amount:
+                    raise ValueError("Insufficient wallet balance")
+                Wallet.objects.filter(pk=self.pk).update(
+                    held_balance=F('held_balance') + amount,
+                    updated_at=timezone.now()
+                )
+                self.held_balance += amount
+            
+            hold = WalletHold.objects.create(
+                wallet=self,
+                amount=amount,
+                reference=reference or f"HLD-{uuid.uuid4().hex[:12].upper()}",
+                description=description,
+                invoice=invoice,
+                expires_at=timezone.now() + timedelta(seconds=expires_in),
+                created_by=user
+            )
         
-        balance_before = self.balance
-        self.balance -= amount
-        self.save()
+        return hold
+    
+    def capture_hold(self, hold_id, amount=None, transaction_type='payment', description=None, **fields):
+        """
+        Debit a hold: the held amount is released and `amount` (default: the
+        whole hold) is debited through apply_transaction() in the same
+        database transaction. Extra fields (payment, ...) are stored on the
+        WalletTransaction. Returns the WalletTransaction.
+        Raises: ValueError if the hold is not active, has expired or the
+        amount exceeds the hold
+        """
+        with db_transaction.atomic():
+            return self._capture_hold(hold_id, amount, transaction_type, description, **fields)
+    
+    def _capture_hold(self, hold_id, amount, transaction_type, description, **fields):
+        """capture_hold() without a savepoint of its own. Must run inside a transaction."""
+        hold = self._lock_active_hold(hold_id)
+        if hold.expires_at <= timezone.now():
+            raise ValueError("Hold has expired")
         
-        # Create transaction record
-        WalletTransaction.objects.create(
-            wallet=self,
-            transaction_type='payment',
+        amount = hold.amount if amount is None else Decimal(str(amount))
+        if amount > hold.amount:
+            raise ValueError("Capture amount exceeds the held amount")
+        
+        self.return_held_funds(self.pk, self.balance_shards, hold.amount)
+        if 'invoice' not in fields:
+            fields['invoice_id'] = hold.invoice_id
+        wallet_transaction = self._apply_transactions([dict(
+            transaction_type=transaction_type,
             amount=amount,
-            balance_before=balance_before,
-            balance_after=self.balance,
-            reference=f"INV-{invoice.control_number}",
-            description=description or f"Payment for invoice {invoice.control_number}",
-            invoice=invoice,
-            status='success'
-        )
+            reference=hold.reference,
+            description=description or hold.description or f"Capture of hold {hold.reference}",
+            **fields
+        )])[0]
         
-        return self.balance
+        hold.status = 'captured'
+        hold.captured_amount = amount
+        hold.wallet_transaction = wallet_transaction
+        hold.captured_at = timezone.now()
+        hold.save(update_fields=['status', 'captured_amount', 'wallet_transaction', 'captured_at', 'updated_at'])
+        
+        self.held_balance -= hold.amount
+        return wallet_transaction
+    
+    def release_hold(self, hold_id):
+        """Return the funds of an active hold to the available balance"""
+        with db_transaction.atomic():
+            hold = self._lock_active_hold(hold_id)
+            self.return_held_funds(self.pk, self.balance_shards, hold.amount)
+            hold.status = 'released'
+            hold.released_at = timezone.now()
+            hold.save(update_fields=['status', 'released_at', 'updated_at'])
+        
+        self.held_balance -= hold.amount
+        return hold
+    
+    def _lock_active_hold(self, hold_id):
+        try:
+            hold = WalletHold.objects.select_for_update().get(pk=hold_id, wallet_id=self.pk)
+        except WalletHold.DoesNotExist:
+            raise ValueError("Hold not found")
+        if hold.status != 'active':
+            raise ValueError(f"Hold is already {hold.status}")
+        return hold
+
+
+class WalletBalanceShard(models.Model):
+    """
+    Balance sub-counter of a sharded wallet. The shards carry the available
+    balance and the wallet row the funds of active holds, the wallet total
+    is the sum of both
+    """
+    shard_id = models.AutoField(primary_key=True)
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='shards')
+    shard_index = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    
+    class Meta:
+        db_table = 'wallet_balance_shards'
+        verbose_name = 'Wallet Balance Shard'
+        verbose_name_plural = 'Wallet Balance Shards'
+        ordering = ['wallet', 'shard_index']
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'shard_index'], name='unique_wallet_shard_index'),
+        ]
+    
+    def __str__(self):
+        return f"Wallet {self.wallet_id} shard {self.shard_index} - ${self.balance}"
 
 
 class WalletTransaction(TimestampedModel):
@@ -201,7 +567,7 @@ class WalletTransaction(TimestampedModel):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     balance_before = models.DecimalField(max_digits=10, decimal_places=2)
     balance_after = models.DecimalField(max_digits=10, decimal_places=2)
-    reference = models.CharField(max_length=100)
+    reference = models.CharField(max_length=100, db_index=True)
     description = models.TextField(blank=True, null=True)
     invoice = models.ForeignKey('invoices.Invoice', on_delete=models.SET_NULL, null=True, blank=True, related_name='wallet_transactions')
     payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name='wallet_transactions')
@@ -211,13 +577,238 @@ class WalletTransaction(TimestampedModel):
         ('pending', 'Pending'),
     ], default='success')
     gateway_response = models.JSONField(blank=True, null=True, help_text="Response from payment gateway")
+    created_by = models.ForeignKey('users.User', on_delete=models.SET_NULL, null=True, blank=True, related_name='wallet_transactions')
+    
+    # Transaction types that take money out of the wallet
+    DEBIT_TYPES = ('withdrawal', 'payment', 'auto_payment')
     
     class Meta:
         db_table = 'wallet_transactions'
         verbose_name = 'Wallet Transaction'
         verbose_name_plural = 'Wallet Transactions'
         ordering = ['-created_at']
-        
+        indexes = [
+            models.Index(fields=['wallet', '-created_at'], name='wallet_txn_wallet_created_idx'),
+            models.Index(fields=['wallet', 'transaction_type', '-created_at'], name='wallet_txn_wallet_type_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.transaction_type} - ${self.amount} - {self.wallet.customer.customer_name}"
 
+
+
+class WalletHold(TimestampedModel):
+    """Funds reserved on a wallet until they are captured, released or expire"""
+    hold_id = models.AutoField(primary_key=True)
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='holds')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    captured_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=[
+        ('active', 'Active'),
+        ('captured', 'Captured'),
+        ('released', 'Released'),
+        ('expired', 'Expired'),
+    ], default='active')
+    reference = models.CharField(max_length=100, db_index=True)
+    description = models.TextField(blank=True, null=True)
+    invoice = models.ForeignKey('invoices.Invoice', on_delete=models.SET_NULL, null=True, blank=True, related_name='wallet_holds')
+    wallet_transaction = models.ForeignKey(WalletTransaction, on_delete=models.SET_NULL, null=True, blank=True, related_name='holds')
+    expires_at = models.DateTimeField()
+    captured_at = models.DateTimeField(null=True, blank=True)
+    released_at = models.DateTimeField(null=True, blank=True)
+    created_by = models.ForeignKey('users.User', on_delete=models.SET_NULL, null=True, blank=True, related_name='wallet_holds')
+    
+    class Meta:
+        db_table = 'wallet_holds'
+        verbose_name = 'Wallet Hold'
+        verbose_name_plural = 'Wallet Holds'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='wallet_hold_status_exp_idx'),
+            models.Index(fields=['wallet', '-created_at'], name='wallet_hold_wallet_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Hold {self.reference} - ${self.amount} - {self.status}"
+
+
+class RefundBatch(TimestampedModel):
+    """Group of refunds issued together, e.g. for a cancelled vessel"""
+    batch_id = models.AutoField(primary_key=True)
+    reason = models.TextField()
+    status = models.CharField(max_length=20, choices=[
+        ('pending', 'Pending'),
+        ('completed', 'Completed'),
+        ('partially_failed', 'Partially Failed'),
+    ], default='pending')
+    created_by = models.ForeignKey('users.User', on_delete=models.SET_NULL, null=True, blank=True, related_name='refund_batches')
+    
+    class Meta:
+        db_table = 'refund_batches'
+        verbose_name = 'Refund Batch'
+        verbose_name_plural = 'Refund Batches'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Refund batch {self.batch_id} - {self.status}"
+
+
+class Refund(TimestampedModel):
+    """
+    Refund of a payment, back to the wallet that paid it or through the
+    payment gateway. A payment has at most one refund; a failed refund is
+    retried on the same row, so retries never refund twice. A partial refund
+    is therefore final: the rest of the payment cannot be refunded later.
+    """
+    refund_id = models.AutoField(primary_key=True)
+    payment = models.OneToOneField(Payment, on_delete=models.CASCADE, related_name='refund')
+    batch = models.ForeignKey(RefundBatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='refunds')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    reference = models.CharField(max_length=100, unique=True, help_text="Sent to the gateway as the idempotency key")
+    reason = models.TextField(blank=True, null=True)
+    status = models.CharField(max_length=20, choices=[
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ], default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    gateway_response = models.JSONField(blank=True, null=True)
+    wallet_transaction = models.ForeignKey('WalletTransaction', on_delete=models.SET_NULL, null=True, blank=True, related_name='refunds')
+    transaction = models.ForeignKey(Transaction, on_delete=models.SET_NULL, null=True, blank=True, related_name='refunds')
+    processed_at = models.DateTimeField(null=True, blank=True)
+    created_by = models.ForeignKey('users.User', on_delete=models.SET_NULL, null=True, blank=True, related_name='refunds')
+    
+    class Meta:
+        db_table = 'refunds'
+        verbose_name = 'Refund'
+        verbose_name_plural = 'Refunds'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['batch', 'status'], name='refund_batch_status_idx'),
+            models.Index(fields=['status', 'created_at'], name='refund_status_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Refund {self.reference} - ${self.amount} - {self.status}"
+
+
+class GatewayOperation(TimestampedModel):
+    """
+    Deposit or payment started at the gateway and waiting for its
+    confirmation. Nothing is credited or marked paid until the gateway
+    confirms it through the callback endpoint or the reconciliation worker.
+    """
+    operation_id = models.AutoField(primary_key=True)
+    operation_type = models.CharField(max_length=20, choices=[
+        ('deposit', 'Wallet Deposit'),
+        ('payment', 'Invoice Payment'),
+    ])
+    reference = models.CharField(max_length=100, unique=True, help_text="Reference the gateway confirms, normalized (see apps.payments.references)")
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    payment_method = models.CharField(max_length=50)
+    status = models.CharField(max_length=20, choices=[
+        ('pending', 'Pending'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ], default='pending')
+    description = models.TextField(blank=True, null=True)
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, null=True, blank=True, related_name='gateway_operations')
+    payment = models.ForeignKey(Payment, on_delete=models.CASCADE, null=True, blank=True, related_name='gateway_operations')
+    wallet_transaction = models.ForeignKey(WalletTransaction, on_delete=models.SET_NULL, null=True, blank=True, related_name='gateway_operations')
+    gateway_response = models.JSONField(blank=True, null=True, help_text="Latest response or callback from the gateway")
+    checks = models.PositiveIntegerField(default=0, help_text="Times the reconciliation worker polled the gateway")
+    last_checked_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    created_by = models.ForeignKey('users.User', on_delete=models.SET_NULL, null=True, blank=True, related_name='gateway_operations')
+    
+    class Meta:
+        db_table = 'gateway_operations'
+        verbose_name = 'Gateway Operation'
+        verbose_name_plural = 'Gateway Operations'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='gateway_op_status_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.operation_type} {self.reference} - ${self.amount} - {self.status}"
+
+
+class ExchangeRate(TimestampedModel):
+    """Daily exchange rate: 1 unit of base_currency = rate units of quote_currency"""
+    rate_id = models.AutoField(primary_key=True)
+    rate_date = models.DateField()
+    base_currency = models.CharField(max_length=3)
+    quote_currency = models.CharField(max_length=3)
+    rate = models.DecimalField(max_digits=18, decimal_places=8)
+    source = models.CharField(max_length=50, blank=True, null=True)
+    
+    class Meta:
+        db_table = 'exchange_rates'
+        verbose_name = 'Exchange Rate'
+        verbose_name_plural = 'Exchange Rates'
+        ordering = ['-rate_date']
+        constraints = [
+            models.UniqueConstraint(fields=['base_currency', 'quote_currency', 'rate_date'], name='exchange_rate_pair_date_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.base_currency}/{self.quote_currency} {self.rate} on {self.rate_date}"
+
+
+class IdempotencyKey(TimestampedModel):
+    """Stored response for a client-supplied Idempotency-Key header"""
+    idempotency_key_id = models.AutoField(primary_key=True)
+    key = models.CharField(max_length=255)
+    scope = models.CharField(max_length=100, help_text="Endpoint the key was used on")
+    user = models.ForeignKey('users.User', on_delete=models.CASCADE, related_name='idempotency_keys')
+    request_hash = models.CharField(max_length=64, help_text="SHA-256 of the request arguments and body")
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(blank=True, null=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        db_table = 'idempotency_keys'
+        verbose_name = 'Idempotency Key'
+        verbose_name_plural = 'Idempotency Keys'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'scope', 'key'], name='unique_idempotency_key'),
+        ]
+    
+    def __str__(self):
+        return f"{self.scope} - {self.key}"
+
+
+class WalletBalanceSnapshot(TimestampedModel):
+    """Per-period wallet balance and activity totals, built from WalletTransaction"""
+    snapshot_id = models.AutoField(primary_key=True)
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='balance_snapshots')
+    period = models.CharField(max_length=10, choices=[
+        ('daily', 'Daily'),
+        ('monthly', 'Monthly'),
+    ])
+    period_start = models.DateTimeField()
+    period_end = models.DateTimeField(help_text="Exclusive end of the period")
+    opening_balance = models.DecimalField(max_digits=10, decimal_places=2)
+    closing_balance = models.DecimalField(max_digits=10, decimal_places=2)
+    total_credits = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_debits = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    transaction_count = models.PositiveIntegerField(default=0)
+    last_transaction_id = models.IntegerField(help_text="Last WalletTransaction included in the snapshot")
+    
+    class Meta:
+        db_table = 'wallet_balance_snapshots'
+        verbose_name = 'Wallet Balance Snapshot'
+        verbose_name_plural = 'Wallet Balance Snapshots'
+        ordering = ['-period_end']
+        constraints = [
+            models.UniqueConstraint(fields=['wallet', 'period', 'period_start'], name='unique_wallet_snapshot_period'),
+        ]
+        indexes = [
+            models.Index(fields=['wallet', 'period', '-period_end'], name='wallet_snapshot_end_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.wallet_id} {self.period} {self.period_start:%Y-%m-%d} - ${self.closing_balance}"
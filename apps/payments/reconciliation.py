@@ -0,0 +1,212 @@
+"""
+Payment statement reconciliation
+Imports gateway/bank statement files (CSV or JSON lines) in chunks and
+settles the matching invoices with bulk inserts
+"""
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from django.db import IntegrityError, transaction as db_transaction
+from django.utils import timezone
+from apps.core.utils import iter_lines, unique_numbers
+from apps.payments.models import Payment, Transaction, ReleaseOrder
+from apps.payments.references import find_duplicate_references, normalize_reference, payment_references
+from apps.payments.utils import generate_release_code
+from apps.ledger.utils import post_transactions
+
+
+STATEMENT_CHUNK_SIZE = 500
+STATEMENT_FORMATS = ('csv', 'jsonl')
+PAYMENT_METHODS = ('mobile_money', 'bank', 'cash')
+
+
+def _parse_line(row, default_payment_method):
+    """Validate a statement row, returns (parsed dict, error)"""
+    if row is None:
+        return None, 'invalid_line'
+    
+    control_number = (row.get('control_number') or '').strip()
+    reference = normalize_reference(row.get('reference') or row.get('payment_reference'))
+    payment_method = (row.get('payment_method') or default_payment_method).strip()
+    
+    if not control_number or not reference:
+        return None, 'missing_control_number_or_reference'
+    if payment_method not in PAYMENT_METHODS:
+        return None, 'invalid_payment_method'
+    try:
+        amount = Decimal(str(row.get('amount'))).quantize(Decimal('0.01'))
+    except (InvalidOperation, TypeError, ValueError):
+        return None, 'invalid_amount'
+    if amount <= 0:
+        return None, 'invalid_amount'
+    
+    return {
+        'control_number': control_number,
+        'reference': reference,
+        'payment_method': payment_method,
+        'amount': amount,
+        'details': row,
+    }, None
+
+
+def import_payment_statement(lines, file_format='csv', payment_method='mobile_money',
+                             user=None, chunk_size=STATEMENT_CHUNK_SIZE):
+    """
+    Reconcile a payment statement against pending invoices.
+    
+    Lines are read lazily and processed `chunk_size` at a time: invoices are
+    matched by control number with one in_bulk() lookup per chunk, references
+    are screened with the in-memory reference filter and only the ones it
+    flags are checked in the database (one query per chunk), and the Payment,
+    Transaction and ReleaseOrder rows (and their ledger postings) for the
+    matched lines are written with bulk inserts in one database transaction
+    per chunk.
+    
+    Returns a report dict with counts plus the duplicate, unmatched and
+    invalid lines (matched lines are only counted).
+    """
+    report = {
+        'total_lines': 0,
+        'matched': 0,
+        'matched_amount': Decimal('0.00'),
+        'duplicates': [],
+        'unmatched': [],
+        'invalid': [],
+    }
+    settled_invoice_ids = set()
+    
+    statement = iter_lines(lines, file_format)
+    while True:
+        chunk = list(islice(statement, chunk_size))
+        if not chunk:
+            break
+        report['total_lines'] += len(chunk)
+        payment_references.refresh()
+        try:
+            chunk_report = _reconcile_chunk(chunk, payment_method, user, settled_invoice_ids)
+        except IntegrityError:
+            # A reference committed out of payment_id order was missed by the filter
+            chunk_report = _reconcile_chunk(chunk, payment_method, user, settled_invoice_ids, screen=False)
+        for key in ('duplicates', 'unmatched', 'invalid'):
+            report[key].extend(chunk_report[key])
+        report['matched'] += chunk_report['matched']
+        report['matched_amount'] += chunk_report['matched_amount']
+        settled_invoice_ids.update(chunk_report['settled_invoice_ids'])
+    
+    report['matched_amount'] = float(report['matched_amount'])
+    return report
+
+
+def _reconcile_chunk(chunk, default_payment_method, user, settled_invoice_ids, screen=True):
+    """Reconcile one chunk in one database transaction, returns the chunk's report"""
+    from apps.invoices.models import Invoice
+    
+    report = {
+        'matched': 0,
+        'matched_amount': Decimal('0.00'),
+        'duplicates': [],
+        'unmatched': [],
+        'invalid': [],
+        'settled_invoice_ids': set(),
+    }
+    parsed = []
+    for line_number, row in chunk:
+        line, error = _parse_line(row, default_payment_method)
+        if error:
+            report['invalid'].append({'line': line_number, 'reason': error})
+        else:
+            parsed.append((line_number, line))
+    if not parsed:
+        return report
+    
+    now = timezone.now()
+    
+    with db_transaction.atomic():
+        invoices = Invoice.objects.select_for_update().in_bulk(
+            {line['control_number'] for _, line in parsed},
+            field_name='control_number'
+        )
+        pairs = {(line['payment_method'], line['reference']) for _, line in parsed}
+        if screen:
+            pairs, _ = payment_references.screen(pairs)
+        known_references = find_duplicate_references(pairs)
+        
+        matched = []
+        for line_number, line in parsed:
+            entry = {
+                'line': line_number,
+                'control_number': line['control_number'],
+                'reference': line['reference'],
+            }
+            invoice = invoices.get(line['control_number'])
+            if invoice is None:
+                report['unmatched'].append(dict(entry, reason='unknown_control_number'))
+            elif (line['payment_method'], line['reference']) in known_references:
+                report['duplicates'].append(dict(entry, reason='duplicate_reference'))
+            elif invoice.status == 'paid' or invoice.invoice_id in settled_invoice_ids or invoice.invoice_id in report['settled_invoice_ids']:
+                report['duplicates'].append(dict(entry, reason='invoice_already_paid'))
+            elif line['amount'] != invoice.amount:
+                report['unmatched'].append(dict(entry, reason='amount_mismatch'))
+            else:
+                known_references.add((line['payment_method'], line['reference']))
+                report['settled_invoice_ids'].add(invoice.invoice_id)
+                matched.append((invoice, line))
+        
+        if not matched:
+            return report
+        
+        payments = Payment.objects.bulk_create([
+            Payment(
+                invoice=invoice,
+                amount_paid=line['amount'],
+                payment_reference=line['reference'],
+                payment_method=line['payment_method'],
+                status='completed',
+                processed_by=user,
+                processed_at=now
+            )
+            for invoice, line in matched
+        ])
+        
+        transactions = Transaction.objects.bulk_create([
+            Transaction(
+                payment=payment,
+                transaction_type='cargo_payment',
+                amount=payment.amount_paid,
+                currency=invoice.currency,
+                status='success',
+                reference=payment.payment_reference,
+                created_by=user,
+                transaction_details=line['details']
+            )
+            for (invoice, line), payment in zip(matched, payments)
+        ])
+        post_transactions(
+            (transaction, line['payment_method'])
+            for transaction, (invoice, line) in zip(transactions, matched)
+        )
+        
+        # A release code collision must not pass for a duplicate reference
+        # in the IntegrityError retry
+        release_codes = unique_numbers(len(matched), generate_release_code, ReleaseOrder.objects, 'release_code')
+        ReleaseOrder.objects.bulk_create([
+            ReleaseOrder(
+                cargo_id=invoice.cargo_id,
+                payment=payment,
+                release_code=release_code,
+                status='active',
+                generated_by=user
+            )
+            for (invoice, line), payment, release_code in zip(matched, payments, release_codes)
+        ])
+        
+        by_method = {}
+        for invoice, line in matched:
+            by_method.setdefault(line['payment_method'], []).append(invoice.invoice_id)
+        for method, invoice_ids in by_method.items():
+            Invoice.objects.filter(invoice_id__in=invoice_ids).update(
+                status='paid', payment_method=method, updated_at=now
+            )
+    
+    report['matched'] = len(matched)
+    report['matched_amount'] = sum(line['amount'] for _, line in matched)
+    return report
@@ -0,0 +1,136 @@
+"""
+Payment references
+References are stored normalized (whitespace removed, upper-cased) so a
+gateway reference typed or exported differently still matches, and a
+Payment reference is unique per payment method. A batch of references is
+checked for duplicates with one indexed query; statement imports first
+screen their lines against an in-memory Bloom filter of the known
+references and only query the database for the lines it flags.
+"""
+import hashlib
+import math
+import threading
+import uuid
+from apps.payments.models import Payment
+
+
+FILTER_ERROR_RATE = 0.001
+FILTER_MIN_CAPACITY = 100000
+FILTER_LOAD_CHUNK_SIZE = 10000
+
+
+def normalize_reference(reference):
+    """Reference without whitespace, upper-cased ('' for None)"""
+    if reference is None:
+        return ''
+    return ''.join(str(reference).split()).upper()
+
+
+def generate_payment_reference(prefix='PAY'):
+    return f"{prefix}-{uuid.uuid4().hex[:12].upper()}"
+
+
+def find_duplicate_references(pairs):
+    """
+    Check a batch of (payment_method, reference) pairs against existing
+    Payments with one query.
+    Returns: set of the (payment_method, normalized reference) pairs already used
+    """
+    pairs = {(payment_method, normalize_reference(reference)) for payment_method, reference in pairs}
+    if not pairs:
+        return set()
+    
+    used = Payment.objects.filter(
+        payment_reference__in={reference for _, reference in pairs}
+    ).values_list('payment_method', 'payment_reference')
+    return pairs.intersection(used)
+
+
+class ReferenceFilter:
+    """
+    Bloom filter of (payment_method, reference) pairs. It has no false
+    negatives, so a reference it does not contain is certainly new; one it
+    contains is a duplicate with probability 1 - `error_rate` and has to be
+    confirmed with find_duplicate_references().
+    """
+    
+    def __init__(self, capacity, error_rate=FILTER_ERROR_RATE):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.size = max(64, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+    
+    def _positions(self, payment_method, reference):
+        digest = hashlib.blake2b(f"{payment_method}:{reference}".encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+    
+    def add(self, payment_method, reference):
+        for position in self._positions(payment_method, normalize_reference(reference)):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+    
+    def __contains__(self, pair):
+        payment_method, reference = pair
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(payment_method, normalize_reference(reference))
+        )
+    
+    @property
+    def is_full(self):
+        return self.count >= self.capacity
+
+
+class PaymentReferenceIndex:
+    """
+    Process-wide ReferenceFilter over all Payment references. It remembers
+    the highest payment_id it has read and catches up with newer payments on
+    every refresh(), and is rebuilt with twice the capacity once full, so
+    the false positive rate stays near FILTER_ERROR_RATE.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filter = None
+        self._last_id = 0
+    
+    def refresh(self):
+        with self._lock:
+            if self._filter is None or self._filter.is_full:
+                self._rebuild()
+            else:
+                self._load(self._filter)
+    
+    def _rebuild(self):
+        capacity = max(FILTER_MIN_CAPACITY, Payment.objects.count() * 2)
+        self._last_id = 0
+        self._filter = ReferenceFilter(capacity)
+        self._load(self._filter)
+    
+    def _load(self, reference_filter):
+        payments = Payment.objects.filter(payment_id__gt=self._last_id).order_by('payment_id').values_list(
+            'payment_id', 'payment_method', 'payment_reference'
+        )
+        for payment_id, payment_method, reference in payments.iterator(chunk_size=FILTER_LOAD_CHUNK_SIZE):
+            reference_filter.add(payment_method, reference)
+            self._last_id = payment_id
+    
+    def screen(self, pairs):
+        """
+        Split (payment_method, reference) pairs into those that may be known
+        (to be confirmed in the database) and those that certainly are not
+        Returns: (maybe_known, new) lists
+        """
+        maybe_known = []
+        new = []
+        with self._lock:
+            for pair in pairs:
+                (maybe_known if pair in self._filter else new).append(pair)
+        return maybe_known, new
+
+
+payment_references = PaymentReferenceIndex()
@@ -0,0 +1,322 @@
+"""
+Payment refunds
+Refunds are created as pending rows and processed in chunks: wallet
+payments are credited back with one apply_transactions() call per wallet,
+other payments are refunded concurrently through the payment gateway.
+Every refund carries its own reference, sent to the gateway as the
+idempotency key, so an interrupted run can be resumed without refunding
+anything twice.
+
+A run claims its refunds by setting them to processing and stamping
+updated_at; the claim is a lease of REFUND_LEASE_TIMEOUT seconds. Other runs
+only take over processing refunds whose lease has expired, and a run only
+completes or fails refunds that still carry its own claim time, so a refund
+taken over by another run is left to that run.
+"""
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from itertools import islice
+from django.conf import settings
+from django.db import DatabaseError, transaction as db_transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from apps.payments.models import Payment, Refund, RefundBatch, ReleaseOrder, Transaction, Wallet, WalletTransaction
+from apps.payments.services import PaymentGatewayService
+from apps.ledger.utils import post_transactions
+
+
+REFUND_CHUNK_SIZE = 100
+CENT = Decimal('0.01')
+
+
+def get_refund_lease_timeout():
+    """Seconds a run owns the refunds it claimed before another run may take them over"""
+    return getattr(settings, 'REFUND_LEASE_TIMEOUT', 10 * 60)
+
+
+def resumable_refunds(now=None):
+    """Filter for refunds a run may claim: pending, failed, or processing with an expired lease"""
+    now = now or timezone.now()
+    return Q(status__in=('pending', 'failed')) | Q(
+        status='processing', updated_at__lt=now - timedelta(seconds=get_refund_lease_timeout())
+    )
+
+
+def generate_refund_reference():
+    return f"RFD-{uuid.uuid4().hex[:12].upper()}"
+
+
+def create_refunds(payment_ids, reason=None, user=None, batch=None, amounts=None):
+    """
+    Create pending refunds for completed payments. `amounts` optionally maps
+    payment_id -> partial refund amount (default: the full amount paid).
+    
+    Returns: (refunds: list, skipped: dict of payment_id -> reason)
+    Skip reasons: not_found, not_completed, already_refunded
+    Raises: ValueError if an amount is not positive or exceeds the amount paid
+    """
+    payment_ids = list(dict.fromkeys(payment_ids))
+    amounts = amounts or {}
+    payments = Payment.objects.in_bulk(payment_ids)
+    refunded = set(Refund.objects.filter(payment_id__in=payment_ids).values_list('payment_id', flat=True))
+    
+    skipped = {}
+    refunds = []
+    for payment_id in payment_ids:
+        payment = payments.get(payment_id)
+        if payment is None:
+            skipped[payment_id] = 'not_found'
+        elif payment_id in refunded:
+            skipped[payment_id] = 'already_refunded'
+        elif payment.status != 'completed':
+            skipped[payment_id] = 'not_completed'
+        else:
+            amount = Decimal(str(amounts.get(payment_id, payment.amount_paid)))
+            if amount <= 0 or amount > payment.amount_paid:
+                raise ValueError(f"Refund amount for payment {payment_id} must be positive and at most the amount paid")
+            refunds.append(Refund(
+                payment=payment,
+                batch=batch,
+                amount=amount,
+                reference=generate_refund_reference(),
+                reason=reason,
+                created_by=user
+            ))
+    
+    # A concurrent request may have refunded some of the payments already
+    Refund.objects.bulk_create(refunds, ignore_conflicts=True)
+    created = Refund.objects.in_bulk([refund.reference for refund in refunds], field_name='reference')
+    for refund in refunds:
+        if refund.reference not in created:
+            skipped[refund.payment_id] = 'already_refunded'
+    
+    return [created[refund.reference] for refund in refunds if refund.reference in created], skipped
+
+
+def create_refund_batch(payment_ids, reason, user=None):
+    """Returns: (batch, skipped: dict of payment_id -> reason)"""
+    with db_transaction.atomic():
+        batch = RefundBatch.objects.create(reason=reason, created_by=user)
+        _, skipped = create_refunds(payment_ids, reason, user, batch=batch)
+    return batch, skipped
+
+
+def process_refunds(refund_ids, chunk_size=REFUND_CHUNK_SIZE, max_concurrency=None):
+    """
+    Process (or resume) refunds `chunk_size` at a time. Refunds that are
+    already completed are ignored. Returns: dict with completed/failed counts.
+    """
+    counts = {'completed': 0, 'failed': 0}
+    refund_ids = iter(refund_ids)
+    while True:
+        chunk = list(islice(refund_ids, chunk_size))
+        if not chunk:
+            return counts
+        _process_chunk(chunk, counts, max_concurrency)
+
+
+def process_refund_batch(batch, chunk_size=REFUND_CHUNK_SIZE, max_concurrency=None):
+    """Process every refund of a batch that is not completed yet and update the batch status"""
+    refund_ids = list(
+        batch.refunds.filter(resumable_refunds()).order_by('refund_id').values_list('refund_id', flat=True)
+    )
+    counts = process_refunds(refund_ids, chunk_size, max_concurrency)
+    
+    batch.status = 'partially_failed' if batch.refunds.exclude(status='completed').exists() else 'completed'
+    batch.save(update_fields=['status', 'updated_at'])
+    return counts
+
+
+def refund_payment(payment, amount=None, reason=None, user=None):
+    """
+    Refund a single payment, or retry its failed refund. A payment has one
+    refund, so once a partial refund has completed the payment cannot be
+    refunded again.
+    Returns: the Refund
+    Raises: ValueError if the payment cannot be refunded
+    """
+    refund = Refund.objects.filter(payment=payment).first()
+    if refund is None:
+        refunds, skipped = create_refunds(
+            [payment.payment_id], reason, user,
+            amounts={payment.payment_id: amount} if amount is not None else None
+        )
+        if skipped:
+            raise ValueError(f"Payment cannot be refunded: {skipped[payment.payment_id].replace('_', ' ')}")
+        refund = refunds[0]
+    elif refund.status == 'completed':
+        raise ValueError("Payment already refunded")
+    
+    process_refunds([refund.refund_id])
+    refund.refresh_from_db()
+    return refund
+
+
+def _process_chunk(refund_ids, counts, max_concurrency):
+    now = timezone.now()
+    
+    with db_transaction.atomic():
+        refunds = list(
+            Refund.objects.select_for_update(skip_locked=True, of=('self',))
+            .select_related('payment__invoice')
+            .filter(resumable_refunds(now), refund_id__in=refund_ids)
+        )
+        Refund.objects.filter(refund_id__in=[refund.refund_id for refund in refunds]).update(
+            status='processing', attempts=F('attempts') + 1, error=None, updated_at=now
+        )
+    
+    _refund_to_wallets([refund for refund in refunds if refund.payment.payment_method == 'wallet'], now, counts)
+    _refund_through_gateway(
+        [refund for refund in refunds if refund.payment.payment_method != 'wallet'], now, counts, max_concurrency
+    )
+
+
+def _claimed(refunds, claimed_at):
+    """Refunds of this run that are still processing under its claim"""
+    return Refund.objects.filter(
+        refund_id__in=[refund.refund_id for refund in refunds], status='processing', updated_at=claimed_at
+    )
+
+
+def _refund_to_wallets(refunds, claimed_at, counts):
+    """
+    Credit wallet refunds back, one ledger batch per wallet. The credit is
+    the refunded share of the original wallet debit, so it is in the wallet
+    currency at the rate of the original payment.
+    """
+    if not refunds:
+        return
+    
+    paying_wallets = {
+        payment_id: (wallet_id, debited)
+        for payment_id, wallet_id, debited in WalletTransaction.objects.filter(
+            payment_id__in=[refund.payment_id for refund in refunds],
+            transaction_type__in=WalletTransaction.DEBIT_TYPES
+        ).values_list('payment_id', 'wallet_id', 'amount')
+    }
+    
+    by_wallet = {}
+    credits = {}
+    for refund in refunds:
+        if refund.payment_id not in paying_wallets:
+            _mark_failed([refund], 'Paying wallet not found', claimed_at, counts)
+            continue
+        wallet_id, debited = paying_wallets[refund.payment_id]
+        credits[refund.refund_id] = (debited * refund.amount / refund.payment.amount_paid).quantize(CENT)
+        by_wallet.setdefault(wallet_id, []).append(refund)
+    
+    wallets = Wallet.objects.in_bulk(list(by_wallet))
+    for wallet_id, group in by_wallet.items():
+        now = timezone.now()
+        try:
+            with db_transaction.atomic():
+                completed = _claimed(group, claimed_at).update(status='completed', processed_at=now, updated_at=now)
+                if completed != len(group):
+                    raise ValueError("Refund was processed by another run")
+                
+                wallet_transactions = wallets[wallet_id].apply_transactions([
+                    dict(
+                        transaction_type='refund',
+                        amount=credits[refund.refund_id],
+                        reference=refund.reference,
+                        description=f"Refund of payment {refund.payment.payment_reference}",
+                        invoice_id=refund.payment.invoice_id,
+                        payment=refund.payment
+                    )
+                    for refund in group
+                ])
+                for refund, wallet_transaction in zip(group, wallet_transactions):
+                    refund.wallet_transaction = wallet_transaction
+                Refund.objects.bulk_update(group, ['wallet_transaction'])
+                
+                _close_refunded_payments(group, now)
+        except (ValueError, DatabaseError) as e:
+            _mark_failed(group, str(e), claimed_at, counts)
+        else:
+            counts['completed'] += len(group)
+
+
+def _refund_through_gateway(refunds, claimed_at, counts, max_concurrency):
+    """Refund through the gateway concurrently, then record the results in one transaction"""
+    if not refunds:
+        return
+    
+    results = PaymentGatewayService.process_refunds(
+        [(refund.amount, refund.payment.payment_reference, refund.reference) for refund in refunds],
+        max_concurrency
+    )
+    
+    succeeded = []
+    failed = []
+    for refund, (success, _, gateway_response) in zip(refunds, results):
+        refund.gateway_response = gateway_response
+        (succeeded if success else failed).append(refund)
+    
+    for refund in failed:
+        _mark_failed([refund], refund.gateway_response.get('message') or 'Gateway refund failed', claimed_at, counts)
+    
+    if not succeeded:
+        return
+    
+    now = timezone.now()
+    with db_transaction.atomic():
+        claimed = set(_claimed(succeeded, claimed_at).select_for_update().values_list('refund_id', flat=True))
+        succeeded = [refund for refund in succeeded if refund.refund_id in claimed]
+        
+        transactions = Transaction.objects.bulk_create([
+            Transaction(
+                payment=refund.payment,
+                transaction_type='refund',
+                amount=refund.amount,
+                currency=refund.payment.invoice.currency,
+                status='success',
+                reference=refund.reference,
+                created_by=refund.created_by,
+                transaction_details=refund.gateway_response
+            )
+            for refund in succeeded
+        ])
+        post_transactions(
+            (transaction, refund.payment.payment_method)
+            for transaction, refund in zip(transactions, succeeded)
+        )
+        
+        for refund, transaction in zip(succeeded, transactions):
+            refund.transaction = transaction
+            refund.status = 'completed'
+            refund.processed_at = now
+            refund.updated_at = now
+        Refund.objects.bulk_update(succeeded, ['transaction', 'status', 'gateway_response', 'processed_at', 'updated_at'])
+        
+        _close_refunded_payments(succeeded, now)
+    
+    counts['completed'] += len(succeeded)
+
+
+def _close_refunded_payments(refunds, now):
+    """Fully refunded payments are marked refunded, their invoices cancelled and release orders expired"""
+    from apps.invoices.models import Invoice
+    
+    full = [refund.payment for refund in refunds if refund.amount == refund.payment.amount_paid]
+    if not full:
+        return
+    
+    payment_ids = [payment.payment_id for payment in full]
+    Payment.objects.filter(payment_id__in=payment_ids).update(status='refunded', updated_at=now)
+    ReleaseOrder.objects.filter(payment_id__in=payment_ids, status='active').update(status='expired', updated_at=now)
+    Invoice.objects.filter(invoice_id__in=[payment.invoice_id for payment in full]).update(status='cancelled', updated_at=now)
+
+
+def _mark_failed(refunds, error, claimed_at, counts):
+    """Record a failure, leaving refunds taken over or completed by another run untouched"""
+    now = timezone.now()
+    with db_transaction.atomic():
+        claimed = set(_claimed(refunds, claimed_at).select_for_update().values_list('refund_id', flat=True))
+        failed = [refund for refund in refunds if refund.refund_id in claimed]
+        for refund in failed:
+            refund.status = 'failed'
+            refund.error = error
+            refund.updated_at = now
+        Refund.objects.bulk_update(failed, ['status', 'error', 'gateway_response', 'updated_at'])
+    counts['failed'] += len(failed)
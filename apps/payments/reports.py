@@ -0,0 +1,83 @@
+"""
+Revenue reports
+Amounts are summed in the database per day and currency first, so however
+many transactions a period has, the currency conversion only sees one row
+per (day, currency) and converts those columns with fx.convert_column()
+"""
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+from apps.payments.fx import base_currency, convert_column
+from apps.payments.models import Refund, Transaction
+
+
+REVENUE_TYPES = ('cargo_payment', 'storage_fee', 'penalty')
+REPORT_PERIODS = ('daily', 'monthly')
+
+
+def _bucket(day, period):
+    return day.replace(day=1) if period == 'monthly' else day
+
+
+def revenue_report(start, end, currency=None, period='daily'):
+    """
+    Revenue for [start, end) in `currency` (default: BASE_CURRENCY), one row
+    per day or month: settled cargo payments, storage fees and penalties,
+    completed refunds and the net. Each amount is converted at the rate of
+    the day it was received or refunded.
+    Raises: ValueError if a rate is missing
+    """
+    currency = currency or base_currency()
+    
+    revenue = list(
+        Transaction.objects.filter(
+            status='success', transaction_type__in=REVENUE_TYPES,
+            created_at__gte=start, created_at__lt=end
+        )
+        .annotate(day=TruncDate('created_at'))
+        .order_by()
+        .values('day', 'currency', 'transaction_type')
+        .annotate(total=Sum('amount'))
+        .values_list('day', 'currency', 'transaction_type', 'total')
+    )
+    # Refunds are read from Refund so wallet refunds (which have no Transaction) count too
+    refunds = list(
+        Refund.objects.filter(status='completed', processed_at__gte=start, processed_at__lt=end)
+        .annotate(day=TruncDate('processed_at'), currency=F('payment__invoice__currency'))
+        .order_by()
+        .values('day', 'currency')
+        .annotate(total=Sum('amount'))
+        .values_list('day', 'currency', 'total')
+    )
+    rows = revenue + [(day, code, 'refunds', total) for day, code, total in refunds]
+    
+    converted = convert_column(
+        [total for _, _, _, total in rows],
+        [code for _, code, _, _ in rows],
+        [day for day, _, _, _ in rows],
+        currency
+    ) if rows else []
+    
+    buckets = {}
+    for (day, _, kind, _), amount in zip(rows, converted):
+        bucket = buckets.setdefault(_bucket(day, period), dict.fromkeys(REVENUE_TYPES + ('refunds',), 0.0))
+        bucket[kind] += float(amount)
+    
+    periods = []
+    totals = dict.fromkeys(REVENUE_TYPES + ('refunds', 'net'), 0.0)
+    for day in sorted(buckets):
+        bucket = buckets[day]
+        net = sum(bucket[kind] for kind in REVENUE_TYPES) - bucket['refunds']
+        row = {key: round(value, 2) for key, value in bucket.items()}
+        periods.append({'period_start': day, **row, 'net': round(net, 2)})
+        for key, value in row.items():
+            totals[key] += value
+        totals['net'] += net
+    
+    return {
+        'currency': currency,
+        'period': period,
+        'start': start,
+        'end': end,
+        'periods': periods,
+        'totals': {key: round(value, 2) for key, value in totals.items()},
+    }
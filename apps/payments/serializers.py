@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from apps.payments.models import Payment, Transaction, ReleaseOrder, Wallet, WalletTransaction
+from apps.payments.models import Payment, Transaction, ReleaseOrder, Wallet, WalletTransaction, WalletHold, Refund, RefundBatch, GatewayOperation
 
 
 class PaymentSerializer(serializers.ModelSerializer):
@@ -40,12 +40,14 @@ class WalletSerializer(serializers.ModelSerializer):
     """Serializer for Wallet model"""
     customer_name = serializers.CharField(source='customer.customer_name', read_only=True)
     customer_id = serializers.IntegerField(source='customer.customer_id', read_only=True)
+    balance = serializers.DecimalField(source='current_balance', max_digits=12, decimal_places=2, read_only=True)
+    available_balance = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
     
     class Meta:
         model = Wallet
-        fields = ['wallet_id', 'customer_id', 'customer_name', 'balance', 'currency',
-                  'is_active', 'auto_payment_enabled', 'created_at', 'updated_at']
-        read_only_fields = ['wallet_id', 'balance', 'created_at', 'updated_at']
+        fields = ['wallet_id', 'customer_id', 'customer_name', 'balance', 'held_balance', 'available_balance',
+                  'balance_shards', 'currency', 'is_active', 'auto_payment_enabled', 'created_at', 'updated_at']
+        read_only_fields = ['wallet_id', 'balance', 'held_balance', 'balance_shards', 'created_at', 'updated_at']
 
 
 class WalletTransactionSerializer(serializers.ModelSerializer):
@@ -61,3 +63,48 @@ class WalletTransactionSerializer(serializers.ModelSerializer):
                   'created_at']
         read_only_fields = ['transaction_id', 'created_at']
 
+
+class WalletHoldSerializer(serializers.ModelSerializer):
+    """Serializer for Wallet Hold model"""
+    invoice_control = serializers.CharField(source='invoice.control_number', read_only=True, allow_null=True)
+    
+    class Meta:
+        model = WalletHold
+        fields = ['hold_id', 'wallet_id', 'amount', 'captured_amount', 'status', 'reference',
+                  'description', 'invoice_id', 'invoice_control', 'wallet_transaction_id',
+                  'expires_at', 'captured_at', 'released_at', 'created_at']
+        read_only_fields = fields
+
+
+class RefundSerializer(serializers.ModelSerializer):
+    """Serializer for Refund model"""
+    payment_reference = serializers.CharField(source='payment.payment_reference', read_only=True)
+    payment_method = serializers.CharField(source='payment.payment_method', read_only=True)
+    
+    class Meta:
+        model = Refund
+        fields = ['refund_id', 'payment_id', 'payment_reference', 'payment_method', 'batch_id',
+                  'amount', 'reference', 'reason', 'status', 'attempts', 'error',
+                  'wallet_transaction_id', 'transaction_id', 'processed_at', 'created_at']
+        read_only_fields = fields
+
+
+class RefundBatchSerializer(serializers.ModelSerializer):
+    """Serializer for Refund Batch model"""
+    refunds = RefundSerializer(many=True, read_only=True)
+    
+    class Meta:
+        model = RefundBatch
+        fields = ['batch_id', 'reason', 'status', 'refunds', 'created_at', 'updated_at']
+        read_only_fields = fields
+
+
+class GatewayOperationSerializer(serializers.ModelSerializer):
+    """Serializer for Gateway Operation model"""
+    
+    class Meta:
+        model = GatewayOperation
+        fields = ['operation_id', 'operation_type', 'reference', 'amount', 'payment_method',
+                  'status', 'description', 'wallet_id', 'payment_id', 'wallet_transaction_id',
+                  'checks', 'last_checked_at', 'completed_at', 'created_at']
+        read_only_fields = fields
@@ -1,22 +1,66 @@
 """
-Payment Gateway Service (Dummy Implementation)
-Replace with actual payment gateway integration later
+Payment Gateway Service
+Pluggable gateway clients selected by settings.PAYMENT_GATEWAY['BACKEND']:
+- 'dummy': in-process dummy gateway (default)
+- 'http': real provider over a pooled HTTP session with timeouts and retries
 """
+import asyncio
 import uuid
-from decimal import Decimal
+from abc import ABC, abstractmethod
 from django.conf import settings
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
-class PaymentGatewayService:
-    """Dummy payment gateway service"""
+GATEWAY_DEFAULTS = {
+    'BACKEND': 'dummy',
+    'BASE_URL': '',
+    'API_KEY': '',
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 10,
+    'MAX_RETRIES': 3,
+    'BACKOFF_FACTOR': 0.5,
+    'POOL_SIZE': 20,
+    'MAX_CONCURRENCY': 10,
+    'WEBHOOK_SECRET': '',
+    'VERIFY_AFTER': 60,
+    'PENDING_TTL': 24 * 60 * 60,
+}
+
+
+def get_gateway_settings():
+    """Gateway settings merged over the defaults"""
+    return {**GATEWAY_DEFAULTS, **getattr(settings, 'PAYMENT_GATEWAY', {})}
+
+
+class BaseGatewayClient(ABC):
+    """
+    Interface every gateway client implements.
+    All methods return tuples so callers never have to catch network errors.
+    """
     
-    @staticmethod
-    def process_deposit(amount, payment_method, customer_phone=None, customer_email=None):
+    @abstractmethod
+    def process_deposit(self, amount, payment_method, customer_phone=None, customer_email=None):
+        """Returns: (success: bool, reference: str, gateway_response: dict)"""
+    
+    @abstractmethod
+    def verify_payment(self, reference):
+        """Returns: (verified: bool, gateway_response: dict)"""
+    
+    @abstractmethod
+    def process_refund(self, amount, original_reference, reference=None):
         """
-        Process deposit to wallet via payment gateway
+        `reference` identifies the refund; retrying with the same reference
+        must not refund twice. A new one is generated when omitted.
         Returns: (success: bool, reference: str, gateway_response: dict)
         """
-        # Dummy implementation - replace with actual gateway call
+
+
+class DummyGatewayClient(BaseGatewayClient):
+    """Dummy payment gateway, every call succeeds immediately"""
+    
+    def process_deposit(self, amount, payment_method, customer_phone=None, customer_email=None):
         reference = f"DEP-{uuid.uuid4().hex[:12].upper()}"
         
         # Simulate gateway response
@@ -31,13 +75,7 @@ class PaymentGatewayService:
         
         return True, reference, gateway_response
     
-    @staticmethod
-    def verify_payment(reference):
-        """
-        Verify payment status from gateway
-        Returns: (verified: bool, gateway_response: dict)
-        """
-        # Dummy implementation
+    def verify_payment(self, reference):
         gateway_response = {
             "status": "verified",
             "transaction_id": reference,
@@ -47,14 +85,8 @@ class PaymentGatewayService:
         
         return True, gateway_response
     
-    @staticmethod
-    def process_refund(amount, original_reference):
-        """
-        Process refund via payment gateway
-        Returns: (success: bool, reference: str, gateway_response: dict)
-        """
-        # Dummy implementation
-        reference = f"REF-{uuid.uuid4().hex[:12].upper()}"
+    def process_refund(self, amount, original_reference, reference=None):
+        reference = reference or f"REF-{uuid.uuid4().hex[:12].upper()}"
         
         gateway_response = {
             "status": "success",
@@ -66,3 +98,196 @@ class PaymentGatewayService:
         
         return True, reference, gateway_response
 
+
+class HttpGatewayClient(BaseGatewayClient):
+    """
+    Gateway client for an HTTP/JSON provider.
+    
+    One requests.Session is shared per client so connections are pooled and
+    reused. Every call has a (connect, read) timeout, and transient failures
+    (connection errors, 429/502/503/504) are retried with exponential backoff.
+    Write calls send the reference we generate as an Idempotency-Key so a
+    retried POST cannot charge or refund twice.
+    """
+    
+    def __init__(self, base_url, api_key='', connect_timeout=3.05, read_timeout=10,
+                 max_retries=3, backoff_factor=0.5, pool_size=20):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'POST']),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'Authorization': f"Bearer {api_key}",
+            'Content-Type': 'application/json',
+        })
+    
+    @classmethod
+    def from_settings(cls, config):
+        return cls(
+            base_url=config['BASE_URL'],
+            api_key=config['API_KEY'],
+            connect_timeout=config['CONNECT_TIMEOUT'],
+            read_timeout=config['READ_TIMEOUT'],
+            max_retries=config['MAX_RETRIES'],
+            backoff_factor=config['BACKOFF_FACTOR'],
+            pool_size=config['POOL_SIZE'],
+        )
+    
+    def _request(self, method, path, idempotency_key=None, **kwargs):
+        """Returns: (ok: bool, body: dict)"""
+        headers = {'Idempotency-Key': idempotency_key} if idempotency_key else None
+        try:
+            response = self.session.request(
+                method, f"{self.base_url}{path}", headers=headers, timeout=self.timeout, **kwargs
+            )
+        except requests.exceptions.RequestException as e:
+            return False, {"status": "error", "message": str(e)}
+        
+        try:
+            body = response.json()
+        except ValueError:
+            body = {"status": "error", "message": response.text[:500]}
+        return response.ok, body
+    
+    def process_deposit(self, amount, payment_method, customer_phone=None, customer_email=None):
+        reference = f"DEP-{uuid.uuid4().hex[:12].upper()}"
+        ok, body = self._request('POST', '/deposits', idempotency_key=reference, json={
+            "reference": reference,
+            "amount": str(amount),
+            "payment_method": payment_method,
+            "customer_phone": customer_phone,
+            "customer_email": customer_email,
+        })
+        return ok and body.get('status') in ('success', 'pending'), reference, body
+    
+    def verify_payment(self, reference):
+        ok, body = self._request('GET', f"/payments/{reference}")
+        return ok and bool(body.get('verified')), body
+    
+    def process_refund(self, amount, original_reference, reference=None):
+        reference = reference or f"REF-{uuid.uuid4().hex[:12].upper()}"
+        ok, body = self._request('POST', '/refunds', idempotency_key=reference, json={
+            "reference": reference,
+            "original_reference": original_reference,
+            "amount": str(amount),
+        })
+        return ok and body.get('status') == 'success', reference, body
+
+
+class AsyncGatewayClient:
+    """
+    asyncio front-end for a gateway client.
+    
+    Blocking calls run in worker threads (sharing the wrapped client's
+    connection pool) with at most `max_concurrency` in flight, so batches of
+    references can be verified or refunded concurrently.
+    """
+    
+    def __init__(self, client=None, max_concurrency=None):
+        self.client = client or get_gateway_client()
+        self.max_concurrency = max_concurrency or get_gateway_settings()['MAX_CONCURRENCY']
+    
+    async def _run(self, semaphore, func, *args):
+        async with semaphore:
+            return await asyncio.to_thread(func, *args)
+    
+    async def verify_payments(self, references):
+        """Returns: dict of reference -> (verified, gateway_response)"""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = await asyncio.gather(*(
+            self._run(semaphore, self.client.verify_payment, reference)
+            for reference in references
+        ))
+        return dict(zip(references, results))
+    
+    async def process_refunds(self, refunds):
+        """
+        `refunds` is a list of (amount, original_reference) pairs or
+        (amount, original_reference, reference) triples.
+        Returns a list of (success, reference, gateway_response) in the same order.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        return list(await asyncio.gather(*(
+            self._run(semaphore, self.client.process_refund, *refund)
+            for refund in refunds
+        )))
+
+
+_gateway_client = None
+
+
+def get_gateway_client():
+    """Return the process-wide gateway client configured in settings"""
+    global _gateway_client
+    if _gateway_client is None:
+        config = get_gateway_settings()
+        if config['BACKEND'] == 'http':
+            _gateway_client = HttpGatewayClient.from_settings(config)
+        else:
+            _gateway_client = DummyGatewayClient()
+    return _gateway_client
+
+
+def verify_payments(references, max_concurrency=None):
+    """Verify a batch of references concurrently from synchronous code"""
+    return asyncio.run(AsyncGatewayClient(max_concurrency=max_concurrency).verify_payments(list(references)))
+
+
+def process_refunds(refunds, max_concurrency=None):
+    """Process a batch of (amount, original_reference[, reference]) refunds concurrently from synchronous code"""
+    return asyncio.run(AsyncGatewayClient(max_concurrency=max_concurrency).process_refunds(list(refunds)))
+
+
+class PaymentGatewayService:
+    """Payment gateway facade, delegates to the configured gateway client"""
+    
+    @staticmethod
+    def process_deposit(amount, payment_method, customer_phone=None, customer_email=None):
+        """
+        Process deposit to wallet via payment gateway
+        Returns: (success: bool, reference: str, gateway_response: dict)
+        """
+        return get_gateway_client().process_deposit(amount, payment_method, customer_phone, customer_email)
+    
+    @staticmethod
+    def verify_payment(reference):
+        """
+        Verify payment status from gateway
+        Returns: (verified: bool, gateway_response: dict)
+        """
+        return get_gateway_client().verify_payment(reference)
+    
+    @staticmethod
+    def process_refund(amount, original_reference, reference=None):
+        """
+        Process refund via payment gateway
+        Returns: (success: bool, reference: str, gateway_response: dict)
+        """
+        return get_gateway_client().process_refund(amount, original_reference, reference)
+    
+    @staticmethod
+    def verify_payments(references, max_concurrency=None):
+        """
+        Verify many references concurrently
+        Returns: dict of reference -> (verified: bool, gateway_response: dict)
+        """
+        return verify_payments(references, max_concurrency)
+    
+    @staticmethod
+    def process_refunds(refunds, max_concurrency=None):
+        """
+        Process many (amount, original_reference[, reference]) refunds concurrently
+        Returns: list of (success: bool, reference: str, gateway_response: dict)
+        """
+        return process_refunds(refunds, max_concurrency)
@@ -0,0 +1,193 @@
+"""
+Wallet statements and balance snapshots
+Snapshots store the closing balance and activity totals of each daily or
+monthly period, so balance-at-time and period statements only read the
+transactions after the nearest snapshot. Balances are running sums of the
+ledger amounts rather than balance_after, which does not form a chain on
+sharded wallets
+"""
+from datetime import timedelta
+from decimal import Decimal
+from django.db.models import Case, Count, DecimalField, F, Max, Q, Sum, Value, When
+from django.db.models.functions import TruncDay, TruncMonth
+from django.utils import timezone
+from apps.payments.models import Wallet, WalletTransaction, WalletBalanceSnapshot
+
+
+SNAPSHOT_PERIODS = ('daily', 'monthly')
+ZERO = Decimal('0.00')
+
+_money = DecimalField(max_digits=12, decimal_places=2)
+CREDIT_AMOUNT = Case(
+    When(transaction_type__in=WalletTransaction.DEBIT_TYPES, then=Value(ZERO)),
+    default=F('amount'),
+    output_field=_money
+)
+DEBIT_AMOUNT = Case(
+    When(transaction_type__in=WalletTransaction.DEBIT_TYPES, then=F('amount')),
+    default=Value(ZERO),
+    output_field=_money
+)
+
+
+def period_floor(period, moment):
+    """Start of the period containing `moment`"""
+    moment = timezone.localtime(moment).replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == 'monthly':
+        moment = moment.replace(day=1)
+    return moment
+
+
+def next_period(period, start):
+    """Start of the period after the one beginning at `start`"""
+    if period == 'monthly':
+        return (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def period_ceil(period, moment):
+    """Start of the first period beginning at or after `moment`"""
+    floor = period_floor(period, moment)
+    return floor if floor == moment else next_period(period, floor)
+
+
+def _ledger(wallet_id):
+    """Settled ledger rows of a wallet"""
+    return WalletTransaction.objects.filter(wallet_id=wallet_id, status='success')
+
+
+def _totals(queryset):
+    totals = queryset.aggregate(
+        credits=Sum(CREDIT_AMOUNT),
+        debits=Sum(DEBIT_AMOUNT),
+        count=Count('pk')
+    )
+    return totals['credits'] or ZERO, totals['debits'] or ZERO, totals['count']
+
+
+def build_wallet_snapshots(wallet_id, period='daily', until=None):
+    """
+    Snapshot every complete period with activity since the wallet's latest
+    snapshot. Periods are aggregated with one GROUP BY query and each closing
+    balance is the previous one plus the period's credits minus its debits.
+    Returns the number of snapshots created.
+    """
+    cutoff = period_floor(period, until or timezone.now())
+    trunc = TruncMonth if period == 'monthly' else TruncDay
+    
+    last = WalletBalanceSnapshot.objects.filter(
+        wallet_id=wallet_id, period=period
+    ).order_by('-period_end').values_list('period_end', 'closing_balance').first()
+    
+    transactions = _ledger(wallet_id).filter(created_at__lt=cutoff)
+    if last:
+        transactions = transactions.filter(created_at__gte=last[0])
+    balance = last[1] if last else ZERO
+    
+    buckets = list(
+        transactions.annotate(bucket=trunc('created_at'))
+        .values('bucket')
+        .annotate(
+            credits=Sum(CREDIT_AMOUNT),
+            debits=Sum(DEBIT_AMOUNT),
+            count=Count('pk'),
+            last_id=Max('pk')
+        )
+        .order_by('bucket')
+    )
+    if not buckets:
+        return 0
+    
+    snapshots = []
+    for bucket in buckets:
+        start = period_floor(period, bucket['bucket'])
+        closing_balance = balance + bucket['credits'] - bucket['debits']
+        snapshots.append(WalletBalanceSnapshot(
+            wallet_id=wallet_id,
+            period=period,
+            period_start=start,
+            period_end=next_period(period, start),
+            opening_balance=balance,
+            closing_balance=closing_balance,
+            total_credits=bucket['credits'],
+            total_debits=bucket['debits'],
+            transaction_count=bucket['count'],
+            last_transaction_id=bucket['last_id']
+        ))
+        balance = closing_balance
+    
+    WalletBalanceSnapshot.objects.bulk_create(snapshots)
+    return len(snapshots)
+
+
+def build_snapshots(period='daily', until=None, wallet_ids=None):
+    """Snapshot all (or the given) wallets, returns the number of snapshots created"""
+    if wallet_ids is None:
+        wallet_ids = Wallet.objects.values_list('wallet_id', flat=True).iterator()
+    return sum(build_wallet_snapshots(wallet_id, period, until) for wallet_id in wallet_ids)
+
+
+def balance_at(wallet_id, at):
+    """
+    Wallet balance at time `at`: the closing balance of the nearest
+    snapshot plus the net of the transactions after it and before `at`.
+    """
+    snapshot = WalletBalanceSnapshot.objects.filter(
+        wallet_id=wallet_id, period_end__lte=at
+    ).order_by('-period_end').values_list('period_end', 'closing_balance').first()
+    
+    transactions = _ledger(wallet_id).filter(created_at__lt=at)
+    if snapshot:
+        transactions = transactions.filter(created_at__gte=snapshot[0])
+    
+    credits, debits, _ = _totals(transactions)
+    return (snapshot[1] if snapshot else ZERO) + credits - debits
+
+
+def wallet_statement(wallet_id, start, end, period='daily'):
+    """
+    Statement summary for [start, end): opening/closing balances plus credit,
+    debit and transaction totals. Whole periods covered by snapshots are
+    summed from the snapshot table; only the partial periods at the edges and
+    the not-yet-snapshotted tail are aggregated from WalletTransaction.
+    """
+    watermark = WalletBalanceSnapshot.objects.filter(
+        wallet_id=wallet_id, period=period, period_end__lte=end
+    ).aggregate(watermark=Max('period_end'))['watermark']
+    
+    first_full = period_ceil(period, start)
+    last_full = min(period_floor(period, end), watermark) if watermark else None
+    
+    credits = debits = ZERO
+    count = 0
+    if last_full and first_full < last_full:
+        snapshot_totals = WalletBalanceSnapshot.objects.filter(
+            wallet_id=wallet_id, period=period,
+            period_start__gte=first_full, period_end__lte=last_full
+        ).aggregate(
+            credits=Sum('total_credits'),
+            debits=Sum('total_debits'),
+            count=Sum('transaction_count')
+        )
+        credits = snapshot_totals['credits'] or ZERO
+        debits = snapshot_totals['debits'] or ZERO
+        count = snapshot_totals['count'] or 0
+        edges = _ledger(wallet_id).filter(
+            Q(created_at__gte=start, created_at__lt=first_full) |
+            Q(created_at__gte=last_full, created_at__lt=end)
+        )
+    else:
+        edges = _ledger(wallet_id).filter(created_at__gte=start, created_at__lt=end)
+    
+    edge_credits, edge_debits, edge_count = _totals(edges)
+    
+    return {
+        'wallet_id': wallet_id,
+        'period_start': start,
+        'period_end': end,
+        'opening_balance': balance_at(wallet_id, start),
+        'closing_balance': balance_at(wallet_id, end),
+        'total_credits': credits + edge_credits,
+        'total_debits': debits + edge_debits,
+        'transaction_count': count + edge_count,
+    }
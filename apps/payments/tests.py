@@ -0,0 +1,1633 @@
+"""
+Payments tests
+Tests that run operations from several threads need row locks
+(select_for_update) and are skipped on SQLite.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import threading
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, IntegrityError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.utils import timezone
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from apps.cargo.models import Cargo, CargoHistory
+from apps.core.pagination import KeysetPagination
+from apps.core.testing import QueryCountMixin, QueryPlanMixin, create_cargo, create_customer, create_invoice, create_user
+from apps.invoices.models import Invoice
+from apps.payments import fx
+from apps.payments.confirmations import reconcile_gateway_operations, start_payment
+from apps.payments.models import ExchangeRate, GatewayOperation, IdempotencyKey, Payment, Refund, ReleaseOrder, Transaction, Wallet, WalletHold, WalletTransaction
+from apps.payments.gateway_stub import GatewayStubServer
+from apps.payments.idempotency import idempotent
+from apps.payments.integrity import verify_wallets
+from apps.payments.references import PaymentReferenceIndex, find_duplicate_references, normalize_reference
+from apps.payments.refunds import process_refunds, refund_payment
+from apps.payments.services import AsyncGatewayClient, BaseGatewayClient, HttpGatewayClient, PaymentGatewayService
+from apps.payments.statements import balance_at, build_wallet_snapshots, period_floor, wallet_statement
+from apps.payments.utils import (
+    finalize_payment, process_auto_payment, release_expired_holds, settle_all_pending_invoices, settle_invoice_from_wallet,
+    settle_invoices_from_wallet, settle_pending_invoices
+)
+from apps.payments.velocity import SlidingWindow, VelocityLimitExceeded, VelocityTracker, withdrawal_velocity
+
+
+def create_wallet(balance=0, customer=None):
+    """Wallet of `customer` (default: a new customer), with an opening deposit of `balance`"""
+    wallet = Wallet.objects.create(customer=customer or create_customer())
+    if balance:
+        wallet.deposit(balance, 'OPENING')
+    wallet.refresh_from_db()
+    return wallet
+
+
+def run_concurrently(target, count):
+    """
+    Call target(i) for i in range(count), each in its own thread, released
+    together. Returns: the exceptions raised by the calls
+    """
+    barrier = threading.Barrier(count)
+    errors = []
+    
+    def worker(i):
+        try:
+            barrier.wait()
+            target(i)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+    
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def assert_ledger_chain(test, wallet):
+    """Every WalletTransaction starts where the previous one ended and moves the balance by its amount"""
+    transactions = list(wallet.transactions.order_by('transaction_id'))
+    balance = Decimal('0.00')
+    for transaction in transactions:
+        sign = -1 if transaction.transaction_type in WalletTransaction.DEBIT_TYPES else 1
+        test.assertEqual(transaction.balance_before, balance)
+        test.assertEqual(transaction.balance_after, balance + sign * transaction.amount)
+        balance = transaction.balance_after
+    wallet = Wallet.objects.get(pk=wallet.pk)
+    test.assertEqual(wallet.current_balance, balance)
+
+
+class WalletBalanceTests(TestCase):
+    """Balance changes are applied in the database, not from the instance"""
+    
+    def test_stale_instances_do_not_lose_updates(self):
+        wallet = create_wallet(100)
+        first = Wallet.objects.get(pk=wallet.pk)
+        second = Wallet.objects.get(pk=wallet.pk)
+        
+        first.deposit(50, 'D1')
+        self.assertEqual(second.withdraw(30, 'W1'), Decimal('120.00'))
+        
+        wallet.refresh_from_db()
+        self.assertEqual(wallet.balance, Decimal('120.00'))
+        assert_ledger_chain(self, wallet)
+    
+    def test_insufficient_balance_changes_nothing(self):
+        wallet = create_wallet(20)
+        with self.assertRaisesMessage(ValueError, 'Insufficient wallet balance'):
+            wallet.withdraw(25, 'W1')
+        
+        wallet.refresh_from_db()
+        self.assertEqual(wallet.balance, Decimal('20.00'))
+        self.assertEqual(wallet.transactions.count(), 1)
+    
+    def test_batch_is_all_or_nothing(self):
+        wallet = create_wallet(20)
+        with self.assertRaises(ValueError):
+            wallet.apply_transactions([
+                dict(transaction_type='withdrawal', amount=15, reference='W1'),
+                dict(transaction_type='withdrawal', amount=15, reference='W2'),
+            ])
+        
+        wallet.refresh_from_db()
+        self.assertEqual(wallet.balance, Decimal('20.00'))
+        self.assertFalse(wallet.transactions.filter(reference__in=['W1', 'W2']).exists())
+    
+    def test_non_positive_amount_is_rejected(self):
+        wallet = create_wallet()
+        with self.assertRaises(ValueError):
+            wallet.deposit(0, 'D1')
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentWalletTests(TransactionTestCase):
+    """Concurrent operations on one wallet lose no update and never overdraw it"""
+    
+    def test_concurrent_deposits_and_withdrawals(self):
+        wallet = create_wallet(200)
+        
+        def operate(i):
+            instance = Wallet.objects.get(pk=wallet.pk)
+            if i % 2:
+                instance.withdraw(5, f'W{i}')
+            else:
+                instance.deposit(10, f'D{i}')
+        
+        self.assertEqual(run_concurrently(operate, 50), [])
+        
+        wallet.refresh_from_db()
+        self.assertEqual(wallet.balance, Decimal('200.00') + 25 * 10 - 25 * 5)
+        self.assertEqual(wallet.transactions.count(), 51)
+        assert_ledger_chain(self, wallet)
+    
+    def test_concurrent_withdrawals_never_overdraw(self):
+        wallet = create_wallet(100)
+        errors = run_concurrently(lambda i: Wallet.objects.get(pk=wallet.pk).withdraw(10, f'W{i}'), 30)
+        
+        self.assertEqual(len(errors), 20)
+        self.assertTrue(all(str(e) == 'Insufficient wallet balance' for e in errors))
+        wallet.refresh_from_db()
+        self.assertEqual(wallet.balance, Decimal('0.00'))
+        assert_ledger_chain(self, wallet)
+
+
+class WalletSettlementTests(TestCase):
+    """settle_invoice_from_wallet() writes a settlement atomically within a fixed query budget"""
+    
+    def setUp(self):
+        self.customer = create_customer()
+        self.wallet = create_wallet(100, self.customer)
+    
+    def test_settlement_query_budget(self):
+        # The first settlement creates the ledger accounts
+        settle_invoice_from_wallet(self.wallet, create_invoice(self.customer, 10))
+        
+        invoice = create_invoice(self.customer, 10)
+        # Hold: BEGIN, wallet lock, UPDATE, INSERT, COMMIT (5). Settlement:
+        # BEGIN, invoice claim, 3 INSERTs, hold lock, held UPDATE, wallet lock,
+        # balance UPDATE, ledger row INSERT, account lookup, journal and posting
+        # INSERTs, hold UPDATE, COMMIT (15)
+        with self.assertNumQueries(20):
+            payment, release_order, wallet_transaction = settle_invoice_from_wallet(self.wallet, invoice)
+        
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.status, 'paid')
+        self.assertEqual(wallet_transaction.payment, payment)
+        self.assertEqual(wallet_transaction.invoice, invoice)
+        self.assertEqual(release_order.payment, payment)
+        self.assertTrue(Transaction.objects.filter(payment=payment, transaction_type='cargo_payment').exists())
+        self.wallet.refresh_from_db()
+        self.assertEqual((self.wallet.balance, self.wallet.held_balance), (Decimal('80.00'), Decimal('0.00')))
+    
+    def test_paid_invoice_is_not_settled_twice(self):
+        invoice = create_invoice(self.customer, 10)
+        settle_invoice_from_wallet(self.wallet, invoice)
+        
+        with self.assertRaisesMessage(ValueError, 'Invoice already paid'):
+            settle_invoice_from_wallet(self.wallet, Invoice.objects.get(pk=invoice.pk))
+        
+        self.wallet.refresh_from_db()
+        self.assertEqual((self.wallet.balance, self.wallet.held_balance), (Decimal('90.00'), Decimal('0.00')))
+        self.assertEqual(Payment.objects.filter(invoice=invoice).count(), 1)
+        self.assertEqual(WalletHold.objects.filter(status='released').count(), 1)
+    
+    def test_failed_settlement_writes_nothing(self):
+        invoice = create_invoice(self.customer, 10)
+        with mock.patch.object(ReleaseOrder.objects, 'create', side_effect=DatabaseError('insert failed')):
+            with self.assertRaisesMessage(DatabaseError, 'insert failed'):
+                settle_invoice_from_wallet(self.wallet, invoice)
+        
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.status, 'pending')
+        self.assertFalse(Payment.objects.filter(invoice=invoice).exists())
+        self.wallet.refresh_from_db()
+        self.assertEqual((self.wallet.balance, self.wallet.held_balance), (Decimal('100.00'), Decimal('0.00')))
+    
+    def test_auto_payment_uses_the_settlement(self):
+        self.wallet.auto_payment_enabled = True
+        self.wallet.save(update_fields=['auto_payment_enabled'])
+        invoice = create_invoice(self.customer, 10)
+        
+        success, message, data = process_auto_payment(invoice)
+        
+        self.assertTrue(success, message)
+        wallet_transaction = WalletTransaction.objects.get(invoice=invoice)
+        self.assertEqual(wallet_transaction.transaction_type, 'auto_payment')
+        self.assertEqual(wallet_transaction.payment_id, data['payment_id'])
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentSettlementTests(TransactionTestCase):
+    """An invoice paid from several requests at once is settled and debited once"""
+    
+    def test_concurrent_payments_of_one_invoice(self):
+        customer = create_customer()
+        wallet = create_wallet(100, customer)
+        invoice = create_invoice(customer, 10)
+        
+        errors = run_concurrently(
+            lambda i: settle_invoice_from_wallet(Wallet.objects.get(pk=wallet.pk), Invoice.objects.get(pk=invoice.pk)),
+            10
+        )
+        
+        self.assertEqual(len(errors), 9)
+        self.assertTrue(all(str(e) == 'Invoice already paid' for e in errors))
+        self.assertEqual(Payment.objects.filter(invoice=invoice).count(), 1)
+        wallet.refresh_from_db()
+        self.assertEqual((wallet.balance, wallet.held_balance), (Decimal('90.00'), Decimal('0.00')))
+        assert_ledger_chain(self, wallet)
+
+
+class PaymentListIndexTests(QueryPlanMixin, TestCase):
+    """Payment and wallet transaction lists are served from their indexes"""
+    
+    def setUp(self):
+        customer = create_customer()
+        self.wallet = create_wallet(100, customer)
+        settle_invoice_from_wallet(self.wallet, create_invoice(customer, 10))
+        self.client = APIClient()
+        self.client.force_authenticate(create_user(customer.organization))
+    
+    def test_payment_list(self):
+        self.assertUsesIndex('/api/payments/', 'payments', 'payment_created_idx')
+    
+    def test_wallet_transactions(self):
+        url = f'/api/payments/wallets/{self.wallet.wallet_id}/transactions/'
+        self.assertUsesIndex(url, 'wallet_transactions', 'wallet_txn_wallet_created_idx')
+        self.assertUsesIndex(
+            f'{url}?transaction_type=payment', 'wallet_transactions', 'wallet_txn_wallet_type_idx'
+        )
+
+
+class PaymentQueryCountTests(QueryCountMixin, TestCase):
+    """Payment and wallet endpoints load the related rows they serialize in their own queries"""
+    
+    def setUp(self):
+        self.customer = create_customer()
+        self.wallet = create_wallet(1000, self.customer)
+        self.payment, self.release_order, _ = settle_invoice_from_wallet(self.wallet, create_invoice(self.customer, 10))
+        self.client = APIClient()
+        self.client.force_authenticate(create_user(self.customer.organization))
+    
+    def pay_invoices(self, count=5):
+        """Payments for new invoices of new cargo, the first from this wallet"""
+        for _ in range(count):
+            settle_invoice_from_wallet(self.wallet, create_invoice(self.customer, 10))
+    
+    def test_payment_list(self):
+        self.assertConstantQueries('/api/payments/', self.pay_invoices, expected=2)
+    
+    def test_payment_detail(self):
+        self.assertEqual(self.count_queries(f'/api/payments/{self.payment.payment_id}/'), 1)
+    
+    def test_release_order_detail(self):
+        self.assertEqual(self.count_queries(f'/api/payments/release-orders/{self.release_order.release_code}/'), 1)
+    
+    def test_wallet_list(self):
+        self.assertConstantQueries('/api/payments/wallets/', lambda: [create_wallet(10) for _ in range(5)], expected=3)
+    
+    def test_wallet_detail(self):
+        self.assertEqual(self.count_queries(f'/api/payments/wallets/{self.wallet.wallet_id}/'), 1)
+    
+    def test_wallet_transactions(self):
+        self.assertConstantQueries(
+            f'/api/payments/wallets/{self.wallet.wallet_id}/transactions/', self.pay_invoices, expected=3
+        )
+
+
+def interleave_debit(operation):
+    """Patch Wallet so that operation() runs between the first debit's balance check and its shard update"""
+    debit_shards = Wallet._debit_shards
+    interleaved = []
+    
+    def interleaved_debit_shards(wallet, shards, amount):
+        if not interleaved:
+            interleaved.append(amount)
+            operation()
+        return debit_shards(wallet, shards, amount)
+    
+    return mock.patch.object(Wallet, '_debit_shards', interleaved_debit_shards)
+
+
+class ShardedWalletTests(TestCase):
+    """A sharded wallet keeps the balance, checks and audit trail of a single-row wallet"""
+    
+    def setUp(self):
+        self.wallet = create_wallet(Decimal('100.05'))
+        self.wallet.set_balance_shards(4)
+    
+    def shard_balances(self):
+        return list(self.wallet.shards.order_by('shard_index').values_list('balance', flat=True))
+    
+    def test_resharding_keeps_the_balance(self):
+        self.assertEqual(self.shard_balances(), [Decimal('25.02'), Decimal('25.01'), Decimal('25.01'), Decimal('25.01')])
+        wallet = Wallet.objects.get(pk=self.wallet.pk)
+        self.assertEqual((wallet.balance, wallet.current_balance), (Decimal('0.00'), Decimal('100.05')))
+        
+        self.wallet.set_balance_shards(0)
+        wallet.refresh_from_db()
+        self.assertEqual(wallet.balance, Decimal('100.05'))
+        self.assertEqual(sum(self.shard_balances()), Decimal('0.00'))
+    
+    def test_debit_larger_than_any_shard(self):
+        self.assertTrue(self.wallet.has_sufficient_balance(90))
+        self.assertEqual(self.wallet.withdraw(90, 'W1'), Decimal('10.05'))
+        self.assertEqual(sum(self.shard_balances()), Decimal('10.05'))
+        self.assertTrue(all(balance >= 0 for balance in self.shard_balances()))
+        
+        self.assertFalse(self.wallet.has_sufficient_balance(20))
+        with self.assertRaisesMessage(ValueError, 'Insufficient wallet balance'):
+            self.wallet.withdraw(20, 'W2')
+        self.assertEqual(sum(self.shard_balances()), Decimal('10.05'))
+    
+    def test_audit_trail(self):
+        self.wallet.deposit(5, 'D1')
+        self.wallet.withdraw(30, 'W1')
+        self.wallet.apply_transactions([
+            dict(transaction_type='withdrawal', amount=10, reference='W2'),
+            dict(transaction_type='deposit', amount=3, reference='D2'),
+        ])
+        assert_ledger_chain(self, self.wallet)
+    
+    def test_balance_at_does_not_rely_on_balance_after(self):
+        self.wallet.withdraw(30, 'W1')
+        # Concurrent debits leave balance_after out of order on sharded wallets
+        WalletTransaction.objects.filter(reference='W1').update(balance_after=Decimal('100.05'))
+        self.assertEqual(balance_at(self.wallet.pk, timezone.now()), Decimal('70.05'))
+    
+    def test_holds_count_against_every_shard(self):
+        self.wallet.authorize_hold(80)
+        with self.assertRaisesMessage(ValueError, 'Insufficient wallet balance'):
+            self.wallet.withdraw(25, 'W1')
+        with self.assertRaisesMessage(ValueError, 'Insufficient wallet balance'):
+            self.wallet.authorize_hold(25)
+        self.assertEqual(self.wallet.withdraw(20, 'W2'), Decimal('80.05'))
+    
+    def test_holds_move_funds_off_the_shards(self):
+        hold = self.wallet.authorize_hold(50)
+        wallet = Wallet.objects.get(pk=self.wallet.pk)
+        self.assertEqual((wallet.balance, wallet.held_balance), (Decimal('50.00'), Decimal('50.00')))
+        self.assertEqual(sum(self.shard_balances()), Decimal('50.05'))
+        self.assertEqual(wallet.current_balance, Decimal('100.05'))
+        
+        self.wallet.capture_hold(hold.hold_id, amount=30)
+        wallet.refresh_from_db()
+        self.assertEqual((wallet.balance, wallet.held_balance), (Decimal('0.00'), Decimal('0.00')))
+        self.assertEqual(sum(self.shard_balances()), Decimal('70.05'))
+        
+        hold = self.wallet.authorize_hold(20)
+        self.wallet.set_balance_shards(2)
+        self.assertEqual(self.shard_balances()[:2], [Decimal('25.03'), Decimal('25.02')])
+        self.wallet.release_hold(hold.hold_id)
+        wallet.refresh_from_db()
+        self.assertEqual((wallet.balance, wallet.held_balance), (Decimal('0.00'), Decimal('0.00')))
+        self.assertEqual(wallet.current_balance, Decimal('70.05'))
+    
+    def test_interleaved_debits_cannot_spend_held_funds(self):
+        self.wallet.authorize_hold(50)
+        balances = []
+        
+        def withdraw():
+            balances.append(Wallet.objects.get(pk=self.wallet.pk).withdraw(40, 'W1'))
+        
+        with interleave_debit(withdraw):
+            with self.assertRaisesMessage(ValueError, 'Insufficient wallet balance'):
+                Wallet.objects.get(pk=self.wallet.pk).withdraw(40, 'W2')
+        self.assertEqual(balances, [Decimal('60.05')])
+    
+    def test_hold_between_check_and_debit_is_not_spent(self):
+        holds = []
+        
+        def authorize_hold():
+            holds.append(Wallet.objects.get(pk=self.wallet.pk).authorize_hold(70))
+        
+        with interleave_debit(authorize_hold):
+            with self.assertRaisesMessage(ValueError, 'Insufficient wallet balance'):
+                Wallet.objects.get(pk=self.wallet.pk).withdraw(40, 'W1')
+        self.assertEqual(len(holds), 1)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentShardedWalletTests(TransactionTestCase):
+    """Concurrent debits spread over the shards lose no update and never overdraw a shard"""
+    
+    def test_concurrent_payments(self):
+        wallet = create_wallet(400)
+        wallet.set_balance_shards(8)
+        
+        self.assertEqual(run_concurrently(lambda i: Wallet.objects.get(pk=wallet.pk).withdraw(5, f'W{i}'), 40), [])
+        
+        wallet = Wallet.objects.get(pk=wallet.pk)
+        self.assertEqual(wallet.current_balance, Decimal('200.00'))
+        self.assertEqual(wallet.transactions.filter(transaction_type='withdrawal').count(), 40)
+        self.assertFalse(wallet.shards.filter(balance__lt=0).exists())
+    
+    def test_concurrent_withdrawals_never_overdraw(self):
+        wallet = create_wallet(100)
+        wallet.set_balance_shards(4)
+        
+        errors = run_concurrently(lambda i: Wallet.objects.get(pk=wallet.pk).withdraw(10, f'W{i}'), 30)
+        
+        self.assertEqual(len(errors), 20)
+        self.assertTrue(all(str(e) == 'Insufficient wallet balance' for e in errors))
+        wallet = Wallet.objects.get(pk=wallet.pk)
+        self.assertEqual(wallet.current_balance, Decimal('0.00'))
+        self.assertFalse(wallet.shards.filter(balance__lt=0).exists())
+    
+    def test_concurrent_holds_and_withdrawals_never_spend_held_funds(self):
+        wallet = create_wallet(100)
+        wallet.set_balance_shards(4)
+        
+        def operate(i):
+            instance = Wallet.objects.get(pk=wallet.pk)
+            if i % 2:
+                instance.withdraw(10, f'W{i}')
+            else:
+                instance.authorize_hold(10)
+        
+        errors = run_concurrently(operate, 30)
+        
+        self.assertEqual(len(errors), 20)
+        wallet = Wallet.objects.get(pk=wallet.pk)
+        self.assertEqual(wallet.current_balance, wallet.held_balance)
+        self.assertEqual(wallet.held_balance, 10 * WalletHold.objects.filter(wallet=wallet).count())
+        self.assertFalse(wallet.shards.filter(balance__lt=0).exists())
+
+
+class SlidingWindowTests(TestCase):
+    """Events leave the window bucket by bucket as time moves on"""
+    
+    def test_events_expire(self):
+        window = SlidingWindow(60)
+        window.add(1000, Decimal('10'))
+        window.add(1030, Decimal('5'))
+        
+        self.assertEqual(window.totals(1059), (2, Decimal('15')))
+        self.assertEqual(window.retry_after(1059), 1)
+        self.assertEqual(window.totals(1060), (1, Decimal('5')))
+        self.assertEqual(window.retry_after(1060), 30)
+        self.assertEqual(window.totals(1200), (0, Decimal('0')))
+        self.assertIsNone(window.retry_after(1200))
+    
+    def test_events_older_than_the_window_are_ignored(self):
+        window = SlidingWindow(60)
+        window.add(1100, Decimal('1'))
+        window.add(1000, Decimal('5'))
+        self.assertEqual(window.totals(1100), (1, Decimal('1')))
+
+
+@override_settings(WALLET_VELOCITY={'ENABLED': True, 'RULES': [
+    {'scope': 'wallet', 'window': 60 * 60, 'max_count': 2},
+    {'scope': 'user', 'window': 60 * 60, 'max_amount': 100},
+]})
+class VelocityTrackerTests(TestCase):
+    """Withdrawals are counted per wallet and user, uncounted on release and rebuilt from the ledger"""
+    
+    def setUp(self):
+        self.wallet = create_wallet(500)
+        self.tracker = VelocityTracker()
+    
+    def test_check_and_record(self):
+        self.tracker.check_and_record(self.wallet, 1, Decimal('10'))
+        entry = self.tracker.check_and_record(self.wallet, 1, Decimal('10'))
+        with self.assertRaises(VelocityLimitExceeded) as raised:
+            self.tracker.check_and_record(self.wallet, 1, Decimal('10'))
+        self.assertEqual(raised.exception.rule['max_count'], 2)
+        self.assertGreater(raised.exception.retry_after, 0)
+        
+        self.tracker.release(entry)
+        self.tracker.check_and_record(self.wallet, 1, Decimal('10'))
+    
+    def test_rejected_withdrawal_is_not_counted(self):
+        other_wallet = create_wallet(500)
+        self.tracker.check_and_record(self.wallet, 1, Decimal('90'))
+        with self.assertRaisesMessage(VelocityLimitExceeded, 'Withdrawal limit reached'):
+            self.tracker.check_and_record(other_wallet, 1, Decimal('20'))
+        self.tracker.check_and_record(other_wallet, 1, Decimal('10'))
+        self.tracker.check_and_record(other_wallet, 2, Decimal('50'))
+    
+    def test_rebuilt_from_wallet_transactions(self):
+        self.wallet.withdraw(10, 'W1')
+        self.wallet.withdraw(10, 'W2')
+        with self.assertRaisesMessage(VelocityLimitExceeded, 'Too many withdrawals'):
+            self.tracker.check_and_record(self.wallet, 1, Decimal('10'))
+    
+    @override_settings(WALLET_VELOCITY={})
+    def test_off_by_default(self):
+        for _ in range(5):
+            self.assertIsNone(self.tracker.check_and_record(self.wallet, 1, Decimal('1000')))
+
+
+@override_settings(WALLET_VELOCITY={'ENABLED': True, 'RULES': [{'scope': 'wallet', 'window': 60 * 60, 'max_count': 1}]})
+class WalletWithdrawVelocityTests(TestCase):
+    """The withdraw endpoint answers 429 for a withdrawal that breaks a velocity rule"""
+    
+    def setUp(self):
+        withdrawal_velocity.clear()
+        self.addCleanup(withdrawal_velocity.clear)
+        customer = create_customer()
+        self.wallet = create_wallet(100, customer)
+        self.client = APIClient()
+        self.client.force_authenticate(create_user(customer.organization))
+        self.url = f'/api/payments/wallets/{self.wallet.wallet_id}/withdraw/'
+    
+    def test_limit_exceeded(self):
+        self.assertEqual(self.client.post(self.url, {'amount': 10}, format='json').status_code, 200)
+        
+        response = self.client.post(self.url, {'amount': 10}, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(response.data['success'])
+        self.assertIn('Retry-After', response)
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal('90.00'))
+    
+    def test_failed_withdrawal_is_not_counted(self):
+        self.assertEqual(self.client.post(self.url, {'amount': 500}, format='json').status_code, 400)
+        self.assertEqual(self.client.post(self.url, {'amount': 10}, format='json').status_code, 200)
+
+
+class StatementImportTests(TestCase):
+    """The statement import endpoint settles matching invoices once and reports every other line"""
+    
+    def setUp(self):
+        # A fresh reference filter, the process-wide one remembers payments of other tests
+        patcher = mock.patch('apps.payments.reconciliation.payment_references', PaymentReferenceIndex())
+        self.references = patcher.start()
+        self.addCleanup(patcher.stop)
+        
+        customer = create_customer()
+        self.first = create_invoice(customer, 10)
+        self.second = create_invoice(customer, 20)
+        self.client = APIClient()
+        self.client.force_authenticate(create_user(customer.organization))
+    
+    def post_statement(self, *lines):
+        rows = ['control_number,reference,amount'] + [','.join(str(value) for value in line) for line in lines]
+        statement = SimpleUploadedFile('statement.csv', '\n'.join(rows).encode())
+        response = self.client.post('/api/payments/import/', {'file': statement}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        return response.data['data']
+    
+    def test_matched_lines_settle_invoices(self):
+        report = self.post_statement(
+            (self.first.control_number, 'ref 1', '10.00'),
+            (self.second.control_number, 'REF2', 20),
+        )
+        
+        self.assertEqual((report['total_lines'], report['matched'], report['matched_amount']), (2, 2, 30.0))
+        self.assertEqual(Invoice.objects.filter(status='paid').count(), 2)
+        self.assertEqual(
+            set(Payment.objects.values_list('payment_reference', flat=True)), {'REF1', 'REF2'}
+        )
+        self.assertEqual(ReleaseOrder.objects.values('release_code').distinct().count(), 2)
+    
+    def test_duplicate_lines(self):
+        report = self.post_statement(
+            (self.first.control_number, 'REF1', 10),
+            (self.second.control_number, 'REF1', 20),
+            (self.first.control_number, 'REF3', 10),
+        )
+        self.assertEqual(report['matched'], 1)
+        self.assertEqual(
+            [(line['line'], line['reason']) for line in report['duplicates']],
+            [(3, 'duplicate_reference'), (4, 'invoice_already_paid')]
+        )
+        
+        report = self.post_statement((self.first.control_number, 'REF1', 10))
+        self.assertEqual((report['matched'], report['duplicates'][0]['reason']), (0, 'duplicate_reference'))
+        self.assertEqual(Payment.objects.count(), 1)
+    
+    def test_unknown_and_invalid_lines(self):
+        report = self.post_statement(
+            ('CN-UNKNOWN', 'REF1', 10),
+            (self.first.control_number, 'REF2', 15),
+            (self.second.control_number, 'REF3', 'abc'),
+            (self.second.control_number, '', 20),
+        )
+        
+        self.assertEqual(report['matched'], 0)
+        self.assertEqual(
+            [line['reason'] for line in report['unmatched']], ['unknown_control_number', 'amount_mismatch']
+        )
+        self.assertEqual(
+            [line['reason'] for line in report['invalid']], ['invalid_amount', 'missing_control_number_or_reference']
+        )
+        self.assertFalse(Payment.objects.exists())
+    
+    def test_reference_missed_by_the_filter_is_retried(self):
+        self.post_statement((self.first.control_number, 'REF1', 10))
+        
+        with mock.patch.object(self.references, 'screen', side_effect=lambda pairs: ([], list(pairs))):
+            report = self.post_statement((self.second.control_number, 'REF1', 20))
+        
+        self.assertEqual((report['matched'], report['duplicates'][0]['reason']), (0, 'duplicate_reference'))
+        self.assertEqual(Payment.objects.count(), 1)
+    
+    def test_release_code_collision_is_not_a_duplicate(self):
+        self.post_statement((self.first.control_number, 'REF1', 10))
+        taken = ReleaseOrder.objects.get().release_code
+        
+        codes = iter([taken, taken, 'RO-NEW'])
+        with mock.patch('apps.payments.reconciliation.generate_release_code', side_effect=lambda: next(codes)):
+            report = self.post_statement((self.second.control_number, 'REF2', 20))
+        
+        self.assertEqual(report['matched'], 1)
+        self.assertTrue(ReleaseOrder.objects.filter(payment__invoice=self.second, release_code='RO-NEW').exists())
+
+
+class HttpGatewayClientTests(TestCase):
+    """HttpGatewayClient against the local gateway stub: retries, timeouts and idempotent writes"""
+    
+    def test_interface_is_abstract(self):
+        with self.assertRaises(TypeError):
+            BaseGatewayClient()
+    
+    def test_transient_failures_are_retried(self):
+        with GatewayStubServer(failures=2) as stub:
+            client = HttpGatewayClient(stub.url, max_retries=3, backoff_factor=0)
+            success, reference, response = client.process_deposit(10, 'mobile_money')
+        
+        self.assertTrue(success)
+        self.assertEqual(response['transaction_id'], reference)
+        self.assertEqual(stub.request_count, 3)
+    
+    def test_retries_give_up(self):
+        with GatewayStubServer(failures=5) as stub:
+            client = HttpGatewayClient(stub.url, max_retries=1, backoff_factor=0)
+            success, _, response = client.process_deposit(10, 'mobile_money')
+        
+        self.assertFalse(success)
+        self.assertEqual(response['status'], 'error')
+        self.assertEqual(stub.request_count, 2)
+    
+    def test_slow_gateway_times_out(self):
+        with GatewayStubServer(latency=0.5) as stub:
+            client = HttpGatewayClient(stub.url, read_timeout=0.1, max_retries=0)
+            verified, response = client.verify_payment('DEP-1')
+        
+        self.assertFalse(verified)
+        self.assertEqual(response['status'], 'error')
+        self.assertIn('Read timed out', response['message'])
+    
+    def test_repeated_refund_is_replayed(self):
+        with GatewayStubServer() as stub:
+            client = HttpGatewayClient(stub.url)
+            first = client.process_refund(5, 'DEP-1', 'REF-1')
+            second = client.process_refund(5, 'DEP-1', 'REF-1')
+        
+        self.assertEqual(first, second)
+        self.assertEqual(stub.references, {'REF-1'})
+
+
+class AsyncGatewayClientTests(TestCase):
+    """AsyncGatewayClient runs batches concurrently, at most max_concurrency at a time"""
+    
+    def test_verify_payments(self):
+        with GatewayStubServer(latency=0.1) as stub:
+            client = HttpGatewayClient(stub.url)
+            client.process_deposit(10, 'mobile_money')
+            known = next(iter(stub.references))
+            references = [known] + [f'DEP-{i}' for i in range(9)]
+            
+            results = asyncio.run(AsyncGatewayClient(client, max_concurrency=3).verify_payments(references))
+        
+        self.assertEqual(list(results), references)
+        self.assertEqual([verified for verified, _ in results.values()], [True] + [False] * 9)
+        self.assertEqual(stub.max_in_flight, 3)
+    
+    def test_process_refunds_keeps_the_order(self):
+        refunds = [(i, f'DEP-{i}', f'REF-{i}') for i in range(1, 7)]
+        with GatewayStubServer(latency=0.05) as stub:
+            results = asyncio.run(AsyncGatewayClient(HttpGatewayClient(stub.url), max_concurrency=6).process_refunds(refunds))
+        
+        self.assertEqual([reference for _, reference, _ in results], [reference for _, _, reference in refunds])
+        self.assertTrue(all(success for success, _, _ in results))
+        self.assertGreater(stub.max_in_flight, 1)
+
+
+class CompleteReleaseOrderTests(TestCase):
+    """A release order can only be completed for arrived cargo, which it moves to delivered"""
+    
+    def setUp(self):
+        customer = create_customer()
+        self.cargo = create_cargo(customer, status='in_transit')
+        _, self.release_order, _ = settle_invoice_from_wallet(
+            create_wallet(100, customer), create_invoice(customer, 10, self.cargo)
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(create_user(customer.organization))
+        self.url = f'/api/payments/release-orders/{self.release_order.release_order_id}/complete/'
+    
+    def test_cargo_not_arrived(self):
+        response = self.client.patch(self.url)
+        
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['error'], 'Cargo is not awaiting collection')
+        self.release_order.refresh_from_db()
+        self.cargo.refresh_from_db()
+        self.assertEqual((self.release_order.status, self.cargo.status), ('active', 'in_transit'))
+    
+    def test_arrived_cargo_is_delivered(self):
+        Cargo.objects.filter(pk=self.cargo.pk).update(status='arrived')
+        
+        response = self.client.patch(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.release_order.refresh_from_db()
+        self.cargo.refresh_from_db()
+        self.assertEqual((self.release_order.status, self.cargo.status), ('used', 'delivered'))
+        self.assertEqual(CargoHistory.objects.get(cargo=self.cargo).previous_status, 'arrived')
+        
+        self.assertEqual(self.client.patch(self.url).status_code, 400)
+
+
+class WalletHoldTests(TestCase):
+    """Holds reserve the available balance until they are captured, released or expire"""
+    
+    def setUp(self):
+        self.wallet = create_wallet(100)
+    
+    def balances(self, wallet=None):
+        wallet = Wallet.objects.get(pk=(wallet or self.wallet).pk)
+        return wallet.current_balance, wallet.held_balance
+    
+    def test_hold_reduces_the_available_balance(self):
+        self.wallet.authorize_hold(70)
+        with self.assertRaisesMessage(ValueError, 'Insufficient wallet balance'):
+            self.wallet.withdraw(40, 'W1')
+        with self.assertRaisesMessage(ValueError, 'Insufficient wallet balance'):
+            self.wallet.authorize_hold(40)
+        
+        self.wallet.withdraw(30, 'W2')
+        self.assertEqual(self.balances(), (Decimal('70.00'), Decimal('70.00')))
+    
+    def test_partial_capture(self):
+        invoice = create_invoice(self.wallet.customer, 50)
+        hold = self.wallet.authorize_hold(70, 'HLD-1', invoice=invoice)
+        
+        wallet_transaction = self.wallet.capture_hold(hold.hold_id, 50)
+        
+        self.assertEqual(self.balances(), (Decimal('50.00'), Decimal('0.00')))
+        self.assertEqual(
+            (wallet_transaction.amount, wallet_transaction.reference, wallet_transaction.invoice_id),
+            (Decimal('50.00'), 'HLD-1', invoice.invoice_id)
+        )
+        hold.refresh_from_db()
+        self.assertEqual((hold.status, hold.captured_amount, hold.wallet_transaction_id), ('captured', Decimal('50.00'), wallet_transaction.pk))
+        
+        with self.assertRaisesMessage(ValueError, 'Capture amount exceeds the held amount'):
+            self.wallet.capture_hold(self.wallet.authorize_hold(10).hold_id, 20)
+    
+    def test_capture_after_expiry(self):
+        hold = self.wallet.authorize_hold(30, expires_in=0)
+        with self.assertRaisesMessage(ValueError, 'Hold has expired'):
+            self.wallet.capture_hold(hold.hold_id)
+        self.assertEqual(self.balances(), (Decimal('100.00'), Decimal('30.00')))
+    
+    def test_hold_is_settled_once(self):
+        captured = self.wallet.authorize_hold(10)
+        self.wallet.capture_hold(captured.hold_id)
+        released = self.wallet.authorize_hold(20)
+        self.wallet.release_hold(released.hold_id)
+        
+        for hold_id, status in ((captured.hold_id, 'captured'), (released.hold_id, 'released')):
+            with self.assertRaisesMessage(ValueError, f'Hold is already {status}'):
+                self.wallet.capture_hold(hold_id)
+            with self.assertRaisesMessage(ValueError, f'Hold is already {status}'):
+                self.wallet.release_hold(hold_id)
+        with self.assertRaisesMessage(ValueError, 'Hold not found'):
+            create_wallet(10).release_hold(released.hold_id)
+        
+        self.assertEqual(self.balances(), (Decimal('90.00'), Decimal('0.00')))
+    
+    def test_sweeper_releases_expired_holds(self):
+        sharded = create_wallet(100)
+        sharded.set_balance_shards(4)
+        expired = [self.wallet.authorize_hold(10, expires_in=0), self.wallet.authorize_hold(20, expires_in=0)]
+        expired.append(sharded.authorize_hold(30, expires_in=0))
+        active = self.wallet.authorize_hold(40)
+        
+        self.assertEqual(release_expired_holds(batch_size=2), 3)
+        self.assertEqual(release_expired_holds(), 0)
+        
+        self.assertEqual(
+            set(WalletHold.objects.filter(pk__in=[hold.pk for hold in expired]).values_list('status', flat=True)), {'expired'}
+        )
+        self.assertEqual(WalletHold.objects.get(pk=active.pk).status, 'active')
+        self.assertEqual(self.balances(), (Decimal('100.00'), Decimal('40.00')))
+        self.assertEqual(self.balances(sharded), (Decimal('100.00'), Decimal('0.00')))
+        self.assertEqual(Wallet.objects.get(pk=sharded.pk).balance, Decimal('0.00'))
+
+
+class SettlePendingInvoicesTests(TestCase):
+    """Unpaid invoices are settled oldest first as far as the available balance goes"""
+    
+    def create_invoices(self, customer, *amounts):
+        invoices = [create_invoice(customer, amount) for amount in amounts]
+        for age, invoice in enumerate(reversed(invoices), start=1):
+            Invoice.objects.filter(pk=invoice.pk).update(created_at=timezone.now() - timedelta(days=age))
+        return invoices
+    
+    def test_oldest_first_partial_settlement(self):
+        wallet = create_wallet(60)
+        wallet.authorize_hold(10)
+        oldest, large, newest = self.create_invoices(wallet.customer, 30, 40, 20)
+        
+        settled, balance_before, balance_after = settle_pending_invoices(wallet)
+        
+        self.assertEqual([row['invoice_id'] for row in settled], [oldest.invoice_id, newest.invoice_id])
+        self.assertEqual((balance_before, balance_after), (Decimal('60.00'), Decimal('10.00')))
+        self.assertEqual(Invoice.objects.get(pk=large.pk).status, 'pending')
+        self.assertEqual(settle_pending_invoices(wallet)[0], [])
+    
+    def test_only_the_given_invoices(self):
+        wallet = create_wallet(100)
+        first, second = self.create_invoices(wallet.customer, 10, 10)
+        
+        settled, _, _ = settle_pending_invoices(wallet, invoice_ids=[second.invoice_id])
+        self.assertEqual([row['invoice_id'] for row in settled], [second.invoice_id])
+        self.assertEqual(Invoice.objects.get(pk=first.pk).status, 'pending')
+    
+    def test_scan_resumes_after_the_last_wallet(self):
+        wallets = []
+        for _ in range(5):
+            wallet = create_wallet(100)
+            Wallet.objects.filter(pk=wallet.pk).update(auto_payment_enabled=True)
+            self.create_invoices(wallet.customer, 10)
+            wallets.append(wallet)
+        idle = create_wallet(100)
+        Wallet.objects.filter(pk=idle.pk).update(auto_payment_enabled=True)
+        
+        chunks = settle_all_pending_invoices(chunk_size=2)
+        self.assertEqual(next(chunks), (wallets[1].wallet_id, 2, 2))
+        
+        # An interrupted run is resumed from the last reported wallet
+        chunks = list(settle_all_pending_invoices(after_wallet_id=wallets[1].wallet_id, chunk_size=2))
+        self.assertEqual(chunks, [(wallets[3].wallet_id, 2, 2), (wallets[4].wallet_id, 1, 1)])
+        self.assertFalse(Invoice.objects.exclude(status='paid').exists())
+        self.assertEqual(list(settle_all_pending_invoices()), [])
+
+
+class LedgerIntegrityTests(TestCase):
+    """verify_wallets() reports chain breaks, amount mismatches and balance mismatches per wallet"""
+    
+    def create_ledger(self):
+        wallet = create_wallet(100)
+        wallet.withdraw(30, 'W1')
+        return wallet
+    
+    def test_discrepancies(self):
+        clean = self.create_ledger()
+        chain_break = self.create_ledger()
+        chain_break.transactions.filter(reference='W1').update(balance_before=Decimal('90.00'), balance_after=Decimal('60.00'))
+        amount_mismatch = self.create_ledger()
+        amount_mismatch.transactions.filter(reference='W1').update(balance_after=Decimal('65.00'))
+        balance_mismatch = self.create_ledger()
+        Wallet.objects.filter(pk=balance_mismatch.pk).update(balance=Decimal('80.00'))
+        # Interleaved debits leave sharded ledgers unchained
+        sharded = self.create_ledger()
+        sharded.set_balance_shards(2)
+        sharded.transactions.filter(reference='W1').update(balance_before=Decimal('90.00'), balance_after=Decimal('60.00'))
+        
+        results = list(verify_wallets(workers=1, batch_size=2))
+        
+        self.assertEqual([result['wallets'] for result in results], [2, 2, 1])
+        self.assertEqual(sum(result['transactions'] for result in results), 10)
+        reported = {
+            wallet['wallet_id']: [
+                (discrepancy['type'], discrepancy['expected'], discrepancy['actual'])
+                for discrepancy in wallet['discrepancies']
+            ]
+            for result in results for wallet in result['discrepancies']
+        }
+        self.assertEqual(reported, {
+            chain_break.pk: [('chain_break', '100.00', '90.00')],
+            amount_mismatch.pk: [('amount_mismatch', '70.00', '65.00')],
+            balance_mismatch.pk: [('balance_mismatch', '70.00', '80.00')],
+        })
+        self.assertNotIn(clean.pk, reported)
+        self.assertNotIn(sharded.pk, reported)
+
+
+def gateway_refunds(success=True, before=None):
+    """Stand-in for PaymentGatewayService.process_refunds() that calls before() first"""
+    def process(refunds, max_concurrency=None):
+        if before:
+            before()
+        return [
+            (success, reference, {'reference': reference, 'message': None if success else 'Declined'})
+            for _, _, reference in refunds
+        ]
+    return mock.patch.object(PaymentGatewayService, 'process_refunds', side_effect=process)
+
+
+class RefundTests(TestCase):
+    """Refunds go back to the paying wallet or through the gateway, once, under the run's lease"""
+    
+    def setUp(self):
+        customer = create_customer()
+        self.wallet = create_wallet(100, customer)
+        self.wallet_payment, self.release_order, _ = settle_invoice_from_wallet(self.wallet, create_invoice(customer, 40))
+        
+        invoice = create_invoice(customer, 25)
+        self.gateway_payment = Payment.objects.create(
+            invoice=invoice, amount_paid=invoice.amount, payment_reference='MM-1', payment_method='mobile_money'
+        )
+        finalize_payment(self.gateway_payment)
+    
+    def test_full_wallet_refund(self):
+        with gateway_refunds() as process:
+            refund = refund_payment(self.wallet_payment)
+        
+        process.assert_not_called()
+        self.assertEqual(refund.status, 'completed')
+        self.assertEqual(refund.wallet_transaction.amount, Decimal('40.00'))
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.current_balance, Decimal('100.00'))
+        assert_ledger_chain(self, self.wallet)
+        
+        self.wallet_payment.refresh_from_db()
+        self.release_order.refresh_from_db()
+        self.assertEqual(self.wallet_payment.status, 'refunded')
+        self.assertEqual(Invoice.objects.get(pk=self.wallet_payment.invoice_id).status, 'cancelled')
+        self.assertEqual(self.release_order.status, 'expired')
+    
+    def test_partial_refund_is_final(self):
+        refund = refund_payment(self.wallet_payment, amount=10)
+        
+        self.assertEqual(refund.status, 'completed')
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.current_balance, Decimal('70.00'))
+        self.wallet_payment.refresh_from_db()
+        self.release_order.refresh_from_db()
+        self.assertEqual(self.wallet_payment.status, 'completed')
+        self.assertEqual(self.release_order.status, 'active')
+        
+        with self.assertRaisesMessage(ValueError, 'Payment already refunded'):
+            refund_payment(self.wallet_payment, amount=10)
+        self.assertEqual(Refund.objects.filter(payment=self.wallet_payment).count(), 1)
+    
+    def test_gateway_refund(self):
+        with gateway_refunds() as process:
+            refund = refund_payment(self.gateway_payment)
+        
+        process.assert_called_once()
+        self.assertEqual(process.call_args[0][0], [(Decimal('25.00'), 'MM-1', refund.reference)])
+        self.assertEqual(refund.status, 'completed')
+        self.assertEqual(
+            (refund.transaction.transaction_type, refund.transaction.amount, refund.transaction.reference),
+            ('refund', Decimal('25.00'), refund.reference)
+        )
+        self.gateway_payment.refresh_from_db()
+        self.assertEqual(self.gateway_payment.status, 'refunded')
+    
+    def test_failed_gateway_refund_is_retried_with_its_reference(self):
+        with gateway_refunds(success=False):
+            failed = refund_payment(self.gateway_payment)
+        self.assertEqual((failed.status, failed.error), ('failed', 'Declined'))
+        self.assertFalse(Transaction.objects.filter(transaction_type='refund').exists())
+        
+        with gateway_refunds() as process:
+            refund = refund_payment(self.gateway_payment)
+        
+        self.assertEqual(refund.pk, failed.pk)
+        self.assertEqual(process.call_args[0][0][0][2], failed.reference)
+        self.assertEqual((refund.status, refund.attempts), ('completed', 2))
+    
+    @override_settings(REFUND_LEASE_TIMEOUT=60)
+    def test_processing_refund_is_only_taken_over_after_its_lease(self):
+        refund = Refund.objects.create(payment=self.gateway_payment, amount=Decimal('25.00'), reference='RFD-LEASE')
+        Refund.objects.filter(pk=refund.pk).update(status='processing', updated_at=timezone.now() - timedelta(seconds=30))
+        
+        with gateway_refunds() as process:
+            self.assertEqual(process_refunds([refund.pk]), {'completed': 0, 'failed': 0})
+        process.assert_not_called()
+        
+        Refund.objects.filter(pk=refund.pk).update(updated_at=timezone.now() - timedelta(seconds=90))
+        with gateway_refunds():
+            self.assertEqual(process_refunds([refund.pk]), {'completed': 1, 'failed': 0})
+        refund.refresh_from_db()
+        self.assertEqual(refund.status, 'completed')
+    
+    def test_refund_taken_over_is_left_to_the_other_run(self):
+        refund = Refund.objects.create(payment=self.gateway_payment, amount=Decimal('25.00'), reference='RFD-LEASE')
+        taken_over_at = timezone.now() + timedelta(seconds=1)
+        
+        def take_over():
+            Refund.objects.filter(pk=refund.pk).update(updated_at=taken_over_at)
+        
+        with gateway_refunds(before=take_over):
+            self.assertEqual(process_refunds([refund.pk]), {'completed': 0, 'failed': 0})
+        
+        refund.refresh_from_db()
+        self.assertEqual((refund.status, refund.updated_at), ('processing', taken_over_at))
+        self.assertIsNone(refund.transaction)
+        self.gateway_payment.refresh_from_db()
+        self.assertEqual(self.gateway_payment.status, 'completed')
+
+
+@override_settings(PAYMENT_GATEWAY={'WEBHOOK_SECRET': 'callback-secret', 'VERIFY_AFTER': 60, 'PENDING_TTL': 3600})
+class GatewayConfirmationTests(TestCase):
+    """Pending operations are finalized once, by a signed callback or the reconciliation worker"""
+    
+    url = '/api/payments/gateway/callback/'
+    
+    def setUp(self):
+        customer = create_customer()
+        self.wallet = create_wallet(0, customer)
+        self.deposit = GatewayOperation.objects.create(
+            operation_type='deposit', reference='DEP-1', amount=Decimal('50.00'),
+            payment_method='mobile_money', description='Deposit of $50', wallet=self.wallet
+        )
+        self.invoice = create_invoice(customer, 30)
+        self.operation = start_payment(self.invoice, Decimal('30.00'), 'mobile_money', reference='mm 2')
+        self.client = APIClient()
+    
+    def callback(self, reference, callback_status='success', secret='callback-secret', signature=None):
+        body = json.dumps({'reference': reference, 'status': callback_status}).encode()
+        if signature is None:
+            signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        return self.client.post(self.url, body, content_type='application/json', HTTP_X_GATEWAY_SIGNATURE=signature)
+    
+    def test_bad_signature(self):
+        response = self.callback('DEP-1', secret='other-secret')
+        
+        self.assertEqual(response.status_code, 403)
+        self.deposit.refresh_from_db()
+        self.assertEqual(self.deposit.status, 'pending')
+    
+    def test_missing_signature(self):
+        self.assertEqual(self.callback('DEP-1', signature='').status_code, 403)
+    
+    def test_no_secret_configured(self):
+        with override_settings(PAYMENT_GATEWAY={'WEBHOOK_SECRET': ''}):
+            response = self.callback('DEP-1', secret='')
+        
+        self.assertEqual(response.status_code, 403)
+        self.deposit.refresh_from_db()
+        self.assertEqual(self.deposit.status, 'pending')
+    
+    def test_unknown_reference(self):
+        self.assertEqual(self.callback('DEP-404').status_code, 404)
+    
+    def test_repeated_deposit_callback_credits_once(self):
+        first = self.callback('dep-1')
+        second = self.callback('DEP-1')
+        
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.data['message'], 'Operation updated')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data['message'], 'Operation already completed')
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.current_balance, Decimal('50.00'))
+        self.assertEqual(self.wallet.transactions.filter(transaction_type='deposit').count(), 1)
+    
+    def test_payment_callbacks(self):
+        self.assertEqual(self.callback('MM2').status_code, 200)
+        self.assertEqual(self.callback('MM2', 'failed').data['message'], 'Operation already completed')
+        
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.status, 'paid')
+        self.assertEqual(Payment.objects.get(pk=self.operation.payment_id).status, 'completed')
+        self.assertEqual(Transaction.objects.filter(payment_id=self.operation.payment_id).count(), 1)
+    
+    def test_failed_payment_callback(self):
+        self.assertEqual(self.callback('MM2', 'failed').status_code, 200)
+        
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.status, 'pending')
+        self.assertEqual(Payment.objects.get(pk=self.operation.payment_id).status, 'failed')
+    
+    def test_reconcile_gateway_operations(self):
+        now = timezone.now()
+        GatewayOperation.objects.filter(reference='DEP-1').update(created_at=now - timedelta(seconds=120))
+        GatewayOperation.objects.filter(reference='MM2').update(created_at=now - timedelta(seconds=90))
+        for reference, age in (('DEP-DECLINED', 120), ('DEP-WAITING', 120), ('DEP-EXPIRED', 7200), ('DEP-NEW', 0)):
+            operation = GatewayOperation.objects.create(
+                operation_type='deposit', reference=reference, amount=Decimal('5.00'),
+                payment_method='mobile_money', wallet=self.wallet
+            )
+            GatewayOperation.objects.filter(pk=operation.pk).update(created_at=now - timedelta(seconds=age))
+        
+        results = {
+            'DEP-1': (True, {'status': 'success'}),
+            'MM2': (True, {'status': 'success'}),
+            'DEP-DECLINED': (False, {'status': 'declined'}),
+            'DEP-WAITING': (False, {'status': 'pending'}),
+            'DEP-EXPIRED': (False, {'status': 'pending'}),
+        }
+        with mock.patch.object(
+            PaymentGatewayService, 'verify_payments',
+            side_effect=lambda references, max_concurrency=None: {reference: results[reference] for reference in references}
+        ) as verify:
+            counts = reconcile_gateway_operations()
+            self.assertEqual(reconcile_gateway_operations()['checked'], 0)
+        
+        self.assertEqual(counts, {'checked': 5, 'completed': 2, 'failed': 2, 'pending': 1})
+        self.assertEqual(verify.call_count, 1)
+        self.assertEqual(
+            dict(GatewayOperation.objects.values_list('reference', 'status')),
+            {
+                'DEP-1': 'completed', 'MM2': 'completed', 'DEP-DECLINED': 'failed',
+                'DEP-WAITING': 'pending', 'DEP-EXPIRED': 'failed', 'DEP-NEW': 'pending',
+            }
+        )
+        self.assertEqual(GatewayOperation.objects.get(reference='DEP-WAITING').checks, 1)
+        self.assertFalse(GatewayOperation.objects.get(reference='DEP-NEW').last_checked_at)
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.current_balance, Decimal('50.00'))
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.status, 'paid')
+
+
+class ExchangeRateTests(TestCase):
+    """Rates are found directly, inverted or crossed through BASE_CURRENCY, and memoized until replaced"""
+    
+    def setUp(self):
+        fx.clear_rate_cache()
+        fx.set_rate('USD', 'TZS', '2500', date(2026, 1, 1))
+        fx.set_rate('USD', 'KES', '130', date(2026, 1, 1))
+        fx.set_rate('USD', 'TZS', '2600', date(2026, 2, 1))
+    
+    def test_direct_rate_is_the_latest_on_or_before_the_date(self):
+        self.assertEqual(fx.get_rate('USD', 'TZS', date(2026, 1, 31)), Decimal('2500'))
+        self.assertEqual(fx.get_rate('USD', 'TZS', date(2026, 3, 1)), Decimal('2600'))
+        self.assertEqual(fx.convert(2, 'USD', 'TZS', date(2026, 1, 15)), Decimal('5000.00'))
+        with self.assertRaisesMessage(ValueError, 'No exchange rate for USD/TZS on 2025-12-31'):
+            fx.get_rate('USD', 'TZS', date(2025, 12, 31))
+    
+    def test_inverse_rate(self):
+        self.assertEqual(fx.get_rate('TZS', 'USD', date(2026, 1, 15)), Decimal(1) / Decimal('2500'))
+        self.assertEqual(fx.convert(5000, 'TZS', 'USD', date(2026, 1, 15)), Decimal('2.00'))
+    
+    def test_cross_rate_through_base_currency(self):
+        self.assertEqual(fx.get_rate('KES', 'TZS', date(2026, 1, 15)), Decimal(1) / Decimal('130') * Decimal('2500'))
+        self.assertEqual(fx.convert(130, 'KES', 'TZS', date(2026, 1, 15)), Decimal('2500.00'))
+        with self.assertRaises(ValueError):
+            fx.get_rate('KES', 'EUR', date(2026, 1, 15))
+    
+    def test_rates_are_memoized_until_the_cache_is_cleared(self):
+        on_date = date(2026, 1, 15)
+        with self.assertNumQueries(1):
+            fx.get_rate('USD', 'TZS', on_date)
+            fx.get_rate('USD', 'TZS', on_date)
+        
+        # A change that bypasses set_rate() is not seen until the memo is cleared
+        ExchangeRate.objects.filter(quote_currency='TZS', rate_date=date(2026, 1, 1)).update(rate=Decimal('2400'))
+        self.assertEqual(fx.get_rate('USD', 'TZS', on_date), Decimal('2500'))
+        fx.clear_rate_cache()
+        self.assertEqual(fx.get_rate('USD', 'TZS', on_date), Decimal('2400'))
+        
+        fx.set_rate('USD', 'TZS', '2450', date(2026, 1, 10))
+        self.assertEqual(fx.get_rate('USD', 'TZS', on_date), Decimal('2450'))
+    
+    def test_missing_rates_are_not_memoized(self):
+        with self.assertRaises(ValueError):
+            fx.get_rate('USD', 'EUR', date(2026, 1, 15))
+        ExchangeRate.objects.create(base_currency='USD', quote_currency='EUR', rate=Decimal('0.9'), rate_date=date(2026, 1, 1))
+        self.assertEqual(fx.get_rate('USD', 'EUR', date(2026, 1, 15)), Decimal('0.9'))
+    
+    def convert_column(self):
+        return fx.convert_column(
+            [10, Decimal('2.5'), Decimal('5000'), 1],
+            ['USD', 'KES', 'TZS', 'TZS'],
+            [date(2026, 1, 15), date(2026, 1, 15), date(2026, 2, 15), date(2026, 2, 15)],
+            'TZS'
+        )
+    
+    def test_convert_column_without_numpy(self):
+        with mock.patch.object(fx, 'np', None):
+            self.assertEqual(self.convert_column(), [25000.0, 48.08, 5000.0, 1.0])
+    
+    @skipUnless(fx.np, 'NumPy is not installed')
+    def test_convert_column_with_numpy_matches(self):
+        with mock.patch.object(fx, 'np', None):
+            expected = self.convert_column()
+        self.assertEqual(list(self.convert_column()), expected)
+
+
+class IdempotencyKeyTests(TestCase):
+    """A retried request with the same Idempotency-Key is answered from the stored response"""
+    
+    def setUp(self):
+        cache.clear()
+        customer = create_customer()
+        self.wallet = create_wallet(0, customer)
+        self.user = create_user(customer.organization)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/payments/wallets/{self.wallet.pk}/deposit/'
+    
+    def deposit(self, amount, key='deposit-1'):
+        return self.client.post(self.url, {'amount': amount}, format='json', HTTP_IDEMPOTENCY_KEY=key)
+    
+    def test_retry_is_replayed(self):
+        first = self.deposit(50)
+        second = self.deposit(50)
+        cache.clear()
+        third = self.deposit(50)
+        
+        self.assertEqual(first.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', first)
+        for replayed in (second, third):
+            self.assertEqual(replayed.status_code, 200)
+            self.assertEqual(replayed['Idempotent-Replayed'], 'true')
+            self.assertEqual(replayed.data['data']['reference'], first.data['data']['reference'])
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.current_balance, Decimal('50.00'))
+        
+        self.assertEqual(self.deposit(50, key='deposit-2').status_code, 200)
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.current_balance, Decimal('100.00'))
+    
+    def test_different_request_with_the_same_key(self):
+        self.deposit(50)
+        
+        response = self.deposit(60)
+        
+        self.assertEqual(response.status_code, 422)
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.current_balance, Decimal('50.00'))
+    
+    def test_key_in_flight(self):
+        IdempotencyKey.objects.create(
+            user=self.user, scope='wallet_deposit', key='deposit-1', request_hash='in-flight',
+            expires_at=timezone.now() + timedelta(hours=1)
+        )
+        
+        response = self.deposit(50)
+        
+        self.assertEqual(response.status_code, 409)
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.current_balance, Decimal('0.00'))
+    
+    def test_expired_key_is_reused(self):
+        IdempotencyKey.objects.create(
+            user=self.user, scope='wallet_deposit', key='deposit-1', request_hash='old',
+            response_status=200, response_body={}, expires_at=timezone.now()
+        )
+        
+        response = self.deposit(50)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', response)
+    
+    def test_key_is_released_after_a_server_error(self):
+        responses = [503, 201]
+        
+        @api_view(['POST'])
+        @idempotent('test')
+        def view(request):
+            return Response({'success': True}, status=responses.pop(0))
+        
+        def post():
+            request = APIRequestFactory().post('/', {'amount': 1}, format='json', HTTP_IDEMPOTENCY_KEY='retry-1')
+            force_authenticate(request, self.user)
+            return view(request)
+        
+        self.assertEqual(post().status_code, 503)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(post().status_code, 201)
+        self.assertEqual(IdempotencyKey.objects.get().response_status, 201)
+        self.assertEqual(post()['Idempotent-Replayed'], 'true')
+    
+    def test_key_is_released_after_an_exception(self):
+        with mock.patch('apps.payments.views.start_deposit', side_effect=DatabaseError('connection lost')):
+            with self.assertRaises(DatabaseError):
+                self.deposit(50)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        
+        self.assertEqual(self.deposit(50).status_code, 200)
+
+
+class WalletStatementTests(TestCase):
+    """Balances and statements read from snapshots match a full scan of the ledger"""
+    
+    def setUp(self):
+        self.wallet = create_wallet()
+        self.start = period_floor('monthly', timezone.now()) - timedelta(days=40)
+        hours = [0, 5, 24, 30, 47, 24 * 10 + 1, 24 * 40, 24 * 40 + 12, 24 * 55]
+        for i, hour in enumerate(hours):
+            if i % 3 == 2:
+                self.wallet.withdraw(Decimal('7.25'), f'W{i}')
+            else:
+                self.wallet.deposit(Decimal('20.10'), f'D{i}')
+        for transaction, hour in zip(self.wallet.transactions.order_by('transaction_id'), hours):
+            WalletTransaction.objects.filter(pk=transaction.pk).update(created_at=self.start + timedelta(hours=hour))
+        # Failed transactions never count
+        self.wallet.transactions.filter(reference='D4').update(status='failed')
+        
+        self.moments = sorted({
+            moment
+            for hour in hours + list(range(0, 24 * 60, 24 * 5))
+            for moment in (
+                self.start + timedelta(hours=hour) - timedelta(seconds=1),
+                self.start + timedelta(hours=hour),
+                self.start + timedelta(hours=hour, seconds=1),
+            )
+        })
+    
+    def scan(self, start, end):
+        credits = debits = Decimal('0.00')
+        count = 0
+        for transaction in self.wallet.transactions.filter(status='success', created_at__gte=start, created_at__lt=end):
+            if transaction.transaction_type in WalletTransaction.DEBIT_TYPES:
+                debits += transaction.amount
+            else:
+                credits += transaction.amount
+            count += 1
+        return credits, debits, count
+    
+    def scan_balance(self, at):
+        credits, debits, _ = self.scan(self.start - timedelta(days=1), at)
+        return credits - debits
+    
+    def assertMatchesScan(self):
+        for moment in self.moments:
+            self.assertEqual(balance_at(self.wallet.pk, moment), self.scan_balance(moment), moment)
+        
+        for start in self.moments[::6]:
+            for end in self.moments[1::6]:
+                if end <= start:
+                    continue
+                for period in ('daily', 'monthly'):
+                    statement = wallet_statement(self.wallet.pk, start, end, period)
+                    credits, debits, count = self.scan(start, end)
+                    self.assertEqual(
+                        (statement['opening_balance'], statement['closing_balance'],
+                         statement['total_credits'], statement['total_debits'], statement['transaction_count']),
+                        (self.scan_balance(start), self.scan_balance(end), credits, debits, count),
+                        f"{period} statement {start} - {end}"
+                    )
+    
+    def test_without_snapshots(self):
+        self.assertMatchesScan()
+    
+    def test_with_snapshots(self):
+        self.assertEqual(build_wallet_snapshots(self.wallet.pk, 'daily', self.start + timedelta(days=20)), 3)
+        self.assertEqual(build_wallet_snapshots(self.wallet.pk, 'daily'), 2)
+        self.assertGreater(build_wallet_snapshots(self.wallet.pk, 'monthly'), 0)
+        
+        self.assertMatchesScan()
+
+
+class PaymentReferenceTests(TestCase):
+    """References are stored normalized and unique per payment method"""
+    
+    def setUp(self):
+        self.invoice = create_invoice(create_customer(), 10)
+    
+    def create_payment(self, reference, payment_method='mobile_money'):
+        return Payment.objects.create(
+            invoice=self.invoice, amount_paid=Decimal('10.00'),
+            payment_reference=normalize_reference(reference), payment_method=payment_method
+        )
+    
+    def test_normalize_reference(self):
+        self.assertEqual(normalize_reference(' mp 123\tab\n'), 'MP123AB')
+        self.assertEqual(normalize_reference(42), '42')
+        self.assertEqual(normalize_reference(None), '')
+    
+    def test_reference_is_unique_per_payment_method(self):
+        self.create_payment('mp 123')
+        self.create_payment('MP123', payment_method='bank')
+        
+        with self.assertRaises(IntegrityError):
+            self.create_payment(' Mp123 ')
+    
+    def test_find_duplicate_references(self):
+        self.create_payment('MP123')
+        
+        self.assertEqual(
+            find_duplicate_references([('mobile_money', 'mp 123'), ('bank', 'MP123'), ('mobile_money', 'MP124')]),
+            {('mobile_money', 'MP123')}
+        )
+        self.assertEqual(find_duplicate_references([]), set())
+
+
+class PaymentReferenceMigrationTests(TransactionTestCase):
+    """Migration 0012 normalizes existing references and suffixes the duplicates before adding the constraint"""
+    
+    migrate_from = [('payments', '0011_exchange_rates')]
+    migrate_to = [('payments', '0012_payment_reference_uniq')]
+    
+    def setUp(self):
+        self.invoice = create_invoice(create_customer(), 10)
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate(self.migrate_from)
+    
+    def tearDown(self):
+        self.executor.loader.build_graph()
+        self.executor.migrate(self.executor.loader.graph.leaf_nodes())
+    
+    def migrate(self):
+        self.executor.loader.build_graph()
+        self.executor.migrate(self.migrate_to)
+        return self.executor.loader.project_state(self.migrate_to).apps.get_model('payments', 'Payment')
+    
+    def test_references_are_normalized_and_deduplicated(self):
+        Payment = self.executor.loader.project_state(self.migrate_from).apps.get_model('payments', 'Payment')
+        payments = [
+            Payment.objects.create(
+                invoice_id=self.invoice.pk, amount_paid=Decimal('10.00'),
+                payment_reference=reference, payment_method=payment_method
+            ).pk
+            for reference, payment_method in (
+                ('mp 123', 'mobile_money'),
+                ('MP123', 'mobile_money'),
+                ('MP123 ', 'bank'),
+                ('Mp 123', 'mobile_money'),
+                ('X' * 98 + ' y', 'cash'),
+                ('x' * 98 + 'Y', 'cash'),
+            )
+        ]
+        
+        Payment = self.migrate()
+        
+        references = dict(Payment.objects.values_list('pk', 'payment_reference'))
+        self.assertEqual([references[pk] for pk in payments], [
+            'MP123',
+            f'MP123-{payments[1]}',
+            'MP123',
+            f'MP123-{payments[3]}',
+            'X' * 98 + 'Y',
+            ('X' * 98 + 'Y')[:100 - len(f'-{payments[5]}')] + f'-{payments[5]}',
+        ])
+        with self.assertRaises(IntegrityError):
+            Payment.objects.create(
+                invoice_id=self.invoice.pk, amount_paid=Decimal('10.00'),
+                payment_reference='MP123', payment_method='mobile_money'
+            )
+
+
+class KeysetPaginationTests(TestCase):
+    """Cursor pages of the payment list are stable, newest first, with ties broken by payment_id"""
+    
+    def setUp(self):
+        customer = create_customer()
+        invoice = create_invoice(customer, 10)
+        start = timezone.now() - timedelta(hours=1)
+        self.payments = []
+        for i, minutes in enumerate((0, 0, 0, 5, 5, 10, 10)):
+            payment = Payment.objects.create(
+                invoice=invoice, amount_paid=Decimal('10.00'), payment_reference=f'MM-{i}', payment_method='mobile_money'
+            )
+            Payment.objects.filter(pk=payment.pk).update(created_at=start + timedelta(minutes=minutes))
+            self.payments.append(Payment.objects.get(pk=payment.pk))
+        self.client = APIClient()
+        self.client.force_authenticate(create_user(customer.organization))
+    
+    def expected_order(self):
+        return [payment.pk for payment in sorted(self.payments, key=lambda p: (p.created_at, p.pk), reverse=True)]
+    
+    def walk(self, url):
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen += [payment['payment_id'] for payment in response.data['results']]
+            url = response.data['next']
+        return seen
+    
+    def test_pages_cover_every_row_once_in_order(self):
+        self.assertEqual(self.walk('/api/payments/?pagination=cursor&page_size=2'), self.expected_order())
+    
+    def test_new_rows_do_not_shift_later_pages(self):
+        response = self.client.get('/api/payments/?pagination=cursor&page_size=2')
+        first_page = [payment['payment_id'] for payment in response.data['results']]
+        Payment.objects.create(
+            invoice=self.payments[0].invoice, amount_paid=Decimal('10.00'),
+            payment_reference='MM-NEW', payment_method='mobile_money'
+        )
+        
+        self.assertEqual(first_page + self.walk(response.data['next']), self.expected_order())
+    
+    def test_count_is_only_returned_when_asked_for(self):
+        self.assertNotIn('count', self.client.get('/api/payments/?pagination=cursor').data)
+        self.assertEqual(self.client.get('/api/payments/?pagination=cursor&count=exact').data['count'], 7)
+        self.assertEqual(self.client.get('/api/payments/?pagination=cursor&count=estimate').data['count'], 7)
+    
+    def test_cursor_round_trip(self):
+        paginator = KeysetPagination()
+        for payment in self.payments:
+            self.assertEqual(paginator.decode_cursor(paginator.encode_cursor(payment)), (payment.created_at, payment.pk))
+    
+    def test_invalid_cursor(self):
+        def encode(position):
+            return base64.urlsafe_b64encode(position.encode()).decode()
+        
+        cursors = ('not-a-cursor', '%FF', encode('no separator'), encode('yesterday|1'), encode(f'{timezone.now().isoformat()}|x'))
+        for cursor in cursors:
+            response = self.client.get('/api/payments/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+            self.assertEqual(response.data['detail'], 'Invalid cursor')
+
+
+class WalletPayInvoicesTests(TestCase):
+    """The bulk endpoint pays every payable invoice or none of them"""
+    
+    def setUp(self):
+        fx.clear_rate_cache()
+        fx.set_rate('USD', 'TZS', '2500')
+        self.customer = create_customer()
+        self.wallet = create_wallet(100, self.customer)
+        self.client = APIClient()
+        self.client.force_authenticate(create_user(self.customer.organization))
+        self.url = f'/api/payments/wallets/{self.wallet.pk}/pay-invoices/'
+    
+    def create_invoice(self, amount, currency='USD'):
+        invoice = create_invoice(self.customer, amount)
+        Invoice.objects.filter(pk=invoice.pk).update(currency=currency)
+        invoice.refresh_from_db()
+        return invoice
+    
+    def assertNothingPaid(self, *invoices):
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.current_balance, Decimal('100.00'))
+        self.assertFalse(Payment.objects.exists())
+        self.assertEqual(Invoice.objects.filter(pk__in=[invoice.pk for invoice in invoices], status='paid').count(), 0)
+    
+    def test_short_balance_pays_nothing(self):
+        invoices = [self.create_invoice(60), self.create_invoice(50)]
+        
+        response = self.client.post(self.url, {'invoice_ids': [invoice.pk for invoice in invoices]}, format='json')
+        
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['data'], {'required': 110.0, 'available': 100.0, 'shortfall': 10.0})
+        self.assertNothingPaid(*invoices)
+    
+    def test_balance_spent_after_the_check_pays_nothing(self):
+        invoices = [self.create_invoice(60), self.create_invoice(30)]
+        self.wallet.withdraw(20, 'W1')
+        
+        with self.assertRaisesMessage(ValueError, 'Insufficient wallet balance'):
+            settle_invoices_from_wallet(self.wallet, [invoice.pk for invoice in invoices])
+        
+        self.assertFalse(Payment.objects.exists())
+        self.assertEqual(Invoice.objects.filter(status='paid').count(), 0)
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.current_balance, Decimal('80.00'))
+    
+    def test_mixed_currencies(self):
+        shillings = self.create_invoice(50000, 'TZS')
+        dollars = self.create_invoice(30)
+        
+        response = self.client.post(self.url, {'invoice_ids': [shillings.pk, dollars.pk]}, format='json')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['data']['paid_count'], response.data['data']['balance_after']), (2, 50.0))
+        self.assertEqual(
+            dict(WalletTransaction.objects.filter(transaction_type='payment').values_list('invoice_id', 'amount')),
+            {shillings.pk: Decimal('20.00'), dollars.pk: Decimal('30.00')}
+        )
+        self.assertEqual(Payment.objects.get(invoice=shillings).amount_paid, Decimal('50000.00'))
+        self.assertEqual(Transaction.objects.get(payment__invoice=shillings).currency, 'TZS')
+        assert_ledger_chain(self, self.wallet)
+    
+    def test_currency_without_rate_pays_nothing(self):
+        invoices = [self.create_invoice(10), self.create_invoice(1000, 'KES')]
+        
+        response = self.client.post(self.url, {'invoice_ids': [invoice.pk for invoice in invoices]}, format='json')
+        
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('No exchange rate for KES/USD', response.data['error'])
+        self.assertNothingPaid(*invoices)
+    
+    def test_paid_and_unknown_invoices_are_skipped(self):
+        paid = self.create_invoice(40)
+        settle_invoice_from_wallet(self.wallet, paid)
+        by_id = self.create_invoice(30)
+        by_control_number = self.create_invoice(20)
+        
+        response = self.client.post(self.url, {
+            'invoice_ids': [paid.pk, by_id.pk, by_id.pk, 999999],
+            'control_numbers': [by_control_number.control_number, 'CN-UNKNOWN'],
+        }, format='json')
+        
+        self.assertEqual(response.status_code, 200)
+        data = response.data['data']
+        self.assertEqual(
+            (data['paid_count'], data['total_paid'], data['balance_before'], data['balance_after']), (2, 50.0, 60.0, 10.0)
+        )
+        statuses = {result.get('invoice_id', result.get('control_number')): result['status'] for result in data['results']}
+        self.assertEqual(statuses, {
+            'CN-UNKNOWN': 'not_found',
+            paid.pk: 'already_paid',
+            by_id.pk: 'paid',
+            by_control_number.pk: 'paid',
+            999999: 'not_found',
+        })
+        self.assertEqual(Payment.objects.filter(invoice=paid).count(), 1)
+        self.assertEqual(Payment.objects.filter(invoice=by_id).count(), 1)
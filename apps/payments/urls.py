@@ -6,7 +6,16 @@ app_name = 'payments'
 urlpatterns = [
     path('', views.payment_list, name='list'),
     path('<int:pk>/', views.payment_detail, name='detail'),
+    path('<int:pk>/refund/', views.payment_refund, name='refund'),
     path('process/', views.process_payment, name='process'),
+    path('import/', views.import_payment_statement_view, name='import-statement'),
+    path('references/check/', views.check_payment_references, name='check-references'),
+    path('gateway/callback/', views.gateway_callback, name='gateway-callback'),
+    path('gateway/operations/<str:reference>/', views.gateway_operation_detail, name='gateway-operation-detail'),
+    path('reports/revenue/', views.revenue_report_view, name='revenue-report'),
+    path('refunds/bulk/', views.refund_bulk, name='refund-bulk'),
+    path('refunds/batches/<int:batch_id>/', views.refund_batch_detail, name='refund-batch-detail'),
+    path('refunds/batches/<int:batch_id>/resume/', views.refund_batch_resume, name='refund-batch-resume'),
     path('release-orders/<str:release_code>/', views.release_order_detail, name='release-order-detail'),
     path('release-orders/<int:pk>/complete/', views.complete_release_order, name='complete-release-order'),
     
@@ -17,6 +26,12 @@ urlpatterns = [
     path('wallets/<int:pk>/deposit/', views.wallet_deposit, name='wallet-deposit'),
     path('wallets/<int:pk>/withdraw/', views.wallet_withdraw, name='wallet-withdraw'),
     path('wallets/<int:pk>/pay-invoice/', views.wallet_pay_invoice, name='wallet-pay-invoice'),
+    path('wallets/<int:pk>/pay-invoices/', views.wallet_pay_invoices, name='wallet-pay-invoices'),
     path('wallets/<int:pk>/transactions/', views.wallet_transactions, name='wallet-transactions'),
+    path('wallets/<int:pk>/holds/', views.wallet_holds, name='wallet-holds'),
+    path('wallets/<int:pk>/holds/<int:hold_id>/capture/', views.wallet_hold_capture, name='wallet-hold-capture'),
+    path('wallets/<int:pk>/holds/<int:hold_id>/release/', views.wallet_hold_release, name='wallet-hold-release'),
+    path('wallets/<int:pk>/balance/', views.wallet_balance_at, name='wallet-balance-at'),
+    path('wallets/<int:pk>/statement/', views.wallet_statement_view, name='wallet-statement'),
 ]
 
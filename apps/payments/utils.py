@@ -2,9 +2,19 @@
 Wallet utility functions for auto-payment
 """
 from datetime import datetime
+import logging
 import uuid
+from django.db import transaction as db_transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from apps.core.utils import unique_numbers
 from apps.payments.models import Wallet, Payment, Transaction, ReleaseOrder
 from apps.payments.services import PaymentGatewayService
+from apps.payments.fx import convert
+from apps.payments.references import generate_payment_reference
+
+
+logger = logging.getLogger(__name__)
 
 
 def generate_release_code():
@@ -12,6 +22,343 @@ def generate_release_code():
     return f"RO-{datetime.now().strftime('%y%m%d')}-{uuid.uuid4().hex[:6].upper()}"
 
 
+def finalize_payment(payment, user=None, transaction_details=None):
+    """
+    Complete a payment: claim its invoice with a conditional UPDATE (so it
+    can only be paid once), record the Transaction, post it to the ledger
+    and generate the release order. Must run inside a transaction.
+    
+    Returns: (transaction, release_order)
+    Raises: ValueError if the invoice is already paid
+    """
+    from apps.invoices.models import Invoice
+    from apps.ledger.utils import post_transactions
+    
+    now = timezone.now()
+    claimed = Invoice.objects.filter(
+        invoice_id=payment.invoice_id
+    ).exclude(status='paid').update(status='paid', payment_method=payment.payment_method, updated_at=now)
+    if not claimed:
+        raise ValueError("Invoice already paid")
+    
+    if payment.status != 'completed':
+        payment.status = 'completed'
+        payment.processed_by = payment.processed_by or user
+        payment.processed_at = now
+        payment.save(update_fields=['status', 'processed_by', 'processed_at', 'updated_at'])
+    
+    transaction = Transaction.objects.create(
+        payment=payment,
+        transaction_type='cargo_payment',
+        amount=payment.amount_paid,
+        currency=payment.invoice.currency,
+        status='success',
+        reference=payment.payment_reference,
+        created_by=user,
+        transaction_details=transaction_details or {}
+    )
+    post_transactions([(transaction, payment.payment_method)])
+    
+    release_order = ReleaseOrder.objects.create(
+        cargo_id=payment.invoice.cargo_id,
+        payment=payment,
+        release_code=generate_release_code(),
+        status='active',
+        generated_by=user
+    )
+    
+    return transaction, release_order
+
+
+def settle_invoice_from_wallet(wallet, invoice, user=None, transaction_type='payment',
+                               reference_prefix='WLT', description=None):
+    """
+    Pay an invoice from a wallet.
+    
+    The amount is first reserved with a wallet hold, which only locks the
+    wallet row for one short UPDATE. The settlement transaction then claims
+    the invoice with a conditional UPDATE (so it can only be paid once),
+    creates the Payment, Transaction and ReleaseOrder, and captures the hold
+    last, so other debits on the wallet are not blocked by the slower steps.
+    If the settlement fails the hold is released (or left to expire if
+    releasing it fails too) and the settlement error is raised.
+    
+    The hold commits on its own, so this costs a second commit, and a
+    process that dies between the two transactions leaves the funds
+    reserved until the hold expires (WALLET_HOLD_TTL). The capture runs
+    without savepoints of its own; a settlement is 20 queries in total.
+    
+    The wallet is debited the invoice amount converted to the wallet
+    currency at today's rate.
+    
+    Returns: (payment, release_order, wallet_transaction)
+    Raises: ValueError if the invoice is already paid, the balance is
+    insufficient or no exchange rate is known
+    """
+    from apps.invoices.models import Invoice
+    
+    amount = convert(invoice.amount, invoice.currency, wallet.currency)
+    now = timezone.now()
+    description = description or f"Payment for invoice {invoice.control_number}"
+    
+    hold = wallet.authorize_hold(
+        amount, f"INV-{invoice.control_number}", description,
+        invoice=invoice, user=user
+    )
+    
+    try:
+        with db_transaction.atomic():
+            claimed = Invoice.objects.filter(
+                invoice_id=invoice.invoice_id
+            ).exclude(status='paid').update(status='paid', payment_method='wallet', updated_at=now)
+            if not claimed:
+                raise ValueError("Invoice already paid")
+            
+            payment = Payment.objects.create(
+                invoice=invoice,
+                amount_paid=invoice.amount,
+                payment_reference=generate_payment_reference(reference_prefix),
+                payment_method='wallet',
+                status='completed',
+                processed_by=user,
+                processed_at=now
+            )
+            
+            Transaction.objects.create(
+                payment=payment,
+                transaction_type='cargo_payment',
+                amount=invoice.amount,
+                currency=invoice.currency,
+                status='success',
+                reference=payment.payment_reference,
+                created_by=user
+            )
+            
+            release_order = ReleaseOrder.objects.create(
+                cargo_id=invoice.cargo_id,
+                payment=payment,
+                release_code=generate_release_code(),
+                status='active',
+                generated_by=user
+            )
+            
+            wallet_transaction = wallet._capture_hold(
+                hold.hold_id, None, transaction_type, None, payment=payment, invoice=invoice
+            )
+    except Exception:
+        # A failed release must not hide why the settlement failed; the
+        # expired-hold sweeper returns the funds later
+        try:
+            wallet.release_hold(hold.hold_id)
+        except Exception:
+            logger.exception("Releasing hold %s after a failed settlement failed", hold.hold_id)
+        raise
+    
+    invoice.status = 'paid'
+    invoice.payment_method = 'wallet'
+    invoice.updated_at = now
+    
+    return payment, release_order, wallet_transaction
+
+
+def settle_invoices_from_wallet(wallet, invoice_ids, user=None, transaction_type='payment',
+                                reference_prefix='WLT'):
+    """
+    Pay many invoices from one wallet in a single database transaction.
+    
+    The invoices and the wallet are locked once, the total is checked
+    against the balance, and the Payment, WalletTransaction, Transaction and
+    ReleaseOrder rows are written with one bulk INSERT each. Invoices that
+    do not exist or are already paid are skipped and reported. Invoices in
+    another currency are debited at today's rate.
+    
+    Returns: (settled: list of dicts, skipped: dict of invoice_id -> reason,
+              balance_before: Decimal, balance_after: Decimal)
+    Raises: ValueError if the wallet balance does not cover the total or no
+    exchange rate is known
+    """
+    from apps.invoices.models import Invoice
+    
+    invoice_ids = list(dict.fromkeys(invoice_ids))
+    now = timezone.now()
+    
+    with db_transaction.atomic():
+        invoices = list(
+            Invoice.objects.select_for_update()
+            .filter(invoice_id__in=invoice_ids)
+            .only('invoice_id', 'cargo_id', 'control_number', 'amount', 'currency', 'status')
+            .order_by('invoice_id')
+        )
+        found = {invoice.invoice_id for invoice in invoices}
+        skipped = {invoice_id: 'not_found' for invoice_id in invoice_ids if invoice_id not in found}
+        for invoice in invoices:
+            if invoice.status == 'paid':
+                skipped[invoice.invoice_id] = 'already_paid'
+        invoices = [invoice for invoice in invoices if invoice.status != 'paid']
+        
+        balance_before = wallet.lock_balance()
+        if not invoices:
+            return [], skipped, balance_before, balance_before
+        
+        debits = [convert(invoice.amount, invoice.currency, wallet.currency) for invoice in invoices]
+        if balance_before < sum(debits):
+            raise ValueError("Insufficient wallet balance")
+        
+        payments = Payment.objects.bulk_create([
+            Payment(
+                invoice=invoice,
+                amount_paid=invoice.amount,
+                payment_reference=generate_payment_reference(reference_prefix),
+                payment_method='wallet',
+                status='completed',
+                processed_by=user,
+                processed_at=now
+            )
+            for invoice in invoices
+        ])
+        
+        wallet_transactions = wallet.apply_transactions([
+            dict(
+                transaction_type=transaction_type,
+                amount=debit,
+                reference=f"INV-{invoice.control_number}",
+                description=f"Payment for invoice {invoice.control_number}",
+                invoice=invoice,
+                payment=payment
+            )
+            for invoice, payment, debit in zip(invoices, payments, debits)
+        ])
+        
+        Transaction.objects.bulk_create([
+            Transaction(
+                payment=payment,
+                transaction_type='cargo_payment',
+                amount=payment.amount_paid,
+                currency=invoice.currency,
+                status='success',
+                reference=payment.payment_reference,
+                created_by=user
+            )
+            for invoice, payment in zip(invoices, payments)
+        ])
+        
+        release_codes = unique_numbers(len(invoices), generate_release_code, ReleaseOrder.objects, 'release_code')
+        release_orders = ReleaseOrder.objects.bulk_create([
+            ReleaseOrder(
+                cargo_id=invoice.cargo_id,
+                payment=payment,
+                release_code=release_code,
+                status='active',
+                generated_by=user
+            )
+            for invoice, payment, release_code in zip(invoices, payments, release_codes)
+        ])
+        
+        Invoice.objects.filter(
+            invoice_id__in=[invoice.invoice_id for invoice in invoices]
+        ).update(status='paid', payment_method='wallet', updated_at=now)
+    
+    settled = [
+        {
+            'invoice_id': invoice.invoice_id,
+            'control_number': invoice.control_number,
+            'amount': invoice.amount,
+            'payment_id': payment.payment_id,
+            'payment_reference': payment.payment_reference,
+            'release_code': release_order.release_code,
+            'wallet_transaction_id': wallet_transaction.transaction_id,
+        }
+        for invoice, payment, release_order, wallet_transaction
+        in zip(invoices, payments, release_orders, wallet_transactions)
+    ]
+    
+    return settled, skipped, balance_before, wallet_transactions[-1].balance_after
+
+
+UNPAID_INVOICE_STATUSES = ('pending', 'overdue')
+SETTLEMENT_CHUNK_SIZE = 500
+
+
+def settle_pending_invoices(wallet, user=None, invoice_ids=None):
+    """
+    Settle a wallet customer's unpaid invoices (or only those in
+    `invoice_ids`), oldest first, as far as the available balance goes.
+    
+    The wallet is locked, the unpaid invoices are read with one query
+    (covered by the partial invoice_unpaid_cargo_idx index) and every invoice
+    that still fits in the remaining balance is paid in one atomic batch via
+    settle_invoices_from_wallet(). Invoices larger than the remaining balance
+    are skipped so they do not block smaller, newer ones.
+    
+    Returns: (settled: list of dicts, balance_before: Decimal, balance_after: Decimal)
+    """
+    from apps.invoices.models import Invoice
+    
+    with db_transaction.atomic():
+        balance = wallet.lock_balance()
+        available = balance - wallet.held_balance
+        
+        unpaid = Invoice.objects.filter(
+            cargo__customer_id=wallet.customer_id,
+            status__in=UNPAID_INVOICE_STATUSES
+        )
+        if invoice_ids is not None:
+            unpaid = unpaid.filter(invoice_id__in=invoice_ids)
+        unpaid = unpaid.order_by('created_at', 'invoice_id').values_list('invoice_id', 'amount', 'currency')
+        
+        invoice_ids = []
+        for invoice_id, amount, currency in unpaid:
+            amount = convert(amount, currency, wallet.currency)
+            if amount <= available:
+                invoice_ids.append(invoice_id)
+                available -= amount
+        
+        if not invoice_ids:
+            return [], balance, balance
+        
+        settled, _, balance_before, balance_after = settle_invoices_from_wallet(
+            wallet, invoice_ids, user,
+            transaction_type='auto_payment',
+            reference_prefix='WLT-AUTO'
+        )
+    
+    return settled, balance_before, balance_after
+
+
+def settle_all_pending_invoices(user=None, after_wallet_id=0, chunk_size=SETTLEMENT_CHUNK_SIZE):
+    """
+    Run settle_pending_invoices() for every active auto-pay wallet whose
+    customer has unpaid invoices.
+    
+    Wallets are read in wallet_id order, `chunk_size` at a time, and each
+    wallet is settled in its own transaction, so an interrupted run can be
+    resumed from the last reported wallet_id. Yields
+    (last_wallet_id, wallets_processed, invoices_settled) after every chunk.
+    """
+    from apps.invoices.models import Invoice
+    
+    has_unpaid = Invoice.objects.filter(
+        cargo__customer_id=OuterRef('customer_id'),
+        status__in=UNPAID_INVOICE_STATUSES
+    )
+    wallets = Wallet.objects.filter(
+        auto_payment_enabled=True, is_active=True
+    ).filter(Exists(has_unpaid)).order_by('wallet_id')
+    
+    while True:
+        chunk = list(wallets.filter(wallet_id__gt=after_wallet_id)[:chunk_size])
+        if not chunk:
+            return
+        
+        invoices_settled = 0
+        for wallet in chunk:
+            settled, _, _ = settle_pending_invoices(wallet, user)
+            invoices_settled += len(settled)
+        
+        after_wallet_id = chunk[-1].wallet_id
+        yield after_wallet_id, len(chunk), invoices_settled
+
+
 def process_auto_payment(invoice, user=None):
     """
     Process auto-payment from wallet if customer has auto-payment enabled
@@ -34,74 +381,72 @@ def process_auto_payment(invoice, user=None):
         if invoice.status == 'paid':
             return False, "Invoice already paid", {}
         
-        amount = float(invoice.amount)
+        amount = convert(invoice.amount, invoice.currency, wallet.currency)
         
         # Check if wallet has sufficient balance
         if not wallet.has_sufficient_balance(amount):
-            return False, f"Insufficient wallet balance. Required: ${amount}, Available: ${wallet.balance}", {
+            available = wallet.available_balance
+            return False, f"Insufficient wallet balance. Required: ${amount}, Available: ${available}", {
                 'required': float(amount),
-                'available': float(wallet.balance),
-                'shortfall': float(amount - wallet.balance)
+                'available': float(available),
+                'shortfall': float(amount - available)
             }
         
-        # Process payment from wallet
-        balance_before = wallet.balance
-        wallet.pay_invoice(invoice, amount, f"Auto-payment for invoice {invoice.control_number}")
-        
-        # Create payment record
-        payment = Payment.objects.create(
-            invoice=invoice,
-            amount_paid=amount,
-            payment_reference=f"WLT-AUTO-{uuid.uuid4().hex[:8].upper()}",
-            payment_method='wallet',
-            status='completed',
-            processed_by=user,
-            processed_at=datetime.now()
-        )
-        
-        # Update wallet transaction with payment reference
-        transaction = wallet.transactions.filter(
-            invoice=invoice,
-            transaction_type='payment'
-        ).order_by('-created_at').first()
-        if transaction:
-            transaction.payment = payment
-            transaction.transaction_type = 'auto_payment'
-            transaction.save()
-        
-        # Update invoice
-        invoice.status = 'paid'
-        invoice.payment_method = 'wallet'
-        invoice.save()
-        
-        # Create transaction record
-        Transaction.objects.create(
-            payment=payment,
-            transaction_type='cargo_payment',
-            amount=amount,
-            currency='USD',
-            status='success',
-            reference=payment.payment_reference,
-            created_by=user
-        )
-        
-        # Generate release order
-        release_order = ReleaseOrder.objects.create(
-            cargo=invoice.cargo,
-            payment=payment,
-            release_code=generate_release_code(),
-            status='active',
-            generated_by=user
+        # Settle the invoice from the wallet
+        payment, release_order, wallet_transaction = settle_invoice_from_wallet(
+            wallet, invoice, user,
+            transaction_type='auto_payment',
+            reference_prefix='WLT-AUTO',
+            description=f"Auto-payment for invoice {invoice.control_number}"
         )
         
         return True, "Auto-payment processed successfully", {
             'payment_id': payment.payment_id,
             'release_order_id': release_order.release_order_id,
             'release_code': release_order.release_code,
-            'balance_before': float(balance_before),
-            'balance_after': float(wallet.balance)
+            'balance_before': float(wallet_transaction.balance_before),
+            'balance_after': float(wallet_transaction.balance_after)
         }
     
     except Exception as e:
         return False, f"Auto-payment failed: {str(e)}", {}
 
+
+def release_expired_holds(batch_size=1000):
+    """
+    Release holds that expired before being captured or released.
+    
+    Each batch locks up to `batch_size` expired holds (skipping holds that
+    are being captured right now), marks them expired with one UPDATE and
+    returns their funds with one update per wallet. Returns the number of
+    holds released.
+    """
+    from apps.payments.models import WalletHold
+    
+    released = 0
+    now = timezone.now()
+    while True:
+        with db_transaction.atomic():
+            holds = list(
+                WalletHold.objects.select_for_update(skip_locked=True)
+                .filter(status='active', expires_at__lte=now)
+                .order_by('expires_at')
+                .values_list('hold_id', 'wallet_id', 'amount')[:batch_size]
+            )
+            if not holds:
+                return released
+            
+            WalletHold.objects.filter(hold_id__in=[hold_id for hold_id, _, _ in holds]).update(
+                status='expired', released_at=now, updated_at=now
+            )
+            
+            held_by_wallet = {}
+            for _, wallet_id, amount in holds:
+                held_by_wallet[wallet_id] = held_by_wallet.get(wallet_id, 0) + amount
+            shard_counts = dict(
+                Wallet.objects.filter(pk__in=held_by_wallet).values_list('wallet_id', 'balance_shards')
+            )
+            for wallet_id in sorted(held_by_wallet):
+                Wallet.return_held_funds(wallet_id, shard_counts[wallet_id], held_by_wallet[wallet_id])
+        
+        released += len(holds)
@@ -0,0 +1,235 @@
+"""
+Withdrawal velocity limits
+Recent withdrawals are counted per wallet and per user in in-process
+sliding windows of fixed time buckets with running totals, so the rules in
+settings.WALLET_VELOCITY (count and amount per window, single-withdrawal
+spikes) are checked before the debit without querying the database.
+Amounts are counted in BASE_CURRENCY. A wallet or user that is not in
+memory yet (first withdrawal after a restart, or evicted) is rebuilt from
+its settled withdrawals in WalletTransaction, outside the tracker lock.
+Counters are per process: withdrawals made by other processes are only
+seen after a rebuild.
+"""
+import math
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from apps.payments.fx import base_currency, convert
+from apps.payments.models import WalletTransaction
+
+
+WINDOW_BUCKETS = 60
+ZERO = Decimal('0.00')
+
+VELOCITY_DEFAULTS = {
+    'ENABLED': False,
+    'RULES': [],
+    'MAX_SUBJECTS': 10000,
+}
+
+def get_velocity_settings():
+    """Velocity settings merged over the defaults"""
+    return {**VELOCITY_DEFAULTS, **getattr(settings, 'WALLET_VELOCITY', {})}
+
+
+class VelocityLimitExceeded(ValueError):
+    """Raised when a withdrawal breaks a velocity rule"""
+    
+    def __init__(self, message, rule, retry_after=None):
+        super().__init__(message)
+        self.rule = rule
+        self.retry_after = retry_after
+
+
+class SlidingWindow:
+    """
+    Count and amount of the events in the last `window` seconds, to the
+    resolution of one bucket. Each ring slot remembers which bucket it
+    holds and running totals are kept, so adding an event and reading the
+    totals are O(1) amortized: expired buckets are subtracted as time moves on.
+    """
+    __slots__ = ('window', 'width', 'buckets', 'counts', 'amounts', 'count', 'amount', 'head')
+    
+    def __init__(self, window, buckets=WINDOW_BUCKETS):
+        self.window = window
+        self.width = window / buckets
+        self.buckets = buckets
+        self.counts = [0] * buckets
+        self.amounts = [ZERO] * buckets
+        self.count = 0
+        self.amount = ZERO
+        self.head = None
+    
+    def _bucket(self, timestamp):
+        return math.floor(timestamp / self.width)
+    
+    def _advance(self, bucket):
+        """Move the head to `bucket`, dropping the buckets that left the window"""
+        if self.head is not None and bucket <= self.head:
+            return
+        start = bucket - self.buckets + 1 if self.head is None else max(self.head + 1, bucket - self.buckets + 1)
+        for expired in range(start, bucket + 1):
+            slot = expired % self.buckets
+            self.count -= self.counts[slot]
+            self.amount -= self.amounts[slot]
+            self.counts[slot] = 0
+            self.amounts[slot] = ZERO
+        self.head = bucket
+    
+    def add(self, timestamp, amount, count=1):
+        """Add (or, with a negative count and amount, remove) an event; events older than the window are ignored"""
+        bucket = self._bucket(timestamp)
+        self._advance(bucket)
+        if bucket <= self.head - self.buckets:
+            return
+        slot = bucket % self.buckets
+        self.counts[slot] += count
+        self.amounts[slot] += amount
+        self.count += count
+        self.amount += amount
+    
+    def totals(self, timestamp):
+        """Returns: (count, amount) in the window ending at `timestamp`"""
+        self._advance(self._bucket(timestamp))
+        return self.count, self.amount
+    
+    def retry_after(self, timestamp):
+        """Seconds until the oldest event in the window expires"""
+        self._advance(self._bucket(timestamp))
+        for bucket in range(self.head - self.buckets + 1, self.head + 1):
+            if self.counts[bucket % self.buckets]:
+                return max(1, math.ceil((bucket + self.buckets) * self.width - timestamp))
+        return None
+
+
+class VelocityTracker:
+    """
+    Sliding windows for every (scope, id) subject, one per rule window,
+    kept in an LRU of at most MAX_SUBJECTS subjects
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subjects = OrderedDict()
+    
+    def clear(self):
+        with self._lock:
+            self._subjects.clear()
+    
+    def _build(self, scope, subject_id, rules, now):
+        """New windows of a subject, rebuilt from the database"""
+        windows = {rule['window']: SlidingWindow(rule['window']) for rule in rules if rule['scope'] == scope}
+        if windows:
+            self._load(windows, scope, subject_id, now)
+        return windows
+    
+    def _windows(self, keys, loaded, max_subjects):
+        """Windows of every subject, storing the `loaded` ones not in the LRU yet. Call with the lock held."""
+        windows = {}
+        for key in keys:
+            if key in self._subjects:
+                self._subjects.move_to_end(key)
+            else:
+                self._subjects[key] = loaded[key]
+            windows[key[0]] = self._subjects[key]
+        while len(self._subjects) > max_subjects:
+            self._subjects.popitem(last=False)
+        return windows
+    
+    def _load(self, windows, scope, subject_id, now):
+        """Rebuild a subject's windows from its settled withdrawals"""
+        filters = {'wallet_id': subject_id} if scope == 'wallet' else {'created_by_id': subject_id}
+        withdrawals = WalletTransaction.objects.filter(
+            transaction_type='withdrawal', status='success',
+            created_at__gte=now - timedelta(seconds=max(windows)), **filters
+        ).order_by('created_at').values_list('created_at', 'amount', 'wallet__currency')
+        
+        for created_at, amount, currency in withdrawals.iterator():
+            amount = convert(amount, currency, base_currency(), created_at)
+            for window in windows.values():
+                window.add(created_at.timestamp(), amount)
+    
+    def check_and_record(self, wallet, user_id, amount, now=None):
+        """
+        Evaluate every rule for a withdrawal of `amount` (wallet currency)
+        and count it if none is broken. Returns the recorded entry, to pass
+        to release() if the debit does not go through.
+        Raises: VelocityLimitExceeded
+        """
+        config = get_velocity_settings()
+        if not config['ENABLED'] or not config['RULES']:
+            return None
+        
+        now = now or timezone.now()
+        timestamp = now.timestamp()
+        amount = convert(amount, wallet.currency, base_currency(), now)
+        subjects = {'wallet': wallet.wallet_id, 'user': user_id}
+        keys = [(scope, subject_id) for scope, subject_id in subjects.items() if subject_id is not None]
+        
+        loaded = {}
+        while True:
+            with self._lock:
+                missing = [key for key in keys if key not in self._subjects and key not in loaded]
+                if not missing:
+                    windows = self._windows(keys, loaded, config['MAX_SUBJECTS'])
+                    for rule in config['RULES']:
+                        if rule['scope'] in windows:
+                            _evaluate(rule, windows[rule['scope']][rule['window']], timestamp, amount)
+                    
+                    for scope_windows in windows.values():
+                        for window in scope_windows.values():
+                            window.add(timestamp, amount)
+                    return subjects, timestamp, amount
+            
+            # Subjects not in memory are rebuilt without holding the lock, so
+            # withdrawals of other subjects do not wait on the query; if another
+            # thread stored the subject meanwhile, its windows are kept
+            for key in missing:
+                loaded[key] = self._build(*key, config['RULES'], now)
+    
+    def release(self, entry):
+        """Uncount a withdrawal recorded by check_and_record()"""
+        if entry is None:
+            return
+        subjects, timestamp, amount = entry
+        with self._lock:
+            for key in subjects.items():
+                for window in self._subjects.get(key, {}).values():
+                    window.add(timestamp, -amount, count=-1)
+
+
+def _evaluate(rule, window, timestamp, amount):
+    count, total = window.totals(timestamp)
+    scope = rule['scope']
+    
+    if rule.get('max_count') is not None and count + 1 > rule['max_count']:
+        raise VelocityLimitExceeded(
+            f"Too many withdrawals: at most {rule['max_count']} per {scope} every {_describe(rule['window'])}",
+            rule, window.retry_after(timestamp)
+        )
+    if rule.get('max_amount') is not None and total + amount > Decimal(str(rule['max_amount'])):
+        raise VelocityLimitExceeded(
+            f"Withdrawal limit reached: at most {rule['max_amount']} {base_currency()} per {scope} every {_describe(rule['window'])}",
+            rule, window.retry_after(timestamp)
+        )
+    if rule.get('spike_factor') is not None and count >= rule.get('min_history', 3):
+        average = total / count
+        if amount > average * Decimal(str(rule['spike_factor'])):
+            raise VelocityLimitExceeded(
+                f"Withdrawal is more than {rule['spike_factor']}x the {scope}'s average withdrawal and needs review",
+                rule
+            )
+
+
+def _describe(seconds):
+    for unit, size in (('day', 86400), ('hour', 3600), ('minute', 60)):
+        if seconds % size == 0:
+            count = seconds // size
+            return unit if count == 1 else f"{count} {unit}s"
+    return f"{seconds} seconds"
+
+
+withdrawal_velocity = VelocityTracker()
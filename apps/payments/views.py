@@ -2,41 +2,47 @@ from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
-from django.db.models import Q
+from django.conf import settings
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from datetime import datetime
-from apps.payments.models import Payment, Transaction, ReleaseOrder, Wallet, WalletTransaction
-from apps.payments.serializers import PaymentSerializer, TransactionSerializer, ReleaseOrderSerializer, WalletSerializer, WalletTransactionSerializer
-from apps.payments.services import PaymentGatewayService
+from decimal import Decimal
+from apps.core.pagination import StandardResultsSetPagination, get_paginator
+from apps.payments.models import Payment, Transaction, ReleaseOrder, Wallet, WalletTransaction, WalletHold, RefundBatch, GatewayOperation
+from apps.payments.serializers import PaymentSerializer, TransactionSerializer, ReleaseOrderSerializer, WalletSerializer, WalletTransactionSerializer, WalletHoldSerializer, RefundSerializer, RefundBatchSerializer, GatewayOperationSerializer
+from apps.payments.idempotency import idempotent
+from apps.payments.statements import balance_at, wallet_statement
+from apps.payments.fx import convert
+from apps.payments.references import find_duplicate_references, generate_payment_reference, normalize_reference
+from apps.payments.velocity import VelocityLimitExceeded, withdrawal_velocity
+from apps.payments.reports import revenue_report, REPORT_PERIODS
+from apps.payments.refunds import create_refund_batch, process_refund_batch, refund_payment
+from apps.payments.reconciliation import import_payment_statement, STATEMENT_FORMATS
+from apps.payments.utils import finalize_payment, settle_invoice_from_wallet, settle_invoices_from_wallet, settle_pending_invoices
+from apps.payments.confirmations import complete_operation, start_deposit, start_payment, verify_callback_signature
 from apps.cargo.models import Cargo
+import json
 import uuid
 
 
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 20
-    page_size_query_param = 'page_size'
-    max_page_size = 100
-
-
-def generate_release_code():
-    """Generate unique release code"""
-    return f"RO-{datetime.now().strftime('%y%m%d')}-{uuid.uuid4().hex[:6].upper()}"
+MAX_BULK_INVOICES = 1000
+MAX_BULK_REFUNDS = 1000
+MAX_REFERENCE_CHECKS = 1000
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def payment_list(request):
     """List all payments"""
-    payments = Payment.objects.all()
+    payments = Payment.objects.select_related('invoice__cargo__customer')
     
-    paginator = StandardResultsSetPagination()
+    paginator = get_paginator(request)
     result_page = paginator.paginate_queryset(payments, request)
     
     serializer = PaymentSerializer(result_page, many=True)
-    return paginator.get_paginated_response({
-        'count': paginator.page.paginator.count,
-        'results': serializer.data
-    })
+    return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(['GET'])
@@ -44,7 +50,7 @@ def payment_list(request):
 def payment_detail(request, pk):
     """Get payment details"""
     try:
-        payment = Payment.objects.get(payment_id=pk)
+        payment = Payment.objects.select_related('invoice__cargo__customer').get(payment_id=pk)
     except Payment.DoesNotExist:
         return Response({
             'success': False,
@@ -60,13 +66,14 @@ def payment_detail(request, pk):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent('process_payment')
 def process_payment(request):
     """Process a payment"""
     invoice_id = request.data.get('invoice_id')
     control_number = request.data.get('control_number')
     amount_paid = request.data.get('amount_paid')
     payment_method = request.data.get('payment_method', 'mobile_money')
-    payment_reference = request.data.get('payment_reference')
+    payment_reference = normalize_reference(request.data.get('payment_reference'))
     
     if not invoice_id or not control_number or not amount_paid:
         return Response({
@@ -77,7 +84,7 @@ def process_payment(request):
     from apps.invoices.models import Invoice
     
     try:
-        invoice = Invoice.objects.get(invoice_id=invoice_id, control_number=control_number)
+        invoice = Invoice.objects.select_related('cargo__customer').get(invoice_id=invoice_id, control_number=control_number)
     except Invoice.DoesNotExist:
         return Response({
             'success': False,
@@ -90,42 +97,48 @@ def process_payment(request):
             'error': 'Invoice already paid'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    # Create payment
-    payment = Payment.objects.create(
-        invoice=invoice,
-        amount_paid=amount_paid,
-        payment_reference=payment_reference or f"PAY-{uuid.uuid4().hex[:8].upper()}",
-        payment_method=payment_method,
-        status='completed',
-        processed_by=request.user,
-        processed_at=datetime.now()
-    )
-    
-    # Update invoice
-    invoice.status = 'paid'
-    invoice.payment_method = payment_method
-    invoice.save()
-    
-    # Create transaction
-    Transaction.objects.create(
-        payment=payment,
-        transaction_type='cargo_payment',
-        amount=amount_paid,
-        currency='USD',
-        status='success',
-        reference=payment.payment_reference,
-        created_by=request.user,
-        transaction_details=request.data.get('transaction_details', {})
-    )
+    if request.data.get('await_confirmation'):
+        # Recorded as pending until the gateway confirms it
+        try:
+            operation = start_payment(invoice, amount_paid, payment_method, payment_reference, request.user)
+        except ValueError as e:
+            return Response({
+                'success': False,
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'success': True,
+            'message': 'Payment awaiting gateway confirmation',
+            'payment': PaymentSerializer(operation.payment).data,
+            'operation': GatewayOperationSerializer(operation).data
+        }, status=status.HTTP_202_ACCEPTED)
     
-    # Generate release order
-    release_order = ReleaseOrder.objects.create(
-        cargo=invoice.cargo,
-        payment=payment,
-        release_code=generate_release_code(),
-        status='active',
-        generated_by=request.user
-    )
+    try:
+        with db_transaction.atomic():
+            # Create payment
+            payment = Payment.objects.create(
+                invoice=invoice,
+                amount_paid=amount_paid,
+                payment_reference=payment_reference or generate_payment_reference(),
+                payment_method=payment_method,
+                status='completed',
+                processed_by=request.user,
+                processed_at=datetime.now()
+            )
+            
+            # Mark the invoice paid, record and post the transaction, generate release order
+            _, release_order = finalize_payment(payment, request.user, request.data.get('transaction_details', {}))
+    except IntegrityError:
+        return Response({
+            'success': False,
+            'error': 'Payment reference already used'
+        }, status=status.HTTP_409_CONFLICT)
+    except ValueError as e:
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
     
     payment_serializer = PaymentSerializer(payment)
     release_order_serializer = ReleaseOrderSerializer(release_order)
@@ -138,12 +151,75 @@ def process_payment(request):
     }, status=status.HTTP_201_CREATED)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def import_payment_statement_view(request):
+    """Reconcile an uploaded payment statement (CSV or JSON lines)"""
+    statement = request.FILES.get('file')
+    if not statement:
+        return Response({
+            'success': False,
+            'error': 'Statement file is required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    file_format = request.data.get('format') or ('jsonl' if statement.name.endswith(('.jsonl', '.ndjson')) else 'csv')
+    if file_format not in STATEMENT_FORMATS:
+        return Response({
+            'success': False,
+            'error': f"Format must be one of: {', '.join(STATEMENT_FORMATS)}"
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    report = import_payment_statement(
+        statement,
+        file_format=file_format,
+        payment_method=request.data.get('payment_method', 'mobile_money'),
+        user=request.user
+    )
+    
+    return Response({
+        'success': True,
+        'message': f"{report['matched']} of {report['total_lines']} statement line(s) matched",
+        'data': report
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def check_payment_references(request):
+    """Report which of a batch of payment references are already used for a payment method"""
+    references = request.data.get('references') or []
+    payment_method = request.data.get('payment_method', 'mobile_money')
+    
+    if not isinstance(references, list) or not references:
+        return Response({
+            'success': False,
+            'error': 'References are required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if len(references) > MAX_REFERENCE_CHECKS:
+        return Response({
+            'success': False,
+            'error': f'At most {MAX_REFERENCE_CHECKS} references can be checked per request'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    duplicates = find_duplicate_references((payment_method, reference) for reference in references)
+    
+    return Response({
+        'success': True,
+        'data': {
+            'payment_method': payment_method,
+            'checked': len(references),
+            'duplicates': sorted(reference for _, reference in duplicates)
+        }
+    })
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def release_order_detail(request, release_code):
     """Get release order by code"""
     try:
-        release_order = ReleaseOrder.objects.get(release_code=release_code)
+        release_order = ReleaseOrder.objects.select_related('cargo__customer').get(release_code=release_code)
     except ReleaseOrder.DoesNotExist:
         return Response({
             'success': False,
@@ -162,7 +238,7 @@ def release_order_detail(request, release_code):
 def complete_release_order(request, pk):
     """Mark release order as used (cargo collected)"""
     try:
-        release_order = ReleaseOrder.objects.get(release_order_id=pk)
+        release_order = ReleaseOrder.objects.select_related('cargo__customer').get(release_order_id=pk)
     except ReleaseOrder.DoesNotExist:
         return Response({
             'success': False,
@@ -175,25 +251,27 @@ def complete_release_order(request, pk):
             'error': 'Release order already used or expired'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    release_order.status = 'used'
-    release_order.used_at = datetime.now()
-    release_order.save()
+    from apps.cargo.utils import transition_status
     
-    # Update cargo status
-    cargo = release_order.cargo
-    cargo.status = 'delivered'
-    cargo.save()
+    now = timezone.now()
+    with db_transaction.atomic():
+        # Both updates are conditional, so concurrent completions deliver the cargo once
+        used = ReleaseOrder.objects.filter(release_order_id=pk, status='active').update(
+            status='used', used_at=now, updated_at=now
+        )
+        delivered = used and transition_status(
+            release_order.cargo_id, 'arrived', 'delivered', request.user, 'Cargo collected by customer'
+        )
+        if not delivered:
+            db_transaction.set_rollback(True)
     
-    # Create cargo history
-    from apps.cargo.models import CargoHistory
-    CargoHistory.objects.create(
-        cargo=cargo,
-        previous_status='arrived',
-        new_status='delivered',
-        updated_by=request.user,
-        remarks='Cargo collected by customer'
-    )
+    if not delivered:
+        return Response({
+            'success': False,
+            'error': 'Release order already used or expired' if not used else 'Cargo is not awaiting collection'
+        }, status=status.HTTP_409_CONFLICT)
     
+    release_order.refresh_from_db()
     serializer = ReleaseOrderSerializer(release_order)
     return Response({
         'success': True,
@@ -209,7 +287,7 @@ def complete_release_order(request, pk):
 def wallet_list_create(request):
     """List all wallets or create wallet for customer"""
     if request.method == 'GET':
-        wallets = Wallet.objects.all()
+        wallets = Wallet.objects.select_related('customer').prefetch_related('shards')
         
         # Filter by customer
         customer_id = request.query_params.get('customer_id', None)
@@ -220,10 +298,7 @@ def wallet_list_create(request):
         result_page = paginator.paginate_queryset(wallets, request)
         
         serializer = WalletSerializer(result_page, many=True)
-        return paginator.get_paginated_response({
-            'count': paginator.page.paginator.count,
-            'results': serializer.data
-        })
+        return paginator.get_paginated_response(serializer.data)
     
     elif request.method == 'POST':
         # Create wallet for customer
@@ -272,7 +347,7 @@ def wallet_list_create(request):
 def wallet_detail(request, pk):
     """Get wallet details or update wallet settings"""
     try:
-        wallet = Wallet.objects.get(wallet_id=pk)
+        wallet = Wallet.objects.select_related('customer').get(wallet_id=pk)
     except Wallet.DoesNotExist:
         return Response({
             'success': False,
@@ -311,7 +386,7 @@ def wallet_detail(request, pk):
 def wallet_by_customer(request, customer_id):
     """Get wallet by customer ID"""
     try:
-        wallet = Wallet.objects.get(customer_id=customer_id)
+        wallet = Wallet.objects.select_related('customer').get(customer_id=customer_id)
     except Wallet.DoesNotExist:
         return Response({
             'success': False,
@@ -327,10 +402,11 @@ def wallet_by_customer(request, customer_id):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent('wallet_deposit')
 def wallet_deposit(request, pk):
     """Deposit money into wallet"""
     try:
-        wallet = Wallet.objects.get(wallet_id=pk)
+        wallet = Wallet.objects.select_related('customer').get(wallet_id=pk)
     except Wallet.DoesNotExist:
         return Response({
             'success': False,
@@ -357,59 +433,75 @@ def wallet_deposit(request, pk):
             'error': 'Invalid amount'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    # Process payment via gateway (dummy)
-    success, reference, gateway_response = PaymentGatewayService.process_deposit(
-        amount=amount,
-        payment_method=payment_method,
-        customer_phone=wallet.customer.phone_number,
-        customer_email=wallet.customer.email
-    )
-    
-    if not success:
+    # Start the deposit at the gateway; confirmed deposits are credited at once
+    try:
+        operation = start_deposit(wallet, amount, payment_method, description, request.user)
+    except ValueError as e:
         return Response({
             'success': False,
-            'error': 'Payment gateway error'
+            'error': str(e)
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    # Deposit to wallet
-    try:
-        balance_before = wallet.balance
-        wallet.deposit(amount, reference, description)
-        
-        # Update transaction with gateway response
-        transaction = WalletTransaction.objects.filter(
-            wallet=wallet,
-            reference=reference
-        ).first()
-        if transaction:
-            transaction.gateway_response = gateway_response
-            transaction.save()
-        
-        serializer = WalletSerializer(wallet)
+    reference = operation.reference
+    if operation.status == 'pending':
         return Response({
             'success': True,
-            'message': 'Deposit successful',
+            'message': 'Deposit awaiting gateway confirmation',
             'data': {
-                'wallet': serializer.data,
-                'deposit_amount': amount,
-                'balance_before': float(balance_before),
-                'balance_after': float(wallet.balance),
+                'wallet': WalletSerializer(wallet).data,
+                'operation': GatewayOperationSerializer(operation).data,
                 'reference': reference
             }
-        }, status=status.HTTP_200_OK)
-    except ValueError as e:
-        return Response({
-            'success': False,
-            'error': str(e)
-        }, status=status.HTTP_400_BAD_REQUEST)
+        }, status=status.HTTP_202_ACCEPTED)
+    
+    transaction = operation.wallet_transaction
+    wallet.refresh_from_db()
+    response_data = {
+        'deposit_amount': amount,
+        'balance_before': float(transaction.balance_before),
+        'balance_after': float(transaction.balance_after),
+        'reference': reference
+    }
+    
+    # Pay invoices that were waiting for funds
+    if wallet.auto_payment_enabled and wallet.is_active:
+        try:
+            settled, _, _ = settle_pending_invoices(wallet, request.user)
+            response_data['auto_payment'] = {
+                'success': True,
+                'paid_count': len(settled),
+                'total_paid': float(sum(item['amount'] for item in settled)),
+                'invoices': [
+                    {
+                        'invoice_id': item['invoice_id'],
+                        'control_number': item['control_number'],
+                        'amount': float(item['amount']),
+                        'release_code': item['release_code']
+                    }
+                    for item in settled
+                ]
+            }
+        except ValueError as e:
+            response_data['auto_payment'] = {
+                'success': False,
+                'message': f"Auto-payment failed: {str(e)}"
+            }
+    
+    serializer = WalletSerializer(wallet)
+    return Response({
+        'success': True,
+        'message': 'Deposit successful',
+        'data': {'wallet': serializer.data, **response_data}
+    }, status=status.HTTP_200_OK)
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent('wallet_withdraw')
 def wallet_withdraw(request, pk):
     """Withdraw money from wallet"""
     try:
-        wallet = Wallet.objects.get(wallet_id=pk)
+        wallet = Wallet.objects.select_related('customer').get(wallet_id=pk)
     except Wallet.DoesNotExist:
         return Response({
             'success': False,
@@ -435,37 +527,61 @@ def wallet_withdraw(request, pk):
             'error': 'Invalid amount'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    # Withdraw from wallet
     try:
-        balance_before = wallet.balance
-        reference = f"WTH-{uuid.uuid4().hex[:12].upper()}"
-        wallet.withdraw(amount, reference, description)
-        
-        serializer = WalletSerializer(wallet)
+        velocity_entry = withdrawal_velocity.check_and_record(wallet, request.user.pk, Decimal(str(amount)))
+    except VelocityLimitExceeded as e:
+        response = Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_429_TOO_MANY_REQUESTS)
+        if e.retry_after:
+            response['Retry-After'] = str(e.retry_after)
+        return response
+    except ValueError as e:
         return Response({
-            'success': True,
-            'message': 'Withdrawal successful',
-            'data': {
-                'wallet': serializer.data,
-                'withdrawal_amount': amount,
-                'balance_before': float(balance_before),
-                'balance_after': float(wallet.balance),
-                'reference': reference
-            }
-        }, status=status.HTTP_200_OK)
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Withdraw from wallet; a withdrawal that fails for any reason is uncounted
+    try:
+        reference = f"WTH-{uuid.uuid4().hex[:12].upper()}"
+        transaction = wallet.apply_transaction(
+            'withdrawal', amount, reference,
+            description or f"Withdrawal of ${amount}",
+            created_by=request.user
+        )
     except ValueError as e:
+        withdrawal_velocity.release(velocity_entry)
         return Response({
             'success': False,
             'error': str(e)
         }, status=status.HTTP_400_BAD_REQUEST)
+    except Exception:
+        withdrawal_velocity.release(velocity_entry)
+        raise
+    
+    serializer = WalletSerializer(wallet)
+    return Response({
+        'success': True,
+        'message': 'Withdrawal successful',
+        'data': {
+            'wallet': serializer.data,
+            'withdrawal_amount': amount,
+            'balance_before': float(transaction.balance_before),
+            'balance_after': float(transaction.balance_after),
+            'reference': reference
+        }
+    }, status=status.HTTP_200_OK)
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent('wallet_pay_invoice')
 def wallet_pay_invoice(request, pk):
     """Pay invoice from wallet"""
     try:
-        wallet = Wallet.objects.get(wallet_id=pk)
+        wallet = Wallet.objects.select_related('customer').get(wallet_id=pk)
     except Wallet.DoesNotExist:
         return Response({
             'success': False,
@@ -482,7 +598,7 @@ def wallet_pay_invoice(request, pk):
     from apps.invoices.models import Invoice
     
     try:
-        invoice = Invoice.objects.get(invoice_id=invoice_id)
+        invoice = Invoice.objects.select_related('cargo__customer').get(invoice_id=invoice_id)
     except Invoice.DoesNotExist:
         return Response({
             'success': False,
@@ -495,69 +611,31 @@ def wallet_pay_invoice(request, pk):
             'error': 'Invoice already paid'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    amount = float(invoice.amount)
+    try:
+        amount = convert(invoice.amount, invoice.currency, wallet.currency)
+    except ValueError as e:
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
     
     # Check if wallet has sufficient balance
     if not wallet.has_sufficient_balance(amount):
+        available = wallet.available_balance
         return Response({
             'success': False,
             'error': 'Insufficient wallet balance',
             'data': {
                 'required': float(amount),
-                'available': float(wallet.balance),
-                'shortfall': float(amount - wallet.balance)
+                'available': float(available),
+                'shortfall': float(amount - available)
             }
         }, status=status.HTTP_400_BAD_REQUEST)
     
     # Pay invoice from wallet
     try:
-        balance_before = wallet.balance
-        wallet.pay_invoice(invoice, amount)
-        
-        # Create payment record
-        payment = Payment.objects.create(
-            invoice=invoice,
-            amount_paid=amount,
-            payment_reference=f"WLT-{uuid.uuid4().hex[:8].upper()}",
-            payment_method='wallet',
-            status='completed',
-            processed_by=request.user,
-            processed_at=datetime.now()
-        )
-        
-        # Update wallet transaction with payment reference
-        transaction = WalletTransaction.objects.filter(
-            wallet=wallet,
-            invoice=invoice,
-            transaction_type='payment'
-        ).order_by('-created_at').first()
-        if transaction:
-            transaction.payment = payment
-            transaction.save()
-        
-        # Update invoice
-        invoice.status = 'paid'
-        invoice.payment_method = 'wallet'
-        invoice.save()
-        
-        # Create transaction record
-        Transaction.objects.create(
-            payment=payment,
-            transaction_type='cargo_payment',
-            amount=amount,
-            currency='USD',
-            status='success',
-            reference=payment.payment_reference,
-            created_by=request.user
-        )
-        
-        # Generate release order
-        release_order = ReleaseOrder.objects.create(
-            cargo=invoice.cargo,
-            payment=payment,
-            release_code=generate_release_code(),
-            status='active',
-            generated_by=request.user
+        payment, release_order, wallet_transaction = settle_invoice_from_wallet(
+            wallet, invoice, request.user
         )
         
         wallet_serializer = WalletSerializer(wallet)
@@ -571,8 +649,8 @@ def wallet_pay_invoice(request, pk):
                 'wallet': wallet_serializer.data,
                 'payment': payment_serializer.data,
                 'release_order': release_order_serializer.data,
-                'balance_before': float(balance_before),
-                'balance_after': float(wallet.balance)
+                'balance_before': float(wallet_transaction.balance_before),
+                'balance_after': float(wallet_transaction.balance_after)
             }
         }, status=status.HTTP_200_OK)
     except ValueError as e:
@@ -582,31 +660,617 @@ def wallet_pay_invoice(request, pk):
         }, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@idempotent('wallet_pay_invoices')
+def wallet_pay_invoices(request, pk):
+    """Pay many invoices from wallet in one request"""
+    try:
+        wallet = Wallet.objects.select_related('customer').get(wallet_id=pk)
+    except Wallet.DoesNotExist:
+        return Response({
+            'success': False,
+            'error': 'Wallet not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    invoice_ids = request.data.get('invoice_ids') or []
+    control_numbers = request.data.get('control_numbers') or []
+    
+    if not invoice_ids and not control_numbers:
+        return Response({
+            'success': False,
+            'error': 'Invoice IDs or control numbers are required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if len(invoice_ids) + len(control_numbers) > MAX_BULK_INVOICES:
+        return Response({
+            'success': False,
+            'error': f'At most {MAX_BULK_INVOICES} invoices can be paid per request'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    from apps.invoices.models import Invoice
+    
+    results = []
+    try:
+        invoice_ids = [int(invoice_id) for invoice_id in invoice_ids]
+    except (ValueError, TypeError):
+        return Response({
+            'success': False,
+            'error': 'Invalid invoice ID'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if control_numbers:
+        by_control_number = dict(
+            Invoice.objects.filter(control_number__in=control_numbers)
+            .values_list('control_number', 'invoice_id')
+        )
+        for control_number in control_numbers:
+            if control_number in by_control_number:
+                invoice_ids.append(by_control_number[control_number])
+            else:
+                results.append({
+                    'control_number': control_number,
+                    'status': 'not_found'
+                })
+    
+    # Check the total (in the wallet currency) against the balance before taking any locks
+    totals = Invoice.objects.filter(
+        invoice_id__in=invoice_ids
+    ).exclude(status='paid').order_by().values('currency').annotate(total=Sum('amount')).values_list('currency', 'total')
+    try:
+        total = sum(convert(amount, currency, wallet.currency) for currency, amount in totals)
+    except ValueError as e:
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if not wallet.has_sufficient_balance(total):
+        available = wallet.available_balance
+        return Response({
+            'success': False,
+            'error': 'Insufficient wallet balance',
+            'data': {
+                'required': float(total),
+                'available': float(available),
+                'shortfall': float(total - available)
+            }
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        settled, skipped, balance_before, balance_after = settle_invoices_from_wallet(
+            wallet, invoice_ids, request.user
+        )
+    except ValueError as e:
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    for item in settled:
+        results.append({
+            'invoice_id': item['invoice_id'],
+            'control_number': item['control_number'],
+            'status': 'paid',
+            'amount': float(item['amount']),
+            'payment_id': item['payment_id'],
+            'payment_reference': item['payment_reference'],
+            'release_code': item['release_code']
+        })
+    for invoice_id, reason in skipped.items():
+        results.append({
+            'invoice_id': invoice_id,
+            'status': reason
+        })
+    
+    return Response({
+        'success': True,
+        'message': f'{len(settled)} invoice(s) paid successfully from wallet',
+        'data': {
+            'wallet_id': wallet.wallet_id,
+            'paid_count': len(settled),
+            'total_paid': float(sum(item['amount'] for item in settled)),
+            'balance_before': float(balance_before),
+            'balance_after': float(balance_after),
+            'results': results
+        }
+    }, status=status.HTTP_200_OK)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def wallet_transactions(request, pk):
     """Get wallet transaction history"""
     try:
-        wallet = Wallet.objects.get(wallet_id=pk)
+        wallet = Wallet.objects.select_related('customer').get(wallet_id=pk)
     except Wallet.DoesNotExist:
         return Response({
             'success': False,
             'error': 'Wallet not found'
         }, status=status.HTTP_404_NOT_FOUND)
     
-    transactions = WalletTransaction.objects.filter(wallet=wallet).order_by('-created_at')
+    transactions = WalletTransaction.objects.filter(wallet=wallet).select_related('wallet__customer', 'invoice').order_by('-created_at')
     
     # Filter by transaction type
     transaction_type = request.query_params.get('transaction_type', None)
     if transaction_type:
         transactions = transactions.filter(transaction_type=transaction_type)
     
-    paginator = StandardResultsSetPagination()
+    paginator = get_paginator(request)
     result_page = paginator.paginate_queryset(transactions, request)
     
     serializer = WalletTransactionSerializer(result_page, many=True)
-    return paginator.get_paginated_response({
-        'count': paginator.page.paginator.count,
-        'results': serializer.data
+    return paginator.get_paginated_response(serializer.data)
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated])
+def wallet_holds(request, pk):
+    """List wallet holds or reserve funds with a new hold"""
+    try:
+        wallet = Wallet.objects.select_related('customer').get(wallet_id=pk)
+    except Wallet.DoesNotExist:
+        return Response({
+            'success': False,
+            'error': 'Wallet not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    if request.method == 'GET':
+        holds = WalletHold.objects.filter(wallet=wallet).select_related('invoice').order_by('-created_at')
+        
+        # Filter by status
+        hold_status = request.query_params.get('status', None)
+        if hold_status:
+            holds = holds.filter(status=hold_status)
+        
+        paginator = get_paginator(request)
+        result_page = paginator.paginate_queryset(holds, request)
+        
+        serializer = WalletHoldSerializer(result_page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+    
+    amount = request.data.get('amount')
+    invoice_id = request.data.get('invoice_id')
+    expires_in = request.data.get('expires_in')
+    
+    if not amount:
+        return Response({
+            'success': False,
+            'error': 'Amount is required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        amount = float(amount)
+        if amount <= 0:
+            raise ValueError("Amount must be positive")
+        if expires_in is not None:
+            expires_in = int(expires_in)
+            if expires_in <= 0:
+                raise ValueError("Expiry must be positive")
+    except (ValueError, TypeError):
+        return Response({
+            'success': False,
+            'error': 'Invalid amount or expires_in'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    invoice = None
+    if invoice_id:
+        from apps.invoices.models import Invoice
+        try:
+            invoice = Invoice.objects.get(invoice_id=invoice_id)
+        except Invoice.DoesNotExist:
+            return Response({
+                'success': False,
+                'error': 'Invoice not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+    
+    try:
+        hold = wallet.authorize_hold(
+            amount,
+            description=request.data.get('description'),
+            invoice=invoice,
+            expires_in=expires_in,
+            user=request.user
+        )
+    except ValueError as e:
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response({
+        'success': True,
+        'message': 'Funds reserved',
+        'data': {
+            'hold': WalletHoldSerializer(hold).data,
+            'wallet': WalletSerializer(wallet).data
+        }
+    }, status=status.HTTP_201_CREATED)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@idempotent('wallet_hold_capture')
+def wallet_hold_capture(request, pk, hold_id):
+    """Debit a wallet hold, optionally for less than the held amount"""
+    try:
+        wallet = Wallet.objects.select_related('customer').get(wallet_id=pk)
+    except Wallet.DoesNotExist:
+        return Response({
+            'success': False,
+            'error': 'Wallet not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    amount = request.data.get('amount')
+    try:
+        if amount is not None:
+            amount = float(amount)
+            if amount <= 0:
+                raise ValueError("Amount must be positive")
+    except (ValueError, TypeError):
+        return Response({
+            'success': False,
+            'error': 'Invalid amount'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        transaction = wallet.capture_hold(hold_id, amount, description=request.data.get('description'))
+    except ValueError as e:
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response({
+        'success': True,
+        'message': 'Hold captured',
+        'data': {
+            'wallet': WalletSerializer(wallet).data,
+            'transaction': WalletTransactionSerializer(transaction).data
+        }
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def wallet_hold_release(request, pk, hold_id):
+    """Release a wallet hold back to the available balance"""
+    try:
+        wallet = Wallet.objects.select_related('customer').get(wallet_id=pk)
+    except Wallet.DoesNotExist:
+        return Response({
+            'success': False,
+            'error': 'Wallet not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    try:
+        hold = wallet.release_hold(hold_id)
+    except ValueError as e:
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response({
+        'success': True,
+        'message': 'Hold released',
+        'data': {
+            'hold': WalletHoldSerializer(hold).data,
+            'wallet': WalletSerializer(wallet).data
+        }
+    }, status=status.HTTP_200_OK)
+
+
+
+def _parse_moment(value):
+    """Parse an ISO date or datetime query parameter into an aware datetime"""
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            return None
+        moment = datetime.combine(day, datetime.min.time())
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def wallet_balance_at(request, pk):
+    """Get wallet balance at a point in time"""
+    if not Wallet.objects.filter(wallet_id=pk).exists():
+        return Response({
+            'success': False,
+            'error': 'Wallet not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    at = _parse_moment(request.query_params.get('at')) if request.query_params.get('at') else timezone.now()
+    if at is None:
+        return Response({
+            'success': False,
+            'error': 'Invalid date, use YYYY-MM-DD or an ISO 8601 datetime'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response({
+        'success': True,
+        'data': {
+            'wallet_id': pk,
+            'at': at,
+            'balance': float(balance_at(pk, at))
+        }
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def wallet_statement_view(request, pk):
+    """Get wallet statement summary for a period"""
+    if not Wallet.objects.filter(wallet_id=pk).exists():
+        return Response({
+            'success': False,
+            'error': 'Wallet not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    start = _parse_moment(request.query_params.get('start'))
+    end = _parse_moment(request.query_params.get('end'))
+    if not start or not end or start >= end:
+        return Response({
+            'success': False,
+            'error': 'Valid start and end (YYYY-MM-DD or ISO 8601) are required, with start before end'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    statement = wallet_statement(pk, start, end)
+    for field in ('opening_balance', 'closing_balance', 'total_credits', 'total_debits'):
+        statement[field] = float(statement[field])
+    
+    return Response({
+        'success': True,
+        'data': statement
     })
 
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@idempotent('refund_payment')
+def payment_refund(request, pk):
+    """Refund a payment (or retry its failed refund), fully or partially"""
+    try:
+        payment = Payment.objects.get(payment_id=pk)
+    except Payment.DoesNotExist:
+        return Response({
+            'success': False,
+            'error': 'Payment not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    amount = request.data.get('amount')
+    try:
+        if amount is not None:
+            amount = float(amount)
+            if amount <= 0:
+                raise ValueError("Amount must be positive")
+    except (ValueError, TypeError):
+        return Response({
+            'success': False,
+            'error': 'Invalid amount'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        refund = refund_payment(payment, amount, request.data.get('reason'), request.user)
+    except ValueError as e:
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if refund.status != 'completed':
+        return Response({
+            'success': False,
+            'error': f'Refund failed: {refund.error}',
+            'data': RefundSerializer(refund).data
+        }, status=status.HTTP_502_BAD_GATEWAY)
+    
+    return Response({
+        'success': True,
+        'message': 'Payment refunded',
+        'data': RefundSerializer(refund).data
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@idempotent('refund_bulk')
+def refund_bulk(request):
+    """Refund many payments, listed by ID or all completed payments for a container"""
+    payment_ids = request.data.get('payment_ids') or []
+    container_id = request.data.get('container_id')
+    reason = request.data.get('reason')
+    
+    if not reason:
+        return Response({
+            'success': False,
+            'error': 'Reason is required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if not payment_ids and not container_id:
+        return Response({
+            'success': False,
+            'error': 'Payment IDs or container ID are required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        payment_ids = [int(payment_id) for payment_id in payment_ids]
+    except (ValueError, TypeError):
+        return Response({
+            'success': False,
+            'error': 'Invalid payment ID'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if container_id:
+        payment_ids += Payment.objects.filter(
+            invoice__cargo__container_id=container_id, status='completed'
+        ).values_list('payment_id', flat=True)
+    
+    if len(payment_ids) > MAX_BULK_REFUNDS:
+        return Response({
+            'success': False,
+            'error': f'At most {MAX_BULK_REFUNDS} payments can be refunded per request'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    batch, skipped = create_refund_batch(payment_ids, reason, request.user)
+    counts = process_refund_batch(batch)
+    batch = RefundBatch.objects.prefetch_related('refunds__payment').get(batch_id=batch.batch_id)
+    
+    return Response({
+        'success': True,
+        'message': f"{counts['completed']} refund(s) completed, {counts['failed']} failed",
+        'data': {
+            'batch': RefundBatchSerializer(batch).data,
+            'skipped': [
+                {'payment_id': payment_id, 'reason': reason}
+                for payment_id, reason in skipped.items()
+            ]
+        }
+    }, status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def refund_batch_detail(request, batch_id):
+    """Get a refund batch with its refunds"""
+    try:
+        batch = RefundBatch.objects.prefetch_related('refunds__payment').get(batch_id=batch_id)
+    except RefundBatch.DoesNotExist:
+        return Response({
+            'success': False,
+            'error': 'Refund batch not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    return Response({
+        'success': True,
+        'data': RefundBatchSerializer(batch).data
+    })
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def refund_batch_resume(request, batch_id):
+    """Retry the refunds of a batch that are not completed yet"""
+    try:
+        batch = RefundBatch.objects.get(batch_id=batch_id)
+    except RefundBatch.DoesNotExist:
+        return Response({
+            'success': False,
+            'error': 'Refund batch not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    counts = process_refund_batch(batch)
+    batch = RefundBatch.objects.prefetch_related('refunds__payment').get(batch_id=batch_id)
+    
+    return Response({
+        'success': True,
+        'message': f"{counts['completed']} refund(s) completed, {counts['failed']} failed",
+        'data': RefundBatchSerializer(batch).data
+    })
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def gateway_callback(request):
+    """
+    Confirmation from the payment gateway, signed with HMAC-SHA256 of the raw
+    body in the X-Gateway-Signature header. Body: {"reference": ..., "status": "success"|"failed"}
+    """
+    body = request.body
+    if not verify_callback_signature(body, request.headers.get('X-Gateway-Signature')):
+        return Response({
+            'success': False,
+            'error': 'Invalid signature'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    try:
+        payload = json.loads(body)
+        reference = payload['reference']
+        callback_status = payload['status']
+    except (ValueError, TypeError, KeyError):
+        return Response({
+            'success': False,
+            'error': 'Reference and status are required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        operation, changed = complete_operation(normalize_reference(reference), callback_status == 'success', payload)
+    except ValueError as e:
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    return Response({
+        'success': True,
+        'message': 'Operation updated' if changed else f'Operation already {operation.status}',
+        'data': {
+            'reference': operation.reference,
+            'status': operation.status
+        }
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def gateway_operation_detail(request, reference):
+    """Get the status of a deposit or payment awaiting gateway confirmation"""
+    try:
+        operation = GatewayOperation.objects.get(reference=normalize_reference(reference))
+    except GatewayOperation.DoesNotExist:
+        return Response({
+            'success': False,
+            'error': 'Gateway operation not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    return Response({
+        'success': True,
+        'data': GatewayOperationSerializer(operation).data
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def revenue_report_view(request):
+    """Revenue per day or month, converted to one currency"""
+    start = _parse_moment(request.query_params.get('start'))
+    end = _parse_moment(request.query_params.get('end'))
+    if not start or not end or start >= end:
+        return Response({
+            'success': False,
+            'error': 'Valid start and end (YYYY-MM-DD or ISO 8601) are required, with start before end'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    currency = request.query_params.get('currency', settings.BASE_CURRENCY)
+    if currency not in settings.SUPPORTED_CURRENCIES:
+        return Response({
+            'success': False,
+            'error': f"Currency must be one of: {', '.join(settings.SUPPORTED_CURRENCIES)}"
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    period = request.query_params.get('period', 'daily')
+    if period not in REPORT_PERIODS:
+        return Response({
+            'success': False,
+            'error': f"Period must be one of: {', '.join(REPORT_PERIODS)}"
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        report = revenue_report(start, end, currency, period)
+    except ValueError as e:
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response({
+        'success': True,
+        'data': report
+    })
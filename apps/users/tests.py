@@ -0,0 +1,28 @@
+"""
+Users tests
+"""
+from django.test import TestCase
+from rest_framework.test import APIClient
+from apps.core.testing import QueryCountMixin, create_cargo, create_customer, create_user
+
+
+class UserQueryCountTests(QueryCountMixin, TestCase):
+    """User endpoints load the organization and warehouse of each user in the same query"""
+    
+    def setUp(self):
+        self.user = create_user(create_customer().organization)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def test_user_list(self):
+        def add_users():
+            for index in range(5):
+                cargo = create_cargo(create_customer())
+                user = create_user(cargo.warehouse.organization, username=f'clerk{index}')
+                user.warehouse = cargo.warehouse
+                user.save(update_fields=['warehouse'])
+        
+        self.assertConstantQueries('/api/users/', add_users, expected=2)
+    
+    def test_user_detail(self):
+        self.assertEqual(self.count_queries(f'/api/users/{self.user.user_id}/'), 1)
@@ -2,24 +2,18 @@ from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
 from django.db.models import Q
+from apps.core.pagination import StandardResultsSetPagination
 from apps.users.models import User
 from apps.users.serializers import UserSerializer
 
 
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 20
-    page_size_query_param = 'page_size'
-    max_page_size = 100
-
-
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
 def user_list_create(request):
     """List all users or create a new one"""
     if request.method == 'GET':
-        users = User.objects.all()
+        users = User.objects.select_related('organization', 'warehouse')
         
         # Filter by organization
         organization_id = request.query_params.get('organization_id', None)
@@ -49,10 +43,7 @@ def user_list_create(request):
         result_page = paginator.paginate_queryset(users, request)
         
         serializer = UserSerializer(result_page, many=True)
-        return paginator.get_paginated_response({
-            'count': paginator.page.paginator.count,
-            'results': serializer.data
-        })
+        return paginator.get_paginated_response(serializer.data)
     
     elif request.method == 'POST':
         serializer = UserSerializer(data=request.data)
@@ -74,7 +65,7 @@ def user_list_create(request):
 def user_detail(request, pk):
     """Get, update, or delete a user"""
     try:
-        user = User.objects.get(user_id=pk)
+        user = User.objects.select_related('organization', 'warehouse').get(user_id=pk)
     except User.DoesNotExist:
         return Response({
             'success': False,
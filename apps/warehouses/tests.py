@@ -0,0 +1,35 @@
+"""
+Warehouses tests
+"""
+from django.test import TestCase
+from rest_framework.test import APIClient
+from apps.core.testing import QueryCountMixin, create_customer, create_user
+from apps.warehouses.models import Warehouse
+
+
+def create_warehouse(organization, manager=None):
+    return Warehouse.objects.create(
+        warehouse_name='Test Warehouse', location='Dar es Salaam', organization=organization, capacity=100, manager=manager
+    )
+
+
+class WarehouseQueryCountTests(QueryCountMixin, TestCase):
+    """Warehouse endpoints load the organization and manager of each warehouse in the same query"""
+    
+    def setUp(self):
+        self.organization = create_customer().organization
+        self.user = create_user(self.organization)
+        self.warehouse = create_warehouse(self.organization, self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def test_warehouse_list(self):
+        def add_warehouses():
+            for index in range(5):
+                organization = create_customer().organization
+                create_warehouse(organization, create_user(organization, username=f'manager{index}'))
+        
+        self.assertConstantQueries('/api/warehouses/', add_warehouses, expected=2)
+    
+    def test_warehouse_detail(self):
+        self.assertEqual(self.count_queries(f'/api/warehouses/{self.warehouse.warehouse_id}/'), 1)
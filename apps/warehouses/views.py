@@ -2,24 +2,18 @@ from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
 from django.db.models import Q
+from apps.core.pagination import StandardResultsSetPagination
 from apps.warehouses.models import Warehouse
 from apps.warehouses.serializers import WarehouseSerializer
 
 
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 20
-    page_size_query_param = 'page_size'
-    max_page_size = 100
-
-
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
 def warehouse_list_create(request):
     """List all warehouses or create a new one"""
     if request.method == 'GET':
-        warehouses = Warehouse.objects.all()
+        warehouses = Warehouse.objects.select_related('organization', 'manager')
         
         # Filter by organization
         organization_id = request.query_params.get('organization_id', None)
@@ -38,10 +32,7 @@ def warehouse_list_create(request):
         result_page = paginator.paginate_queryset(warehouses, request)
         
         serializer = WarehouseSerializer(result_page, many=True)
-        return paginator.get_paginated_response({
-            'count': paginator.page.paginator.count,
-            'results': serializer.data
-        })
+        return paginator.get_paginated_response(serializer.data)
     
     elif request.method == 'POST':
         serializer = WarehouseSerializer(data=request.data)
@@ -63,7 +54,7 @@ def warehouse_list_create(request):
 def warehouse_detail(request, pk):
     """Get, update, or delete a warehouse"""
     try:
-        warehouse = Warehouse.objects.get(warehouse_id=pk)
+        warehouse = Warehouse.objects.select_related('organization', 'manager').get(warehouse_id=pk)
     except Warehouse.DoesNotExist:
         return Response({
             'success': False,
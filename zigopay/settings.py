@@ -57,6 +57,7 @@ INSTALLED_APPS = [
     'apps.cargo.apps.CargoConfig',
     'apps.invoices.apps.InvoicesConfig',
     'apps.payments.apps.PaymentsConfig',
+    'apps.ledger.apps.LedgerConfig',
     'apps.notifications.apps.NotificationsConfig',
     'apps.whatsapp.apps.WhatsappConfig',
 ]
@@ -101,6 +102,18 @@ DATABASES = {
     }
 }
 
+# Set DATABASE_NAME to use PostgreSQL instead (needs psycopg). The concurrent
+# wallet tests and benchmark_wallet_concurrency need its row locks.
+if os.getenv('DATABASE_NAME'):
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.getenv('DATABASE_NAME'),
+        'USER': os.getenv('DATABASE_USER', 'postgres'),
+        'PASSWORD': os.getenv('DATABASE_PASSWORD', ''),
+        'HOST': os.getenv('DATABASE_HOST', 'localhost'),
+        'PORT': os.getenv('DATABASE_PORT', '5432'),
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -169,6 +182,18 @@ SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Bearer',),
 }
 
+# Cache shared by all workers (idempotency replays, public tracking). Set CACHE_URL
+# to an empty value to use a per-process memory cache for single-process development.
+CACHE_URL = os.getenv('CACHE_URL', 'redis://localhost:6379/1')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_URL,
+    } if CACHE_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 # Celery Configuration
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
@@ -189,6 +214,62 @@ CELERY_BEAT_SCHEDULE = {
     },
 }
 
+# Payment Gateway Configuration
+# BACKEND: 'dummy' (in-process, always succeeds) or 'http' (real provider)
+PAYMENT_GATEWAY = {
+    'BACKEND': os.getenv('PAYMENT_GATEWAY_BACKEND', 'dummy'),
+    'BASE_URL': os.getenv('PAYMENT_GATEWAY_URL', 'http://127.0.0.1:8089'),
+    'API_KEY': os.getenv('PAYMENT_GATEWAY_API_KEY', ''),
+    'CONNECT_TIMEOUT': float(os.getenv('PAYMENT_GATEWAY_CONNECT_TIMEOUT', '3.05')),
+    'READ_TIMEOUT': float(os.getenv('PAYMENT_GATEWAY_READ_TIMEOUT', '10')),
+    'MAX_RETRIES': int(os.getenv('PAYMENT_GATEWAY_MAX_RETRIES', '3')),
+    'BACKOFF_FACTOR': 0.5,
+    'POOL_SIZE': 20,
+    'MAX_CONCURRENCY': 10,  # Concurrent calls for batch verify/refund
+    'WEBHOOK_SECRET': os.getenv('PAYMENT_GATEWAY_WEBHOOK_SECRET', ''),  # Signs gateway callbacks
+    'VERIFY_AFTER': int(os.getenv('PAYMENT_GATEWAY_VERIFY_AFTER', '60')),  # Seconds before polling a pending operation
+    'PENDING_TTL': int(os.getenv('PAYMENT_GATEWAY_PENDING_TTL', 24 * 60 * 60)),  # Seconds before a pending operation fails
+}
+
+# Currencies: ledger postings and reports are kept in BASE_CURRENCY, other
+# currencies are converted with the ExchangeRate table (see apps/payments/fx.py)
+BASE_CURRENCY = os.getenv('BASE_CURRENCY', 'USD')
+SUPPORTED_CURRENCIES = ['USD', 'TZS']
+
+# Idempotency-Key replay window for payment endpoints (seconds)
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+# Public tracking cache (see apps/cargo/tracking.py): seconds a tracking document
+# and an unknown tracking number are cached. Unknown numbers are only cached with a
+# shared cache, since a per-process cache would keep a new cargo "not found" in the
+# other workers.
+TRACKING_CACHE_TTL = int(os.getenv('TRACKING_CACHE_TTL', 5 * 60))
+TRACKING_NOT_FOUND_TTL = int(os.getenv('TRACKING_NOT_FOUND_TTL', 60 if CACHE_URL else 0))
+
+# Default lifetime of wallet holds before the sweeper releases them (seconds)
+WALLET_HOLD_TTL = int(os.getenv('WALLET_HOLD_TTL', 15 * 60))
+
+# Seconds a refund run owns the refunds it claimed; processing refunds older than
+# this are taken over by the next run (see apps/payments/refunds.py)
+REFUND_LEASE_TIMEOUT = int(os.getenv('REFUND_LEASE_TIMEOUT', 10 * 60))
+
+# Velocity rules checked before every wallet withdrawal (see apps/payments/velocity.py),
+# off unless WALLET_VELOCITY_ENABLED=True. The rules below are examples to tune first.
+# `scope` is "wallet" or "user", `window` is in seconds, amounts are in BASE_CURRENCY.
+# A rule sets max_count, max_amount, or spike_factor (reject a withdrawal larger than
+# spike_factor x the average withdrawal in the window, once min_history withdrawals exist).
+WALLET_VELOCITY = {
+    'ENABLED': os.getenv('WALLET_VELOCITY_ENABLED', 'False') == 'True',
+    'RULES': [
+        {'scope': 'wallet', 'window': 60 * 60, 'max_count': 5},
+        {'scope': 'wallet', 'window': 24 * 60 * 60, 'max_amount': 10000},
+        {'scope': 'wallet', 'window': 30 * 24 * 60 * 60, 'spike_factor': 5, 'min_history': 3},
+        {'scope': 'user', 'window': 60 * 60, 'max_count': 100},
+        {'scope': 'user', 'window': 24 * 60 * 60, 'max_amount': 100000},
+    ],
+    'MAX_SUBJECTS': 10000,  # Wallets and users kept in memory per process
+}
+
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
@@ -33,6 +33,7 @@ urlpatterns = [
     path('api/cargo/', include('apps.cargo.urls')),
     path('api/invoices/', include('apps.invoices.urls')),
     path('api/payments/', include('apps.payments.urls')),
+    path('api/ledger/', include('apps.ledger.urls')),
     path('api/notifications/', include('apps.notifications.urls')),
     
     # WhatsApp Bot